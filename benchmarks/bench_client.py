@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+from threading import Thread, RLock
+
+try:
+    from queue import Queue
+except:
+    from Queue import Queue
+
+import requests
+
+from mantaray.api import Session, get_version_number
+from mantaray.scripts.mwa_client import (
+    JobFinished,
+    download_func,
+    notify_func,
+    status_func,
+    submit_jobs,
+)
+
+from mantaray.scripts.preflight import Preflight
+
+from mock_asvo import spawn
+
+
+def start_mock(args):
+    process, url = spawn(
+        "--hold",
+        "--latency", str(args.latency),
+        "--bandwidth", str(args.bandwidth),
+        "--state-delay", str(args.state_delay),
+        "--file-size", str(args.file_size),
+        "--files-per-job", str(args.files_per_job),
+    )
+    host, port = url.split("//")[1].split(":")
+    return process, url, host, port
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "median_ms": statistics.median(values) * 1000.0,
+        "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))] * 1000.0,
+        "max_ms": values[-1] * 1000.0,
+    }
+
+
+def run(args):
+    process, url, host, port = start_mock(args)
+    output_dir = tempfile.mkdtemp(prefix="mwa_client_bench_")
+    params = ("0", host, port, "benchmark")
+    results = {
+        "client_version": get_version_number(),
+        "python": sys.version.split()[0],
+        "config": vars(args),
+    }
+
+    try:
+        session = Session.login(*params)
+
+        # Submission, using the same code path as mwa_client -c
+        jobs = [
+            [
+                "submit_download_job_direct",
+                {
+                    "obs_id": str(1000000000 + i * 8),
+                    "download_type": "vis",
+                    "allow_resubmit": "true",
+                },
+            ]
+            for i in range(args.jobs)
+        ]
+
+        start = time.perf_counter()
+        jobs_list = submit_jobs(session, jobs, Queue(), Queue())
+        elapsed = time.perf_counter() - start
+        results["submit"] = {
+            "jobs": len(jobs_list),
+            "seconds": elapsed,
+            "jobs_per_second": len(jobs_list) / elapsed,
+        }
+
+        start = time.perf_counter()
+        job_count = len(session.get_jobs())
+        results["get_jobs"] = {
+            "jobs": job_count,
+            "seconds": time.perf_counter() - start,
+        }
+
+        # Notifier and download threads, wired up as mwa_client does
+        status_queue = Queue()
+        download_queue = Queue()
+        result_queue = Queue()
+        submit_lock = RLock()
+
+        status_thread = Thread(target=status_func, args=(status_queue, True))
+        status_thread.daemon = True
+        status_thread.start()
+
+        preflight = None
+        if args.preflight:
+            preflight = Preflight(session, output_dir, status_queue)
+
+        notify = session.notify()
+        notify_thread = Thread(
+            target=notify_func,
+            args=(
+                notify,
+                submit_lock,
+                jobs_list,
+                download_queue,
+                result_queue,
+                status_queue,
+                False,
+                None,
+                preflight,
+            ),
+        )
+        notify_thread.daemon = True
+        notify_thread.start()
+
+        threads = []
+        for _ in range(args.workers):
+            t = Thread(
+                target=download_func,
+                args=(
+                    submit_lock,
+                    jobs_list,
+                    download_queue,
+                    result_queue,
+                    status_queue,
+                    session,
+                    output_dir,
+                ),
+            )
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        requests.post(url + "/mock/release").raise_for_status()
+
+        # Woken as each job finishes, as mwa_client is
+        errors = 0
+        while True:
+            with submit_lock:
+                if len(jobs_list) == 0:
+                    break
+            if not isinstance(result_queue.get(), JobFinished):
+                errors += 1
+
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+        for _ in threads:
+            download_queue.put(None)
+        for t in threads:
+            t.join()
+        notify.close()
+        notify_thread.join()
+        status_queue.put(None)
+        status_thread.join()
+
+        while not result_queue.empty():
+            r = result_queue.get()
+            if r and not isinstance(r, JobFinished):
+                errors += 1
+
+        downloaded = sum(
+            os.path.getsize(os.path.join(output_dir, name))
+            for name in os.listdir(output_dir)
+        )
+        gigabytes = downloaded / float(1024 ** 3)
+        results["download"] = {
+            "bytes": downloaded,
+            "seconds": elapsed,
+            "bytes_per_second": downloaded / elapsed,
+            "cpu_seconds": cpu,
+            "cpu_seconds_per_gb": cpu / gigabytes if gigabytes else None,
+            "errors": errors,
+        }
+
+        # Time from the server completing a job to the client asking for it
+        stats = requests.get(url + "/mock/stats").json()
+        latencies = [
+            stats["first_request_at"][job_id] - completed
+            for job_id, completed in stats["completed_at"].items()
+            if job_id in stats["first_request_at"]
+        ]
+        results["notify_to_download"] = percentiles(latencies)
+
+        session.close()
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark job submission, notification and downloads against a"
+            " local mock MWA ASVO server"
+        )
+    )
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4, help="download threads")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the server adds to every API request")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bytes per second per transfer (0 is unlimited)")
+    parser.add_argument("--state-delay", type=float, default=0.01,
+                        help="seconds a job spends in each server state")
+    parser.add_argument("--file-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--files-per-job", type=int, default=1)
+    parser.add_argument("--no-preflight", dest="preflight", action="store_false",
+                        help="do not warm up downloads while jobs are delivering")
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    output = json.dumps(run(args), indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+from mantaray.api import iter_job_records
+
+
+def make_jobs(count, files_per_job):
+    # Job list shaped like a real get_jobs response
+    jobs = []
+    for i in range(count):
+        obs_id = str(1000000000 + i * 8)
+        jobs.append(
+            {
+                "action": "UPDATE",
+                "row": {
+                    "id": i + 1,
+                    "job_type": 0,
+                    "job_state": "completed" if i % 3 else "error",
+                    "error_code": None if i % 3 else 1,
+                    "error_text": None if i % 3 else "Something went wrong",
+                    "job_params": {
+                        "obs_id": obs_id,
+                        "delivery": "acacia",
+                        "avg_time_res": "2",
+                        "avg_freq_res": "40",
+                        "output": "uvfits",
+                        "flag_edge_width": "80",
+                        "allow_resubmit": "false",
+                    },
+                    "product": {
+                        "files": [
+                            {
+                                "type": "acacia",
+                                "url": "https://example.org/mwa/{0}/{0}_{1}.zip"
+                                "?X-Amz-Signature=0123456789abcdef".format(obs_id, n),
+                                "size": 1073741824,
+                                "sha1": "d76f28f1bca9ef57ea4f995da6b14cddee9d839f",
+                            }
+                            for n in range(files_per_job)
+                        ]
+                    },
+                },
+            }
+        )
+    return json.dumps(jobs).encode("utf-8")
+
+
+def chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "seconds": elapsed,
+        "retained_mb": current / 1024.0 / 1024.0,
+        "peak_mb": peak / 1024.0 / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare parsing a get_jobs response into dicts (Session.get_jobs)"
+            " with streaming it into JobRecords (Session.iter_jobs)"
+        )
+    )
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--files-per-job", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=256 * 1024)
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    data = make_jobs(args.jobs, args.files_per_job)
+    results = {
+        "python": sys.version.split()[0],
+        "config": vars(args),
+        "response_mb": len(data) / 1024.0 / 1024.0,
+    }
+
+    # What get_jobs callers keep: the whole list of nested dicts
+    jobs, results["get_jobs"] = measure(lambda: json.loads(b"".join(chunks(data, args.chunk_size))))
+    assert len(jobs) == args.jobs
+    del jobs
+
+    # What iter_jobs callers keep: one compact record per job
+    records, results["iter_jobs"] = measure(
+        lambda: list(iter_job_records(chunks(data, args.chunk_size)))
+    )
+    assert len(records) == args.jobs
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
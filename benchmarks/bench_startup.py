@@ -0,0 +1,104 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Modules which must not be loaded just by importing the CLI
+DEFERRED_MODULES = ["pkg_resources", "websocket"]
+
+IMPORT_CHECK = (
+    "import sys, json\n"
+    "import mantaray.scripts.mwa_client\n"
+    "print(json.dumps([m for m in {0!r} if m in sys.modules]))\n"
+).format(DEFERRED_MODULES)
+
+
+def time_command(cmd, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarise(timings):
+    return {
+        "runs": len(timings),
+        "min_ms": min(timings) * 1000.0,
+        "median_ms": statistics.median(timings) * 1000.0,
+        "max_ms": max(timings) * 1000.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure mwa_client import and startup time"
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--max-import-ms",
+        type=float,
+        default=None,
+        help="exit with an error if the median import time is above this",
+    )
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    python = sys.executable
+
+    results = {
+        "python": sys.version.split()[0],
+        "interpreter": summarise(time_command([python, "-c", "pass"], args.runs)),
+        "import": summarise(
+            time_command([python, "-c", "import mantaray.scripts.mwa_client"], args.runs)
+        ),
+        "help": summarise(
+            time_command([python, "-m", "mantaray.scripts.mwa_client", "-h"], args.runs)
+        ),
+    }
+
+    # get_version_number is called on every login so it must stay cheap
+    from mantaray.api import get_version_number
+
+    start = time.perf_counter()
+    get_version_number()
+    results["version_lookup_ms"] = (time.perf_counter() - start) * 1000.0
+
+    loaded = subprocess.run(
+        [python, "-c", IMPORT_CHECK], stdout=subprocess.PIPE, check=True
+    ).stdout
+    results["deferred_modules_loaded"] = json.loads(loaded)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    failed = False
+    if results["deferred_modules_loaded"]:
+        print(
+            "FAIL: importing mwa_client loaded {0}".format(
+                ", ".join(results["deferred_modules_loaded"])
+            ),
+            file=sys.stderr,
+        )
+        failed = True
+
+    if args.max_import_ms is not None and results["import"]["median_ms"] > args.max_import_ms:
+        print(
+            "FAIL: median import time {0:.1f}ms is above {1:.1f}ms".format(
+                results["import"]["median_ms"], args.max_import_ms
+            ),
+            file=sys.stderr,
+        )
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+from mantaray.scripts.verify import verify_files
+
+
+def make_files(output_dir, count, size):
+    # Job items shaped like get_jobs results, and their files on disk
+    block = os.urandom(1024 * 1024)
+    items = []
+    for i in range(count):
+        file_name = "{0}_{1}.zip".format(1000000000 + i * 8, i + 1)
+        digest = hashlib.sha1()
+        with open(os.path.join(output_dir, file_name), "wb") as f:
+            for _ in range(size // len(block)):
+                f.write(block)
+                digest.update(block)
+
+        items.append(
+            {
+                "row": {
+                    "id": i + 1,
+                    "product": {
+                        "files": [
+                            {
+                                "type": "acacia",
+                                "url": "https://example.org/" + file_name,
+                                "size": size // len(block) * len(block),
+                                "sha1": digest.hexdigest(),
+                            }
+                        ]
+                    },
+                }
+            }
+        )
+    return items
+
+
+def serial_read(items, output_dir):
+    # What an ad hoc script does: hash every file, one after another
+    for item in items:
+        for prod in item["row"]["product"]["files"]:
+            digest = hashlib.sha1()
+            with open(os.path.join(output_dir, os.path.basename(prod["url"])), "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            assert digest.hexdigest() == prod["sha1"]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare hashing downloaded files one at a time with --verify's"
+            " process pool, and with its index of files already verified"
+        )
+    )
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--file-mb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix="mwa_client_verify_")
+    try:
+        items = make_files(output_dir, args.files, args.file_mb * 1024 * 1024)
+        total_mb = args.files * args.file_mb
+        results = {
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+            "config": vars(args),
+        }
+
+        # Files are in the page cache for every run, so this compares CPU use
+        _, elapsed = timed(lambda: serial_read(items, output_dir))
+        results["serial"] = {"seconds": elapsed, "mb_per_second": total_mb / elapsed}
+
+        report, elapsed = timed(lambda: verify_files(items, output_dir, workers=args.workers))
+        assert not report.problems and report.hashed == args.files
+        results["pool"] = {"seconds": elapsed, "mb_per_second": total_mb / elapsed}
+
+        report, elapsed = timed(lambda: verify_files(items, output_dir, workers=args.workers))
+        assert not report.problems and report.cached == args.files
+        results["indexed"] = {"seconds": elapsed}
+
+    finally:
+        shutil.rmtree(output_dir)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,668 @@
+# A self contained stand in for the MWA ASVO server, for benchmarks.
+#
+# It implements login, conversion/download/voltage job submission, get_jobs,
+# cancel_job and the job_results websocket. Jobs move through the usual states
+# every --state-delay seconds and finish with synthetic products served from
+# /files/ with Range support and optional latency and bandwidth limits.
+#
+# Two extra endpoints help benchmarks: POST /mock/release starts jobs submitted
+# with --hold, and GET /mock/stats returns when each job completed and when
+# its files were first requested. Adding ?size=N to a /files/ URL serves a
+# file of that size, which benchmarks/replay.py uses for recorded products.
+# With --zip-members N each product is a real (stored) zip archive of N
+# channel files and a metafits file, for testing partial zip downloads.
+#
+# Point mwa_client at it with:
+#   MWA_ASVO_HOST=127.0.0.1 MWA_ASVO_PORT=8080 MWA_ASVO_HTTPS=0 MWA_ASVO_API_KEY=x
+
+import os
+import sys
+import json
+import time
+import heapq
+import base64
+import socket
+import struct
+import hashlib
+import io
+import argparse
+import subprocess
+import zipfile
+import itertools
+from threading import Thread, Lock, Condition
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# The states a job moves through on its way to completed
+JOB_STATES = [
+    "queued",
+    "staging",
+    "staged",
+    "preprocessing",
+    "delivering",
+    "completed",
+]
+
+JOB_TYPES = {
+    "/api/conversion_job": 0,
+    "/api/download_vis_job": 1,
+    "/api/voltage_job": 3,
+}
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+PATTERN_SIZE = 1024 * 1024
+COOKIE_NAME = "MWA_JOB_COOKIE"
+
+
+def _pattern():
+    # A fixed block of pseudo random bytes. File content is this block repeated
+    block = bytearray()
+    seed = b"mock-asvo"
+    while len(block) < PATTERN_SIZE:
+        seed = hashlib.sha1(seed).digest()
+        block.extend(seed)
+    return bytes(block[:PATTERN_SIZE])
+
+
+PATTERN = _pattern()
+
+
+def file_content(offset, length):
+    # Return length bytes of the synthetic file content starting at offset
+    out = bytearray()
+    while length > 0:
+        start = offset % PATTERN_SIZE
+        chunk = PATTERN[start:start + length]
+        out.extend(chunk)
+        offset += len(chunk)
+        length -= len(chunk)
+    return bytes(out)
+
+
+def build_archive(size, members):
+    # A zip of members channel files sharing size bytes, plus a metafits file
+    buf = io.BytesIO()
+    member_size = size // members
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("mock.metafits", file_content(0, 4096))
+        for i in range(members):
+            zf.writestr(
+                "mock_ch{0:03d}.fits".format(i + 1),
+                file_content(i * member_size, member_size),
+            )
+    return buf.getvalue()
+
+
+class MockAsvo(object):
+    def __init__(
+        self,
+        latency=0.0,
+        bandwidth=0,
+        state_delay=0.1,
+        file_size=1024 * 1024,
+        files_per_job=1,
+        error_every=0,
+        hold=False,
+        zip_members=0,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.state_delay = state_delay
+        self.file_size = file_size
+        self.files_per_job = files_per_job
+        self.error_every = error_every
+        self.hold = hold
+        self.base_url = None
+        self.archive = None
+
+        if zip_members:
+            self.archive = build_archive(file_size, zip_members)
+            self.file_size = len(self.archive)
+
+        self._lock = Lock()
+        self._wakeup = Condition(self._lock)
+        self._jobs = {}
+        self._schedule = []
+        self._next_job_id = itertools.count(1)
+        self._cookies = set()
+        self._clients = []
+        self._sha1 = {}
+        self._held = []
+        self._completed_at = {}
+        self._first_request_at = {}
+        self._running = True
+
+        self._scheduler = Thread(target=self._scheduler_func)
+        self._scheduler.daemon = True
+        self._scheduler.start()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify_all()
+            clients = list(self._clients)
+
+        for client in clients:
+            client.close()
+
+    def login(self):
+        token = base64.b16encode(os.urandom(16)).decode("ascii")
+        with self._lock:
+            self._cookies.add(token)
+        return token
+
+    def authenticated(self, token):
+        with self._lock:
+            return token in self._cookies
+
+    def content(self, offset, length):
+        if self.archive:
+            return self.archive[offset:offset + length]
+        return file_content(offset, length)
+
+    def sha1(self, size):
+        with self._lock:
+            if size in self._sha1:
+                return self._sha1[size]
+
+        digest = hashlib.sha1()
+        offset = 0
+        while offset < size:
+            length = min(PATTERN_SIZE, size - offset)
+            digest.update(self.content(offset, length))
+            offset += length
+
+        with self._lock:
+            self._sha1[size] = digest.hexdigest()
+        return self._sha1[size]
+
+    def submit(self, job_type, params):
+        with self._lock:
+            if params.get("allow_resubmit", "false") != "true":
+                for row in self._jobs.values():
+                    if row["job_type"] == job_type and row["job_params"] == params:
+                        return None, {
+                            "error_code": 2,
+                            "error": "Job already exists",
+                            "job_id": row["id"],
+                        }
+
+            job_id = next(self._next_job_id)
+            row = {
+                "id": job_id,
+                "job_type": job_type,
+                "job_state": JOB_STATES[0],
+                "job_params": params,
+                "error_code": None,
+                "error_text": None,
+                "created": time.time(),
+                "product": {"files": []},
+            }
+            self._jobs[job_id] = row
+
+            if self.hold:
+                self._held.append(job_id)
+            else:
+                self._schedule_locked(job_id)
+
+        self.publish("INSERT", row)
+        return job_id, None
+
+    def cancel(self, job_id):
+        with self._lock:
+            row = self._jobs.get(job_id)
+            if row is None:
+                return False
+            row["job_state"] = "cancelled"
+
+        self.publish("UPDATE", row)
+        return True
+
+    def release(self):
+        # Start processing every job submitted while holding
+        with self._lock:
+            self.hold = False
+            for job_id in self._held:
+                self._schedule_locked(job_id)
+            released = len(self._held)
+            self._held = []
+        return released
+
+    def file_requested(self, job_id):
+        with self._lock:
+            self._first_request_at.setdefault(job_id, time.time())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "completed_at": dict(self._completed_at),
+                "first_request_at": dict(self._first_request_at),
+            }
+
+    def jobs(self):
+        with self._lock:
+            return [{"action": "UPDATE", "row": dict(row)} for row in self._jobs.values()]
+
+    def add_client(self, client):
+        with self._lock:
+            self._clients.append(client)
+
+    def remove_client(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def publish(self, action, row):
+        frame = json.dumps({"action": action, "row": row})
+        with self._lock:
+            clients = list(self._clients)
+
+        for client in clients:
+            if not client.send_text(frame):
+                self.remove_client(client)
+
+    def _schedule_locked(self, job_id):
+        heapq.heappush(self._schedule, (time.monotonic() + self.state_delay, job_id))
+        self._wakeup.notify()
+
+    def _advance_locked(self, job_id):
+        row = self._jobs[job_id]
+        state = row["job_state"]
+
+        if state not in JOB_STATES or state == JOB_STATES[-1]:
+            return False
+
+        next_state = JOB_STATES[JOB_STATES.index(state) + 1]
+
+        if (
+            next_state == "completed"
+            and self.error_every
+            and job_id % self.error_every == 0
+        ):
+            row["job_state"] = "error"
+            row["error_code"] = 1
+            row["error_text"] = "Mock failure for job {0}".format(job_id)
+            return True
+
+        row["job_state"] = next_state
+
+        if next_state == "completed":
+            row["product"] = {"files": self._products_locked(row)}
+            self._completed_at[job_id] = time.time()
+        else:
+            self._schedule_locked(job_id)
+        return True
+
+    def _products_locked(self, row):
+        files = []
+        for i in range(self.files_per_job):
+            name = "{0}_{1}_{2}.zip".format(row["job_params"].get("obs_id"), row["id"], i)
+            files.append(
+                {
+                    "type": "acacia",
+                    "url": "{0}/files/{1}/{2}".format(self.base_url, row["id"], name),
+                    "size": self.file_size,
+                    "sha1": self._sha1.get(self.file_size),
+                }
+            )
+        return files
+
+    def _scheduler_func(self):
+        while True:
+            with self._lock:
+                while self._running and (
+                    not self._schedule or self._schedule[0][0] > time.monotonic()
+                ):
+                    timeout = None
+                    if self._schedule:
+                        timeout = self._schedule[0][0] - time.monotonic()
+                    self._wakeup.wait(timeout)
+
+                if not self._running:
+                    return
+
+                _, job_id = heapq.heappop(self._schedule)
+                changed = self._advance_locked(job_id)
+                row = dict(self._jobs[job_id])
+
+            if changed:
+                self.publish("UPDATE", row)
+
+
+class WebSocketClient(object):
+    def __init__(self, sock):
+        self._sock = sock
+        self._lock = Lock()
+
+    def send_text(self, text):
+        payload = text.encode("utf-8")
+        length = len(payload)
+
+        if length < 126:
+            header = struct.pack("!BB", 0x81, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x81, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, length)
+
+        try:
+            with self._lock:
+                self._sock.sendall(header + payload)
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        try:
+            with self._lock:
+                self._sock.sendall(struct.pack("!BB", 0x88, 0))
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _recv_exact(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self._sock.recv(n - len(data))
+            if not chunk:
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def wait_closed(self):
+        # Discard anything the client sends until it asks to close
+        try:
+            while True:
+                first, second = struct.unpack("!BB", self._recv_exact(2))
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", self._recv_exact(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self._recv_exact(8))[0]
+                if second & 0x80:
+                    self._recv_exact(4)
+                self._recv_exact(length)
+
+                if first & 0x0F == 0x8:
+                    self.close()
+                    return
+        except OSError:
+            return
+
+
+class MockAsvoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this small
+    # responses stall on delayed ACKs and skew the request timings
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def asvo(self):
+        return self.server.asvo
+
+    def _cookie(self):
+        header = self.headers.get("Cookie", "")
+        for part in header.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == COOKIE_NAME:
+                return value
+        return None
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _check_auth(self):
+        if self.asvo.authenticated(self._cookie()):
+            return True
+        self._send_json(401, {"error": "Not logged in"})
+        return False
+
+    def _read_form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        return {k: v[-1] for k, v in parse_qs(body).items()}
+
+    def do_POST(self):
+        if self.asvo.latency:
+            time.sleep(self.asvo.latency)
+
+        path = urlparse(self.path).path
+
+        if path == "/mock/release":
+            self._send_json(200, {"released": self.asvo.release()})
+            return
+
+        if path == "/api/api_login":
+            if not self.headers.get("Authorization"):
+                self._send_json(401, {"error": "No API key"})
+                return
+            token = self.asvo.login()
+            self._send_json(
+                200,
+                {},
+                {"Set-Cookie": "{0}={1}; Path=/".format(COOKIE_NAME, token)},
+            )
+            return
+
+        if path in JOB_TYPES:
+            if not self._check_auth():
+                return
+            params = self._read_form()
+            job_id, error = self.asvo.submit(JOB_TYPES[path], params)
+            if error:
+                self._send_json(400, error)
+            else:
+                self._send_json(200, {"job_id": job_id})
+            return
+
+        self._send_json(404, {"error": "Not found"})
+
+    def do_HEAD(self):
+        self._serve_file(head=True)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+
+        if parsed.path.startswith("/files/"):
+            self.asvo.file_requested(int(parsed.path.split("/")[2]))
+            self._serve_file(head=False)
+            return
+
+        if parsed.path == "/mock/stats":
+            self._send_json(200, self.asvo.stats())
+            return
+
+        if self.asvo.latency:
+            time.sleep(self.asvo.latency)
+
+        if not self._check_auth():
+            return
+
+        if parsed.path == "/api/get_jobs":
+            self._send_json(200, self.asvo.jobs())
+        elif parsed.path == "/api/cancel_job":
+            job_id = int(parse_qs(parsed.query)["job_id"][0])
+            if self.asvo.cancel(job_id):
+                self._send_json(200, {})
+            else:
+                self._send_json(404, {"error": "No such job"})
+        elif parsed.path == "/api/job_results":
+            self._serve_websocket()
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def _serve_websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(
+            hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()
+        ).decode("ascii")
+
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        client = WebSocketClient(self.connection)
+        self.asvo.add_client(client)
+        client.wait_closed()
+        self.asvo.remove_client(client)
+        self.close_connection = True
+
+    def _serve_file(self, head):
+        # ?size=N serves a file of that size instead of --file-size
+        query = parse_qs(urlparse(self.path).query)
+        size = int(query["size"][0]) if "size" in query else self.asvo.file_size
+        start = 0
+        end = size - 1
+        status = 200
+
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            if first:
+                start = int(first)
+                if last:
+                    end = min(int(last), size - 1)
+            else:
+                start = max(0, size - int(last))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{0}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes {0}-{1}/{2}".format(start, end, size)
+            )
+        self.end_headers()
+
+        if head:
+            return
+
+        chunk_size = 256 * 1024
+        began = time.monotonic()
+        sent = 0
+
+        try:
+            while sent < length:
+                n = min(chunk_size, length - sent)
+                self.wfile.write(self.asvo.content(start + sent, n))
+                sent += n
+
+                if self.asvo.bandwidth:
+                    # Throttle to the configured bytes per second
+                    ahead = sent / float(self.asvo.bandwidth) - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except OSError:
+            self.close_connection = True
+
+
+class MockAsvoServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, asvo):
+        super(MockAsvoServer, self).__init__(address, MockAsvoHandler)
+        self.asvo = asvo
+        asvo.base_url = "http://{0}:{1}".format(*self.server_address[:2])
+        # Prime the sha1 cache so products carry their checksum
+        asvo.sha1(asvo.file_size)
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    # Start a mock ASVO in a background thread. Returns the server; use
+    # server.server_address for the bound port and server.shutdown() to stop
+    server = MockAsvoServer((host, port), MockAsvo(**options))
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def spawn(*args):
+    # Run the mock server in a child process (so it does not share the
+    # benchmark's CPU time) on a free port. Returns (process, base_url)
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--port", "0"] + list(args),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    # First line is "Mock ASVO listening on http://host:port"
+    return process, process.stdout.readline().split()[-1]
+
+
+def stop_server(server):
+    server.asvo.stop()
+    server.shutdown()
+    server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock MWA ASVO server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every API request")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bytes per second per transfer (0 is unlimited)")
+    parser.add_argument("--state-delay", type=float, default=0.1,
+                        help="seconds a job spends in each state")
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument("--files-per-job", type=int, default=1)
+    parser.add_argument("--error-every", type=int, default=0,
+                        help="fail every Nth job (0 never fails)")
+    parser.add_argument("--hold", action="store_true",
+                        help="keep jobs queued until POST /mock/release")
+    parser.add_argument("--zip-members", type=int, default=0,
+                        help="serve products as zip files of this many channel files")
+    args = parser.parse_args()
+
+    server = MockAsvoServer(
+        (args.host, args.port),
+        MockAsvo(
+            latency=args.latency,
+            bandwidth=args.bandwidth,
+            state_delay=args.state_delay,
+            file_size=args.file_size,
+            files_per_job=args.files_per_job,
+            error_every=args.error_every,
+            hold=args.hold,
+            zip_members=args.zip_members,
+        ),
+    )
+    print("Mock ASVO listening on {0}".format(server.asvo.base_url))
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.asvo.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
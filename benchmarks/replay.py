@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import shutil
+import cProfile
+import tempfile
+import argparse
+from threading import Thread, RLock
+
+try:
+    from queue import Queue
+except:
+    from Queue import Queue
+
+from mantaray.api import JobRecord, Session
+from mantaray.scripts.mwa_client import (
+    JobFinished,
+    download_func,
+    enqueue_all_ready_to_download_jobs,
+    notify_func,
+    status_func,
+)
+from mantaray.scripts.recording import (
+    RECORD_GET_JOBS,
+    RECORD_JOB,
+    RECORD_JOBS_END,
+    RECORD_NOTIFY,
+)
+
+from mock_asvo import spawn
+
+
+def load_recording(path):
+    notify_frames = []
+    job_lists = []
+    # Jobs of a list recorded from iter_jobs, until its end record
+    jobs = []
+
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == RECORD_NOTIFY:
+                notify_frames.append((record["t"], record["data"]))
+            elif record["type"] == RECORD_GET_JOBS:
+                job_lists.append((record["t"], record["data"]))
+            elif record["type"] == RECORD_JOB:
+                jobs.append(json.loads(record["data"]))
+            elif record["type"] == RECORD_JOBS_END:
+                job_lists.append((record["t"], jobs))
+                jobs = []
+
+    return notify_frames, job_lists
+
+
+def rewrite_item(item, files_url, scale_size):
+    # Point product downloads at the local file server, keeping file names and
+    # (optionally scaled) sizes
+    row = item["row"]
+    product = row.get("product") or {}
+
+    for prod in product.get("files") or []:
+        if prod.get("type") != "acacia":
+            continue
+
+        size = int(int(prod["size"]) * scale_size)
+        prod["size"] = size
+        prod["url"] = "{0}/files/{1}/{2}?size={3}".format(
+            files_url, row["id"], os.path.basename(prod["url"].split("?")[0]), size
+        )
+    return item
+
+
+class ReplayNotify(object):
+    def __init__(self, frames, speed):
+        self._frames = frames
+        self._speed = speed
+        self._index = 0
+        self._closed = False
+        self._start = None
+
+    def close(self):
+        self._closed = True
+
+    def recv(self):
+        if self._closed or self._index >= len(self._frames):
+            return None
+
+        t, frame = self._frames[self._index]
+        self._index += 1
+
+        if self._start is None:
+            self._start = time.monotonic() - t / self._speed if self._speed else 0
+
+        if self._speed:
+            # Keep the recorded gaps between frames, scaled by speed
+            delay = self._start + t / self._speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        return json.loads(frame)
+
+
+class ReplaySession(object):
+    def __init__(self, session, job_lists):
+        self._session = session
+        self._job_lists = job_lists
+        self._index = 0
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def get_jobs(self):
+        # Each call returns the next recorded response, then the last one again
+        if not self._job_lists:
+            return []
+        data = self._job_lists[min(self._index, len(self._job_lists) - 1)]
+        self._index += 1
+        return data
+
+    def iter_jobs(self):
+        return iter([JobRecord.from_item(item) for item in self.get_jobs()])
+
+
+def drain_func(submit_lock, submitted_jobs, download_queue):
+    # Stand in for download_func with --no-download
+    while True:
+        item = download_queue.get()
+        if not item:
+            break
+        job_id = int(item["row"]["id"])
+        with submit_lock:
+            if job_id in submitted_jobs:
+                submitted_jobs.remove(job_id)
+
+
+def profiled(target, profile, timing):
+    def run(*args):
+        start = time.thread_time()
+        if profile:
+            profile.runcall(target, *args)
+        else:
+            target(*args)
+        timing["cpu_seconds"] = time.thread_time() - start
+
+    return run
+
+
+def replay(args):
+    notify_frames, job_lists = load_recording(args.recording)
+
+    process, files_url = spawn()
+    host, port = files_url.split("//")[1].split(":")
+    output_dir = tempfile.mkdtemp(prefix="mwa_client_replay_")
+    profile = cProfile.Profile() if args.cprofile else None
+    notify_timing = {}
+
+    # Do the rewriting up front so it is not counted in the replay
+    frames = [
+        (t, json.dumps(rewrite_item(json.loads(frame), files_url, args.scale_size)))
+        for t, frame in notify_frames
+    ]
+    job_lists = [
+        [rewrite_item(item, files_url, args.scale_size) for item in data or []]
+        for _, data in job_lists
+    ]
+
+    status_queue = Queue()
+    download_queue = Queue()
+    result_queue = Queue()
+    submit_lock = RLock()
+
+    try:
+        session = ReplaySession(Session.login("0", host, port, "replay"), job_lists)
+
+        status_thread = Thread(target=status_func, args=(status_queue, not args.verbose))
+        status_thread.daemon = True
+        status_thread.start()
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+
+        if args.mode == "notify":
+            # Track every job seen, as if this process had submitted them all
+            jobs_list = []
+            seen = set()
+            for _, frame in frames:
+                job_id = int(json.loads(frame)["row"]["id"])
+                if job_id not in seen:
+                    seen.add(job_id)
+                    jobs_list.append(job_id)
+
+            notify_thread = Thread(
+                target=profiled(notify_func, profile, notify_timing),
+                args=(
+                    ReplayNotify(frames, args.speed),
+                    submit_lock,
+                    jobs_list,
+                    download_queue,
+                    result_queue,
+                    status_queue,
+                    args.verbose,
+                ),
+            )
+            notify_thread.daemon = True
+            notify_thread.start()
+        else:
+            jobs_list = enqueue_all_ready_to_download_jobs(
+                session, download_queue, status_queue, args.verbose
+            )
+
+        threads = []
+        for _ in range(args.workers):
+            if args.no_download:
+                t = Thread(target=drain_func, args=(submit_lock, jobs_list, download_queue))
+            else:
+                t = Thread(
+                    target=download_func,
+                    args=(
+                        submit_lock,
+                        jobs_list,
+                        download_queue,
+                        result_queue,
+                        status_queue,
+                        session,
+                        output_dir,
+                    ),
+                )
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        if args.mode == "notify":
+            notify_thread.join()
+
+        # Let the workers finish whatever is queued, then stop them
+        for _ in threads:
+            download_queue.put(None)
+        for t in threads:
+            t.join()
+
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+        status_queue.put(None)
+        status_thread.join()
+        session.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    errors = 0
+    while not result_queue.empty():
+        r = result_queue.get()
+        if r and not isinstance(r, JobFinished):
+            errors += 1
+
+    downloaded = sum(
+        os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+    )
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    if profile:
+        profile.dump_stats(args.cprofile)
+
+    return {
+        "recording": args.recording,
+        "mode": args.mode,
+        "speed": args.speed,
+        "notify_frames": len(frames),
+        "job_lists": len(job_lists),
+        "seconds": elapsed,
+        "frames_per_second": len(frames) / elapsed if elapsed else None,
+        "cpu_seconds": cpu,
+        "notify_cpu_seconds": notify_timing.get("cpu_seconds"),
+        "jobs_still_tracked": len(jobs_list),
+        "downloaded_bytes": downloaded,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Replay a recording made with mwa_client --record through the"
+            " client's notifier and download pipeline, against a local file"
+            " server"
+        )
+    )
+    parser.add_argument("recording", help="file written by mwa_client --record")
+    parser.add_argument(
+        "--mode",
+        choices=["notify", "download-all"],
+        default="notify",
+        help=(
+            "notify: feed the notifier frames to notify_func (default)."
+            " download-all: replay the recorded job list through -w all"
+        ),
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="1 replays at the recorded pace, 10 ten times faster; 0 (the default) is as fast as possible",
+    )
+    parser.add_argument(
+        "--scale-size",
+        type=float,
+        default=1.0,
+        help="multiply product sizes by this, e.g. 0.001 to replay large products quickly",
+    )
+    parser.add_argument("--no-download", action="store_true",
+                        help="drop completed jobs instead of downloading them")
+    parser.add_argument("--workers", type=int, default=4, help="download threads")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="save a cProfile of the notifier thread to FILE")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print the status messages")
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    output = json.dumps(replay(args), indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,4 @@
-from .api import *
\ No newline at end of file
+from .api import *
+from .client import *
+from .jobs import *
+from .validate import *
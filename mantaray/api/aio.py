@@ -0,0 +1,251 @@
+import json
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .api import get_api_version_number
+
+__all__ = ["AsyncHTTPError", "AsyncNotify", "AsyncSession"]
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError(
+            "The asyncio API requires aiohttp. Install it with: pip install"
+            " mantaray-client[async]"
+        )
+
+
+def _new_client_session():
+    # unsafe=True lets the cookie jar keep cookies for IP address hosts
+    return aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+
+
+async def _check_response(r):
+    if r.status >= 400:
+        raise AsyncHTTPError(r.status, await r.text())
+
+
+async def _login(session, protocol, host, port, api_key, verify):
+    url = "{0}://{1}:{2}/api/api_login".format(protocol, host, port)
+    async with session.post(
+        url,
+        auth=aiohttp.BasicAuth(get_api_version_number(), api_key),
+        ssl=None if verify else False,
+    ) as r:
+        await _check_response(r)
+
+
+class AsyncHTTPError(Exception):
+    def __init__(self, status_code, text):
+        super(AsyncHTTPError, self).__init__(
+            "{0} error: {1}".format(status_code, text)
+        )
+        self._status_code = status_code
+        self._text = text
+
+    @property
+    def status_code(self):
+        return self._status_code
+
+    @property
+    def text(self):
+        return self._text
+
+
+class AsyncNotify(object):
+
+    def __init__(self, session, ws, owns_session=True):
+        self._session = session
+        self._ws = ws
+        self._owns_session = owns_session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, tb):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.recv()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+    async def close(self):
+        await self._ws.close()
+        if self._owns_session:
+            await self._session.close()
+
+    async def recv(self):
+        msg = await self._ws.receive()
+        if msg.type != aiohttp.WSMsgType.TEXT or not msg.data:
+            return None
+        return json.loads(msg.data)
+
+    @classmethod
+    async def connect(cls, session, https, host, port, verify=False, owns_session=False):
+        # Open the job_results websocket using an already logged in session
+        websocket = 'wss' if https == '1' else 'ws'
+        ws_url = "{0}://{1}:{2}/api/job_results".format(websocket, host, port)
+        ws = await session.ws_connect(ws_url, ssl=None if verify else False)
+        return cls(session, ws, owns_session=owns_session)
+
+    @classmethod
+    async def login(cls,
+                    https,
+                    host,
+                    port,
+                    api_key,
+                    verify=False):
+        _require_aiohttp()
+
+        session = _new_client_session()
+        protocol = 'https' if https == '1' else 'http'
+
+        try:
+            await _login(session, protocol, host, port, api_key, verify)
+            return await cls.connect(session, https, host, port, verify, owns_session=True)
+        except BaseException:
+            await session.close()
+            raise
+
+
+class AsyncSession(object):
+
+    def __init__(self,
+                 https,
+                 host,
+                 port,
+                 session,
+                 verify):
+
+        self.https = https
+        self.protocol = 'https' if https == '1' else 'http'
+        self.websocket = 'wss' if https == '1' else 'ws'
+        self.host = host
+        self.port = port
+        self.session = session
+        self.verify = verify
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, tb):
+        await self.close()
+
+    async def close(self):
+        await self.session.close()
+
+    @property
+    def _ssl(self):
+        return None if self.verify else False
+
+    @classmethod
+    async def login(cls,
+                    https,
+                    host,
+                    port,
+                    api_key,
+                    verify=False):
+        _require_aiohttp()
+
+        session = _new_client_session()
+        protocol = 'https' if https == '1' else 'http'
+
+        try:
+            await _login(session, protocol, host, port, api_key, verify)
+        except BaseException:
+            await session.close()
+            raise
+
+        return cls(https, host, port, session, verify=verify)
+
+    async def notify(self):
+        # Open a notifier which shares this session's login
+        return await AsyncNotify.connect(
+            self.session, self.https, self.host, self.port, self.verify
+        )
+
+    async def _post_job(self, endpoint, parameters):
+        url = "{0}://{1}:{2}/api/{3}".format(self.protocol, self.host, self.port, endpoint)
+        async with self.session.post(url,
+                                     data=parameters,
+                                     ssl=self._ssl) as r:
+            await _check_response(r)
+            return await r.json(content_type=None)
+
+    async def submit_conversion_job(self,
+                                    obs_id,
+                                    time_res,
+                                    freq_res,
+                                    edge_width,
+                                    conversion,
+                                    calibrate,
+                                    flags=[]):
+        data = {'obs_id': obs_id,
+                'timeres': time_res,
+                'freqres': freq_res,
+                'edgewidth': edge_width,
+                'conversion': conversion,
+                'calibrate': calibrate}
+        data.update(dict.fromkeys(flags, 1))
+        return await self.submit_conversion_job_direct(data)
+
+    async def submit_conversion_job_direct(self, parameters):
+        return await self._post_job("conversion_job", parameters)
+
+    async def submit_download_job(self,
+                                  obs_id,
+                                  download_type):
+        data = {'obs_id': obs_id,
+                'download_type': download_type}
+        return await self.submit_download_job_direct(data)
+
+    async def submit_download_job_direct(self, parameters):
+        return await self._post_job("download_vis_job", parameters)
+
+    async def submit_voltage_job_direct(self, parameters):
+        return await self._post_job("voltage_job", parameters)
+
+    async def get_jobs(self):
+        url = "{0}://{1}:{2}/api/get_jobs".format(self.protocol, self.host, self.port)
+        async with self.session.get(url, ssl=self._ssl) as r:
+            await _check_response(r)
+            return await r.json(content_type=None)
+
+    async def cancel_job(self, job_id):
+        url = "{0}://{1}:{2}/api/cancel_job".format(self.protocol, self.host, self.port)
+        async with self.session.get(url,
+                                    params={'job_id': str(job_id)},
+                                    ssl=self._ssl) as r:
+            await _check_response(r)
+
+    async def download_file_product(self,
+                                    job_id,
+                                    url,
+                                    output_path,
+                                    chunk_size=1024 * 1024):
+
+        # File writes go to the default executor so that other coroutines
+        # keep running while a large file is written
+        loop = asyncio.get_running_loop()
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=10)
+        async with self.session.get(url, timeout=timeout, ssl=self._ssl) as r:
+            await _check_response(r)
+
+            f = await loop.run_in_executor(None, open, output_path, 'wb')
+            try:
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    await loop.run_in_executor(None, f.write, chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+
+        return output_path
+
@@ -1,7 +1,12 @@
 import os
 import ssl
 import json
+import stat
+import hashlib
+import tempfile
 import requests
+from threading import Lock
+from functools import lru_cache
 from urllib.request import urlretrieve
 
 try:
@@ -9,32 +14,130 @@ try:
 except:
     from urllib import urlencode
 
-from websocket import create_connection, WebSocketConnectionClosedException, WebSocketTimeoutException
 from requests.auth import HTTPBasicAuth
-import pkg_resources  # part of setuptools
+
+from .jobs import iter_job_records
+
+# websocket is imported by Notify when it is first used, so modes which never
+# open the notifier do not pay for it
+
+COOKIE_NAME = "MWA_JOB_COOKIE"
+
+# Responses which mean the server no longer accepts our cookie
+AUTH_FAILED = (401, 403)
+
+# Connections kept open to each product host, enough for mwa_client's
+# download threads and the preflight checks alongside them
+DOWNLOAD_POOL_SIZE = 8
+
+# Added to the name of a file while it is being downloaded
+PARTIAL_SUFFIX = ".part"
 
 
 def get_api_version_number():
     # This is what we send to the server when we confirm version compatibility.
-    version = pkg_resources.require("mantaray-client")[0].version  # format major.minor.revision
+    version = get_version_number()  # format major.minor.revision
 
     version_parts = version.split(".")
     return "mantaray-clientv{0}.{1}".format(version_parts[0], version_parts[1])
 
 
+@lru_cache(maxsize=None)
 def get_version_number():
-    return pkg_resources.require("mantaray-client")[0].version
+    # importlib.metadata reads just this distribution's metadata, unlike
+    # pkg_resources which scans every installed distribution on import
+    from importlib.metadata import version
+
+    return version("mantaray-client")
 
 
 def get_pretty_version_string():
     return "manta-ray-client version {0}".format(get_version_number())
 
 
+class DownloadCancelled(Exception):
+    # Raised by download_file_product when told to stop. The partial file is
+    # left where it is, to be carried on from next time
+    pass
+
+
+class CookieCache(object):
+    # Keeps the MWA_JOB_COOKIE for each server and API key on disk, so that
+    # later runs can skip logging in. The file is only readable by its owner,
+    # and is ignored if anyone else can read it
+    def __init__(self, path=None):
+        if path is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+                os.path.expanduser("~"), ".cache"
+            )
+            path = os.path.join(cache_home, "mwa_client", "cookies.json")
+        self.path = path
+        self._lock = Lock()
+
+    @staticmethod
+    def key(base_url, api_key):
+        # The API key itself is never written out
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        return "{0} {1}".format(base_url, digest)
+
+    def _read(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return {}
+
+        with os.fdopen(fd) as f:
+            st = os.fstat(f.fileno())
+            if st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                return {}
+            if hasattr(os, "getuid") and st.st_uid != os.getuid():
+                return {}
+            try:
+                cookies = json.load(f)
+            except ValueError:
+                return {}
+
+        return cookies if isinstance(cookies, dict) else {}
+
+    def _write(self, cookies):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # mkstemp creates the file readable only by us, and replacing the
+        # cache in one step means readers never see half of it
+        fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=".cookies.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cookies, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def load(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def store(self, key, cookie):
+        with self._lock:
+            cookies = self._read()
+            cookies[key] = cookie
+            self._write(cookies)
+
+    def clear(self, key):
+        with self._lock:
+            cookies = self._read()
+            if cookies.pop(key, None) is not None:
+                self._write(cookies)
+
+
 class Notify(object):
 
-    def __init__(self, session, ws):
+    def __init__(self, session, ws, owns_session=True):
         self._session = session
         self._ws = ws
+        self._owns_session = owns_session
 
     def __enter__(self):
         return self
@@ -44,16 +147,55 @@ class Notify(object):
 
     def close(self):
         self._ws.close()
-        self._session.close()
+        if self._owns_session:
+            self._session.close()
 
     def recv(self):
+        frame = self.recv_frame()
+        if not frame:
+            return None
+        return json.loads(frame)
+
+    def recv_frame(self):
+        # The raw text of the next notification, or None if the connection is closed
+        from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException
+
         try:
             frame = self._ws.recv()
         except (WebSocketConnectionClosedException, WebSocketTimeoutException, OSError) as e:
             return None
         if not frame:
             return None
-        return json.loads(frame)
+        return frame
+
+    @staticmethod
+    def _open(session, sslopt):
+        from websocket import create_connection, WebSocketBadStatusException
+
+        ws_url = "{0}://{1}:{2}/api/job_results".format(session.websocket,
+                                                        session.host,
+                                                        session.port)
+
+        cookie = session.cookie()
+        try:
+            return create_connection(ws_url,
+                                     header={'Cookie': '{0}={1}'.format(COOKIE_NAME, cookie)},
+                                     sslopt=sslopt)
+        except WebSocketBadStatusException as e:
+            if e.status_code not in AUTH_FAILED:
+                raise
+
+        session.relogin(cookie)
+        return create_connection(ws_url,
+                                 header={'Cookie': '{0}={1}'.format(COOKIE_NAME, session.cookie())},
+                                 sslopt=sslopt)
+
+    @classmethod
+    def connect(cls,
+                session,
+                sslopt={'cert_reqs': ssl.CERT_NONE}):
+        # Open the job_results websocket using an already logged in Session
+        return cls(session, cls._open(session, sslopt), owns_session=False)
 
     @classmethod
     def login(cls,
@@ -62,30 +204,14 @@ class Notify(object):
               port,
               api_key,
               sslopt={'cert_reqs': ssl.CERT_NONE}):
+        session = Session.login(https, host, port, api_key)
+        try:
+            ws = cls._open(session, sslopt)
+        except Exception:
+            session.close()
+            raise
 
-        session = requests.session()
-        protocol = 'https' if https == '1' else 'http'
-        websocket = 'wss' if https == '1' else 'ws'
-
-        url = "{0}://{1}:{2}/api/api_login".format(protocol, host, port)
-        r = session.post(url,
-                         auth=HTTPBasicAuth(get_api_version_number(), api_key),
-                         verify=False)
-        r.raise_for_status()
-
-        cookie = requests.utils.dict_from_cookiejar(session.cookies)
-        cookie_str = '{0}={1}'.format('MWA_JOB_COOKIE',
-                                      cookie['MWA_JOB_COOKIE'])
-
-        ws_url = "{0}://{1}:{2}/api/job_results".format(websocket,
-                                                        host,
-                                                        port)
-
-        ws = create_connection(ws_url,
-                               header={'Cookie': cookie_str},
-                               sslopt=sslopt)
-
-        return Notify(session, ws)
+        return cls(session, ws, owns_session=True)
 
 
 class Session(object):
@@ -95,7 +221,9 @@ class Session(object):
                  host,
                  port,
                  session,
-                 verify):
+                 verify,
+                 api_key=None,
+                 cookie_cache=None):
 
         self.protocol = 'https' if https == '1' else 'http'
         self.websocket = 'wss' if https == '1' else 'ws'
@@ -103,6 +231,20 @@ class Session(object):
         self.port = port
         self.session = session
         self.verify = verify
+        # Kept so that an expired cookie can be replaced without the caller
+        # noticing
+        self.api_key = api_key
+        self.cookie_cache = cookie_cache
+        self._cookie = None
+        self._login_lock = Lock()
+        # Product files come from another host, which is not sent our
+        # cookie. Its connections are kept open between files
+        self._downloads = requests.session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE
+        )
+        self._downloads.mount('http://', adapter)
+        self._downloads.mount('https://', adapter)
 
     def __enter__(self):
         return self
@@ -112,6 +254,7 @@ class Session(object):
 
     def close(self):
         self.session.close()
+        self._downloads.close()
 
     @classmethod
     def login(cls,
@@ -119,23 +262,90 @@ class Session(object):
               host,
               port,
               api_key,
-              verify=False):
+              verify=False,
+              cookie_cache=None):
 
         requests.packages.urllib3.disable_warnings()
 
-        session = requests.session()
-        protocol = 'https' if https == '1' else 'http'
-        url = "{0}://{1}:{2}/api/api_login".format(protocol, host, port)
-        with session.post(url,
-                          auth=HTTPBasicAuth(get_api_version_number(), api_key),
-                          verify=verify) as r:
-            r.raise_for_status()
-
-            return Session(https,
-                           host,
-                           port,
-                           session,
-                           verify=verify)
+        session = Session(https,
+                          host,
+                          port,
+                          requests.session(),
+                          verify=verify,
+                          api_key=api_key,
+                          cookie_cache=cookie_cache)
+
+        cookie = None
+        if cookie_cache is not None:
+            cookie = cookie_cache.load(session._cache_key())
+
+        if cookie:
+            # Used until the server turns it down, see _request
+            session._set_cookie(cookie)
+        else:
+            session._login()
+
+        return session
+
+    def _cache_key(self):
+        return CookieCache.key(
+            "{0}://{1}:{2}".format(self.protocol, self.host, self.port), self.api_key
+        )
+
+    def _set_cookie(self, cookie):
+        # Replaces the previous cookie in one step, so requests made from
+        # other threads meanwhile always carry one or the other
+        self._cookie = cookie
+        self.session.cookies.set(COOKIE_NAME, cookie)
+
+    def _login(self):
+        # Logged in with a separate session so the cookie jar in use is
+        # never left empty
+        url = "{0}://{1}:{2}/api/api_login".format(self.protocol, self.host, self.port)
+        with requests.session() as login_session:
+            with login_session.post(url,
+                                    auth=HTTPBasicAuth(get_api_version_number(), self.api_key),
+                                    verify=self.verify) as r:
+                r.raise_for_status()
+            cookie = requests.utils.dict_from_cookiejar(login_session.cookies).get(COOKIE_NAME)
+
+        self._set_cookie(cookie)
+        if self.cookie_cache is not None and cookie:
+            self.cookie_cache.store(self._cache_key(), cookie)
+
+    def cookie(self):
+        return self._cookie
+
+    def relogin(self, stale_cookie=None):
+        # Log in again because stale_cookie was refused. If another thread
+        # has already replaced it there is nothing to do
+        with self._login_lock:
+            if stale_cookie is not None and self._cookie != stale_cookie:
+                return
+            if self.cookie_cache is not None:
+                self.cookie_cache.clear(self._cache_key())
+            self._login()
+
+    def set_pool_size(self, size):
+        # Keep up to size connections open, for callers making that many
+        # requests at once
+        adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def notify(self, sslopt={'cert_reqs': ssl.CERT_NONE}):
+        # Open a notifier which shares this session's login
+        return Notify.connect(self, sslopt=sslopt)
+
+    def _request(self, method, url, **kwargs):
+        cookie = self.cookie()
+        r = self.session.request(method, url, verify=self.verify, **kwargs)
+        if r.status_code not in AUTH_FAILED or self.api_key is None:
+            return r
+
+        r.close()
+        self.relogin(cookie)
+        return self.session.request(method, url, verify=self.verify, **kwargs)
 
     def submit_conversion_job(self,
                               obs_id,
@@ -156,9 +366,7 @@ class Session(object):
 
     def submit_conversion_job_direct(self, parameters):
         url = "{0}://{1}:{2}/api/conversion_job".format(self.protocol, self.host, self.port)
-        with self.session.post(url,
-                               parameters,
-                               verify=self.verify) as r:
+        with self._request('POST', url, data=parameters) as r:
             r.raise_for_status()
             return r.json()
 
@@ -171,43 +379,109 @@ class Session(object):
 
     def submit_download_job_direct(self, parameters):
         url = "{0}://{1}:{2}/api/download_vis_job".format(self.protocol, self.host, self.port)
-        with self.session.post(url,
-                               parameters,
-                               verify=self.verify) as r:
+        with self._request('POST', url, data=parameters) as r:
             r.raise_for_status()
             return r.json()
 
     def submit_voltage_job_direct(self, parameters):
         url = "{0}://{1}:{2}/api/voltage_job".format(self.protocol, self.host, self.port)
-        with self.session.post(url,
-                               parameters,
-                               verify=self.verify) as r:
+        with self._request('POST', url, data=parameters) as r:
             r.raise_for_status()
             return r.json()
 
     def get_jobs(self):
         url = "{0}://{1}:{2}/api/get_jobs".format(self.protocol, self.host, self.port)
-        with self.session.get(url, verify=self.verify) as r:
+        with self._request('GET', url) as r:
             r.raise_for_status()
             return r.json()
 
+    def iter_jobs(self, chunk_size=256 * 1024):
+        # Like get_jobs, but yields a compact JobRecord for each job while the
+        # response is still arriving, instead of building the whole list
+        url = "{0}://{1}:{2}/api/get_jobs".format(self.protocol, self.host, self.port)
+        with self._request('GET', url, stream=True) as r:
+            r.raise_for_status()
+            for record in iter_job_records(r.iter_content(chunk_size=chunk_size)):
+                yield record
+
     def cancel_job(self, job_id):
         url = "{0}://{1}:{2}/api/cancel_job".format(self.protocol, self.host, self.port)
-        with self.session.get(url,
-                              params=urlencode({'job_id': job_id}),
-                              verify=self.verify) as r:
+        with self._request('GET', url, params=urlencode({'job_id': job_id})) as r:
             r.raise_for_status()
 
     def download_file_product(self,
                               job_id,
                               url,
-                              output_path):
-
-        with requests.get(url, stream=True, timeout=10) as r:
+                              output_path,
+                              size=None,
+                              cancel=None,
+                              sha1=None):
+        # The file is written to output_path + PARTIAL_SUFFIX and renamed
+        # once it is complete. Given size, a shorter partial file from an
+        # earlier attempt is carried on from rather than started again, and
+        # if sha1 is given too the result is checked against it. cancel is a
+        # threading.Event; once it is set the download stops at the next
+        # chunk with DownloadCancelled, leaving the partial file
+        part_path = output_path + PARTIAL_SUFFIX
+
+        offset = 0
+        if size is not None:
+            try:
+                offset = os.path.getsize(part_path)
+            except OSError:
+                pass
+            if offset >= int(size):
+                offset = 0
+
+        headers = {'Range': 'bytes=%d-' % offset} if offset else None
+
+        with self._downloads.get(url, stream=True, timeout=10, headers=headers) as r:
             r.raise_for_status()
 
-            with open(output_path, 'wb') as f:
+            # A 200 is the whole file, from servers which ignore Range
+            resumed = offset and r.status_code == 206
+            if resumed and not r.headers.get('Content-Range', '').startswith(
+                    'bytes %d-' % offset):
+                # Not the part we asked for, start again next time
+                os.remove(part_path)
+                raise Exception('Error: %s sent the wrong part of the file (%s)'
+                                % (url, r.headers.get('Content-Range')))
+
+            with open(part_path, 'ab' if resumed else 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192):
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(part_path)
                     f.write(chunk)
-        
-        return output_path
\ No newline at end of file
+
+        if resumed and sha1:
+            # The start came from an earlier attempt, which may not have been
+            # of this very file
+            h = hashlib.sha1()
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+            if h.hexdigest() != sha1.lower():
+                os.remove(part_path)
+                raise Exception('Error: %s does not match its sha1 after'
+                                ' resuming, it will be downloaded again'
+                                % output_path)
+
+        os.replace(part_path, output_path)
+        return output_path
+
+    def warm_up(self, url):
+        # Open a connection to url's host, so the next download from it does
+        # not wait for DNS and the TLS handshake. Any response will do
+        parsed = urlparse(url)
+        self._downloads.head("{0}://{1}/".format(parsed.scheme, parsed.netloc),
+                             allow_redirects=False,
+                             timeout=10).close()
+
+    def preflight(self, url):
+        # (size in bytes or None, whether Range requests are accepted) for a
+        # product file, without downloading it
+        with self._downloads.head(url, allow_redirects=True, timeout=10) as r:
+            r.raise_for_status()
+            size = r.headers.get('Content-Length')
+            return (int(size) if size is not None else None,
+                    r.headers.get('Accept-Ranges', '').lower() == 'bytes')
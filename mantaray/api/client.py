@@ -0,0 +1,317 @@
+import os
+import ssl
+import json
+import shutil
+import requests
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from threading import Thread, Lock
+from urllib.parse import urlparse
+
+from .api import Session
+from .validate import validate_job
+
+__all__ = ["Client", "Job", "JobError", "as_completed"]
+
+
+# Map the csv style job types onto the session submit functions
+JOB_TYPE_FUNCS = {
+    "c": "submit_conversion_job_direct",
+    "conversion": "submit_conversion_job_direct",
+    "d": "submit_download_job_direct",
+    "download": "submit_download_job_direct",
+    "v": "submit_voltage_job_direct",
+    "voltage": "submit_voltage_job_direct",
+}
+
+JOB_STATE_READY_FOR_DOWNLOAD = "completed"
+JOB_STATE_ERROR = "error"
+JOB_STATE_CANCELLED = "cancelled"
+
+# Terminal events for jobs nobody is waiting on yet are kept (up to this many)
+# in case the submitter registers after the notifier has already seen them
+MAX_UNCLAIMED_EVENTS = 10000
+
+
+class JobError(Exception):
+    def __init__(self, job_id, state, error_text=None):
+        super(JobError, self).__init__(
+            "Job {0} {1}{2}".format(
+                job_id, state, ": {0}".format(error_text) if error_text else ""
+            )
+        )
+        self._job_id = job_id
+        self._state = state
+        self._error_text = error_text
+
+    @property
+    def job_id(self):
+        return self._job_id
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def error_text(self):
+        return self._error_text
+
+
+class Job(object):
+    def __init__(self, item):
+        self._item = item
+
+    @property
+    def item(self):
+        return self._item
+
+    @property
+    def id(self):
+        return int(self._item["row"]["id"])
+
+    @property
+    def obs_id(self):
+        return self._item["row"]["job_params"]["obs_id"]
+
+    @property
+    def state(self):
+        return self._item["row"]["job_state"]
+
+    @property
+    def products(self):
+        product = self._item["row"].get("product") or {}
+        return product.get("files") or []
+
+    def __repr__(self):
+        return "Job(id={0}, obs_id={1}, state={2})".format(
+            self.id, self.obs_id, self.state
+        )
+
+
+class Client(object):
+    def __init__(self, session, notify, download_workers=4):
+        self._session = session
+        self._notify = notify
+        self._lock = Lock()
+        self._pending = {}
+        self._unclaimed = OrderedDict()
+        self._closed = False
+
+        # One pool shared by every download() call
+        self._pool = ThreadPoolExecutor(max_workers=download_workers)
+
+        self._notify_thread = Thread(target=self._notify_func)
+        self._notify_thread.daemon = True
+        self._notify_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    @property
+    def session(self):
+        return self._session
+
+    @classmethod
+    def login(
+        cls,
+        https,
+        host,
+        port,
+        api_key,
+        verify=False,
+        sslopt={"cert_reqs": ssl.CERT_NONE},
+        download_workers=4,
+        cookie_cache=None,
+    ):
+        session = Session.login(
+            https, host, port, api_key, verify=verify, cookie_cache=cookie_cache
+        )
+        try:
+            notify = session.notify(sslopt=sslopt)
+        except Exception:
+            session.close()
+            raise
+
+        return cls(session, notify, download_workers=download_workers)
+
+    @classmethod
+    def from_env(cls, download_workers=4, cookie_cache=None):
+        # Same environment variables as mwa_client
+        api_key = os.environ.get("MWA_ASVO_API_KEY", None)
+        if not api_key:
+            raise Exception("[ERROR] MWA_ASVO_API_KEY env variable not defined")
+
+        if os.environ.get("SSL_VERIFY", "0") == "1":
+            sslopt = {"cert_reqs": ssl.CERT_REQUIRED}
+        else:
+            sslopt = {"cert_reqs": ssl.CERT_NONE}
+
+        return cls.login(
+            os.environ.get("MWA_ASVO_HTTPS", "1"),
+            os.environ.get("MWA_ASVO_HOST", "asvo.mwatelescope.org"),
+            os.environ.get("MWA_ASVO_PORT", "443"),
+            api_key,
+            sslopt=sslopt,
+            download_workers=download_workers,
+            cookie_cache=cookie_cache,
+        )
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self._notify.close()
+        self._notify_thread.join()
+        self._pool.shutdown(wait=True)
+        self._session.close()
+
+    def submit(self, job_type, params, allow_resubmit=False):
+        # Returns a future which resolves to a Job once the job is ready for
+        # download, or raises JobError if it fails, is cancelled or deleted
+        func_name = JOB_TYPE_FUNCS[job_type]
+        func = getattr(self._session, func_name)
+
+        params = dict((k, str(v)) for k, v in params.items())
+        params.setdefault("allow_resubmit", str(allow_resubmit).lower())
+
+        errors = validate_job(func_name, params)
+        if errors:
+            raise ValueError("Invalid job parameters: {0}".format("; ".join(errors)))
+
+        try:
+            job_response = func(params)
+        except requests.exceptions.HTTPError as re:
+            try:
+                response_dict = json.loads(re.response.text)
+            except ValueError:
+                raise re
+
+            # error_code 2 means the same job is already running or complete
+            if response_dict.get("error_code") == 2 and response_dict.get("job_id"):
+                return self.track(response_dict["job_id"])
+            raise
+
+        return self._register(int(job_response["job_id"]))
+
+    def track(self, job_id):
+        # Returns a future for a job which already exists on the server
+        job_id = int(job_id)
+        future = self._register(job_id)
+
+        if not future.done():
+            for record in self._session.iter_jobs():
+                if record.id == job_id:
+                    self._resolve(record.item)
+                    break
+            else:
+                self._fail(job_id, JobError(job_id, "not found"))
+
+        return future
+
+    def download(self, job, output_dir):
+        # Returns one future per product file. Each resolves to the local path
+        if isinstance(job, Future):
+            job = job.result()
+
+        return [
+            self._pool.submit(self._download_product, job, prod, output_dir)
+            for prod in job.products
+        ]
+
+    def _download_product(self, job, prod, output_dir):
+        delivery = prod["type"]
+
+        if delivery == "acacia":
+            file_name = os.path.basename(urlparse(prod["url"]).path)
+            file_path = os.path.join(output_dir, file_name)
+
+            if os.path.isfile(file_path) and os.path.getsize(file_path) == prod["size"]:
+                return file_path
+
+            return self._session.download_file_product(job.id, prod["url"], file_path)
+
+        # dug or scratch
+        delivery_path = prod["path"]
+        if not os.path.isdir(delivery_path):
+            # Not visible from this system; the product stays where it is
+            return delivery_path
+
+        output_path = os.path.join(output_dir, os.path.basename(delivery_path))
+        if not os.path.isdir(output_path):
+            shutil.copytree(delivery_path, output_path)
+        return output_path
+
+    def _register(self, job_id):
+        with self._lock:
+            future = self._pending.get(job_id)
+            if future is None:
+                future = Future()
+                self._pending[job_id] = future
+
+                if self._closed:
+                    self._pending.pop(job_id)
+                    future.set_exception(Exception("Client is closed"))
+                    return future
+
+            item = self._unclaimed.pop(job_id, None)
+
+        if item:
+            self._resolve(item)
+        return future
+
+    def _fail(self, job_id, exception):
+        with self._lock:
+            future = self._pending.pop(job_id, None)
+
+        if future:
+            future.set_exception(exception)
+
+    def _resolve(self, item):
+        action = item["action"]
+        row = item["row"]
+        job_id = int(row["id"])
+        job_state = row["job_state"]
+
+        if action == "DELETE":
+            outcome = JobError(job_id, "deleted")
+        elif job_state == JOB_STATE_READY_FOR_DOWNLOAD:
+            outcome = Job(item)
+        elif job_state in (JOB_STATE_ERROR, JOB_STATE_CANCELLED):
+            outcome = JobError(job_id, job_state, row.get("error_text"))
+        else:
+            return
+
+        with self._lock:
+            future = self._pending.pop(job_id, None)
+
+            if future is None:
+                self._unclaimed[job_id] = item
+                if len(self._unclaimed) > MAX_UNCLAIMED_EVENTS:
+                    self._unclaimed.popitem(last=False)
+                return
+
+        if isinstance(outcome, Job):
+            future.set_result(outcome)
+        else:
+            future.set_exception(outcome)
+
+    def _notify_func(self):
+        while True:
+            item = self._notify.recv()
+            if not item:
+                break
+
+            self._resolve(item)
+
+        # The notifier is gone so nothing pending can complete any more
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending.clear()
+
+        for job_id, future in pending:
+            future.set_exception(JobError(job_id, "lost", "notifier connection closed"))
@@ -0,0 +1,135 @@
+import json
+import codecs
+
+__all__ = ["JobRecord", "iter_json_array", "iter_job_records"]
+
+_WHITESPACE = " \t\n\r"
+
+# Parser states
+_EXPECT_OPEN = 0
+_EXPECT_FIRST = 1
+_EXPECT_VALUE = 2
+_EXPECT_SEPARATOR = 3
+_DONE = 4
+
+
+def iter_json_array(chunks):
+    # Incrementally parse a JSON array from an iterable of byte chunks,
+    # yielding (value, text) for each element as soon as it has arrived. text
+    # is the element's JSON as sent. A null document yields nothing
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    state = _EXPECT_OPEN
+
+    for chunk, final in _with_final(chunks):
+        buf = buf[pos:] + utf8.decode(chunk, final)
+        pos = 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buf):
+                break
+
+            c = buf[pos]
+
+            if state == _DONE:
+                raise ValueError("unexpected data after JSON array")
+
+            if state == _EXPECT_OPEN:
+                if buf.startswith("null", pos):
+                    pos += 4
+                    state = _DONE
+                elif c == "[":
+                    pos += 1
+                    state = _EXPECT_FIRST
+                elif len(buf) - pos < 4 and not final:
+                    break
+                else:
+                    raise ValueError("expected a JSON array")
+                continue
+
+            if state == _EXPECT_SEPARATOR or (state == _EXPECT_FIRST and c == "]"):
+                if c == ",":
+                    state = _EXPECT_VALUE
+                elif c == "]":
+                    state = _DONE
+                else:
+                    raise ValueError("expected , or ] at character {0}".format(pos))
+                pos += 1
+                continue
+
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if final:
+                    raise
+                # The element has not all arrived yet
+                break
+
+            if end == len(buf) and not final:
+                # A number (say) could carry on into the next chunk
+                break
+
+            yield value, buf[pos:end]
+            pos = end
+            state = _EXPECT_SEPARATOR
+
+    if state != _DONE:
+        raise ValueError("JSON array ended early")
+
+
+def _with_final(chunks):
+    for chunk in chunks:
+        if chunk:
+            yield chunk, False
+    yield b"", True
+
+
+class JobRecord(object):
+    # The fields the client works with for one job from get_jobs. The rest of
+    # the job (parameters, products) is kept as the JSON text the server sent
+    # and only parsed again, by item, when it is needed
+    __slots__ = ("id", "state", "job_type", "obs_id", "action", "_text")
+
+    def __init__(self, id, state, job_type, obs_id, action, text):
+        self.id = id
+        self.state = state
+        self.job_type = job_type
+        self.obs_id = obs_id
+        self.action = action
+        self._text = text
+
+    @classmethod
+    def from_item(cls, item, text=None):
+        row = item["row"]
+        return cls(
+            int(row["id"]),
+            row["job_state"],
+            row["job_type"],
+            row["job_params"].get("obs_id"),
+            item.get("action"),
+            text if text is not None else json.dumps(item, separators=(",", ":")),
+        )
+
+    @property
+    def item(self):
+        # The full job, as returned by Session.get_jobs
+        return json.loads(self._text)
+
+    @property
+    def text(self):
+        # The job as the JSON text the server sent
+        return self._text
+
+    def __repr__(self):
+        return "JobRecord(id={0}, state={1}, obs_id={2})".format(
+            self.id, self.state, self.obs_id
+        )
+
+
+def iter_job_records(chunks):
+    for item, text in iter_json_array(chunks):
+        yield JobRecord.from_item(item, text)
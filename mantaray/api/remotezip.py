@@ -0,0 +1,137 @@
+import io
+import os
+import shutil
+import threading
+import zipfile
+
+import requests
+
+__all__ = ["RemoteFile", "extract_zip_members"]
+
+# zipfile reads headers in small pieces, so each Range request reads at least
+# this far ahead. Member data is read in COPY_SIZE pieces, which are fetched
+# exactly, so nothing outside the chosen members is transferred
+READ_AHEAD = 64 * 1024
+COPY_SIZE = 4 * 1024 * 1024
+
+
+class RemoteFile(io.RawIOBase):
+    # A read only, seekable file backed by HTTP Range requests, so zipfile can
+    # read the central directory and chosen members without the whole archive
+    def __init__(self, url, size, session=None, read_ahead=READ_AHEAD, timeout=10):
+        self.url = url
+        self.size = int(size)
+        self.read_ahead = read_ahead
+        self.timeout = timeout
+        self.bytes_fetched = 0
+        self._session = session or requests.Session()
+        self._owns_session = session is None
+        self._pos = 0
+        self._block_start = 0
+        self._block = b""
+
+    def close(self):
+        if self._owns_session and not self.closed:
+            self._session.close()
+        super(RemoteFile, self).close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError("invalid whence {0}".format(whence))
+
+        if self._pos < 0:
+            raise ValueError("negative seek position")
+        return self._pos
+
+    def _fetch(self, start, length):
+        end = min(start + length, self.size) - 1
+        headers = {"Range": "bytes={0}-{1}".format(start, end)}
+
+        with self._session.get(self.url, headers=headers, timeout=self.timeout) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise Exception(
+                    "Error: {0} does not support Range requests".format(self.url)
+                )
+            data = r.content
+
+        self.bytes_fetched += len(data)
+        return data
+
+    def readinto(self, b):
+        # Fills b unless the end of the file is reached: zipfile treats a
+        # short read as a truncated archive
+        view = memoryview(b).cast("B")
+        filled = 0
+
+        while filled < len(view) and self._pos < self.size:
+            offset = self._pos - self._block_start
+            if offset < 0 or offset >= len(self._block):
+                self._block_start = self._pos
+                self._block = self._fetch(
+                    self._pos, max(len(view) - filled, self.read_ahead)
+                )
+                offset = 0
+
+            data = self._block[offset:offset + len(view) - filled]
+            view[filled:filled + len(data)] = data
+            filled += len(data)
+            self._pos += len(data)
+
+        return filled
+
+
+def _member_path(output_dir, name):
+    # Keep the archive's directories, but nothing may land outside output_dir
+    path = os.path.normpath(name)
+    if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+        raise Exception("Error: unsafe path {0} in zip file".format(name))
+    return os.path.join(output_dir, path)
+
+
+def extract_zip_members(url, size, output_dir, wanted, session=None):
+    # Download only the members of the zip file at url for which wanted(name)
+    # is true, skipping any already extracted. Returns a list of
+    # (path, size, downloaded) and the number of bytes fetched
+    extracted = []
+
+    with RemoteFile(url, size, session) as remote:
+        with zipfile.ZipFile(remote) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not wanted(info.filename):
+                    continue
+
+                path = _member_path(output_dir, info.filename)
+                if os.path.isfile(path) and os.path.getsize(path) == info.file_size:
+                    extracted.append((path, info.file_size, False))
+                    continue
+
+                parent = os.path.dirname(path)
+                if parent:
+                    os.makedirs(parent, exist_ok=True)
+
+                # Written under another name until complete, so an interrupted
+                # download is never mistaken for a finished one
+                part_path = "{0}.{1}.part".format(path, threading.get_ident())
+                with zf.open(info) as src, open(part_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, COPY_SIZE)
+                os.replace(part_path, path)
+
+                extracted.append((path, info.file_size, True))
+
+        return extracted, remote.bytes_fetched
@@ -0,0 +1,137 @@
+__all__ = ["JOB_SCHEMAS", "validate_job"]
+
+
+class IntParam(object):
+    def __init__(self, min=None, max=None):
+        self.min = min
+        self.max = max
+
+    def check(self, value):
+        try:
+            number = int(value)
+        except ValueError:
+            return "must be an integer"
+        return _check_range(number, self.min, self.max)
+
+
+class FloatParam(object):
+    def __init__(self, min=None, max=None, min_exclusive=False):
+        self.min = min
+        self.max = max
+        self.min_exclusive = min_exclusive
+
+    def check(self, value):
+        try:
+            number = float(value)
+        except ValueError:
+            return "must be a number"
+        if self.min_exclusive and self.min is not None and number <= self.min:
+            return "must be greater than {0}".format(self.min)
+        return _check_range(number, self.min, self.max)
+
+
+class BoolParam(object):
+    def check(self, value):
+        if value.lower() not in ("true", "false"):
+            return "must be true or false"
+        return None
+
+
+class EnumParam(object):
+    def __init__(self, *values):
+        self.values = values
+
+    def check(self, value):
+        if value not in self.values:
+            return "must be one of {0}".format(", ".join(self.values))
+        return None
+
+
+def _check_range(number, min, max):
+    if min is not None and number < min:
+        return "must be at least {0}".format(min)
+    if max is not None and number > max:
+        return "must be at most {0}".format(max)
+    return None
+
+
+DELIVERY = EnumParam("acacia", "scratch", "dug")
+
+# Parameters accepted by every job type
+COMMON_PARAMS = {
+    "obs_id": IntParam(min=1),
+    "delivery": DELIVERY,
+    "allow_resubmit": BoolParam(),
+}
+
+CONVERSION_PARAMS = {
+    "avg_time_res": FloatParam(min=0, min_exclusive=True),
+    "avg_freq_res": IntParam(min=1),
+    "flag_edge_width": IntParam(min=0),
+    "output": EnumParam("ms", "uvfits"),
+    "apply_di_cal": BoolParam(),
+    "no_rfi": BoolParam(),
+    "no_geometric_delay": BoolParam(),
+    "no_cable_delay": BoolParam(),
+    "no_digital_gains": BoolParam(),
+    "no_passband_gains": BoolParam(),
+    "no_flag_dc": BoolParam(),
+    "centre": EnumParam("phase", "pointing", "custom"),
+    "phase_centre_ra": FloatParam(min=0, max=360),
+    "phase_centre_dec": FloatParam(min=-90, max=90),
+}
+
+DOWNLOAD_PARAMS = {
+    "download_type": EnumParam("vis_meta", "vis"),
+}
+
+VOLTAGE_PARAMS = {
+    "offset": IntParam(min=0),
+    "duration": IntParam(min=1),
+}
+
+# Keyed by the Session function used to submit each job type
+JOB_SCHEMAS = {
+    "submit_conversion_job_direct": {
+        "required": ["obs_id"],
+        "params": dict(COMMON_PARAMS, **CONVERSION_PARAMS),
+    },
+    "submit_download_job_direct": {
+        "required": ["obs_id", "download_type"],
+        "params": dict(COMMON_PARAMS, **DOWNLOAD_PARAMS),
+    },
+    "submit_voltage_job_direct": {
+        "required": ["obs_id", "offset", "duration"],
+        "params": dict(COMMON_PARAMS, **VOLTAGE_PARAMS),
+    },
+}
+
+
+def validate_job(job_type, params):
+    # Returns a list of problems with the job parameters (empty if it is valid)
+    schema = JOB_SCHEMAS.get(job_type)
+    if schema is None:
+        return ["unknown job type {0}".format(job_type)]
+
+    errors = []
+
+    for key in schema["required"]:
+        if key not in params:
+            errors.append("{0} is required".format(key))
+
+    for key, value in params.items():
+        param = schema["params"].get(key)
+        if param is None:
+            errors.append("unknown parameter {0}".format(key))
+            continue
+
+        problem = param.check(str(value))
+        if problem:
+            errors.append("{0}={1} {2}".format(key, value, problem))
+
+    if params.get("centre") == "custom":
+        for key in ("phase_centre_ra", "phase_centre_dec"):
+            if key not in params:
+                errors.append("{0} is required when centre=custom".format(key))
+
+    return errors
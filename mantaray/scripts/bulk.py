@@ -0,0 +1,249 @@
+import re
+import time
+from datetime import datetime, timezone
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from mantaray.scripts.mwa_client import (
+    JOB_STATE_CANCELLED,
+    JOB_STATE_DELIVERING,
+    JOB_STATE_DOWNLOADING,
+    JOB_STATE_ERROR,
+    JOB_STATE_IMAGING,
+    JOB_STATE_PREPROCESSING,
+    JOB_STATE_QUEUED,
+    JOB_STATE_READY_FOR_DOWNLOAD,
+    JOB_STATE_STAGED,
+    JOB_STATE_STAGING,
+    JOB_STATE_WAIT_CAL,
+)
+
+DEFAULT_WORKERS = 8
+
+# Session functions which resubmit each type of job
+RESUBMIT_FUNCS = {
+    0: "submit_conversion_job_direct",
+    1: "submit_download_job_direct",
+    2: "submit_download_job_direct",
+    3: "submit_voltage_job_direct",
+}
+
+JOB_TYPE_NAMES = {
+    "c": (0,),
+    "conversion": (0,),
+    "d": (1, 2),
+    "download": (1, 2),
+    "v": (3,),
+    "voltage": (3,),
+}
+
+# The server's name for each state, plus the one mwa_client prints for
+# completed jobs ("Ready for Download")
+JOB_STATE_NAMES = dict(
+    (state, state)
+    for state in (
+        JOB_STATE_QUEUED,
+        JOB_STATE_WAIT_CAL,
+        JOB_STATE_STAGING,
+        JOB_STATE_STAGED,
+        JOB_STATE_DOWNLOADING,
+        JOB_STATE_PREPROCESSING,
+        JOB_STATE_IMAGING,
+        JOB_STATE_DELIVERING,
+        JOB_STATE_READY_FOR_DOWNLOAD,
+        JOB_STATE_ERROR,
+        JOB_STATE_CANCELLED,
+    )
+)
+JOB_STATE_NAMES["ready"] = JOB_STATE_READY_FOR_DOWNLOAD
+
+OBS_RANGE_REGEX = re.compile(r"^(\d*)\.\.(\d*)$")
+AGE_REGEX = re.compile(r"^(\d+(?:\.\d+)?)([smhdw]?)$")
+AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_obs_range(value):
+    # 1104585920, 1104585920..1104586040, 1104585920.. or ..1104586040
+    # (inclusive) -> (first, last), either of which may be None
+    value = value.strip()
+    if value.isdigit():
+        return int(value), int(value)
+
+    match = OBS_RANGE_REGEX.match(value)
+    if not match or value == "..":
+        raise ValueError("invalid obs_id range {0}".format(value))
+    first, last = match.groups()
+    return (int(first) if first else None, int(last) if last else None)
+
+
+def parse_job_types(values):
+    job_types = set()
+    for value in values:
+        for name in value.split(","):
+            name = name.strip().lower()
+            if name.isdigit():
+                job_types.add(int(name))
+            elif name in JOB_TYPE_NAMES:
+                job_types.update(JOB_TYPE_NAMES[name])
+            else:
+                raise ValueError("invalid job type {0}".format(name))
+    return job_types
+
+
+def parse_states(values):
+    states = set()
+    for value in values:
+        for name in value.split(","):
+            name = name.strip().lower()
+            if not name:
+                continue
+            if name not in JOB_STATE_NAMES:
+                raise ValueError(
+                    "invalid job state {0}, expected one of {1}".format(
+                        name, ", ".join(sorted(JOB_STATE_NAMES))
+                    )
+                )
+            states.add(JOB_STATE_NAMES[name])
+    return states
+
+
+def parse_age(value):
+    # 90, 30m, 12h, 2d, 1w -> seconds
+    match = AGE_REGEX.match(value.strip().lower())
+    if not match:
+        raise ValueError("invalid age {0}".format(value))
+    number, unit = match.groups()
+    return float(number) * AGE_UNITS[unit]
+
+
+def job_created(row):
+    # When the job was created, in seconds since the epoch, or None if the
+    # server did not say. Accepts a timestamp or an ISO 8601 string
+    created = row.get("created")
+    if created is None:
+        return None
+    if isinstance(created, (int, float)):
+        return float(created)
+
+    try:
+        when = datetime.fromisoformat(str(created).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+class JobSelector(object):
+    # Chooses jobs from the job list. Every criterion given must match
+    def __init__(self, states=None, obs_range=None, job_types=None, older_than=None):
+        self.states = set(states or [])
+        self.obs_range = obs_range
+        self.job_types = set(job_types or [])
+        self.older_than = older_than
+        # Jobs which matched everything else, but which --older-than could
+        # not be checked for as the server did not say when they were
+        # created. Counted by select
+        self.undated = 0
+
+    def matches(self, record, now=None):
+        if self.states and record.state not in self.states:
+            return False
+
+        if self.job_types and record.job_type not in self.job_types:
+            return False
+
+        if self.obs_range:
+            try:
+                obs_id = int(record.obs_id)
+            except (TypeError, ValueError):
+                return False
+            first, last = self.obs_range
+            if first is not None and obs_id < first:
+                return False
+            if last is not None and obs_id > last:
+                return False
+
+        if self.older_than is not None:
+            created = job_created(record.item["row"])
+            if created is None:
+                self.undated += 1
+                return False
+            if (now or time.time()) - created < self.older_than:
+                return False
+
+        return True
+
+    def select(self, records):
+        now = time.time()
+        self.undated = 0
+        return [r for r in records if self.matches(r, now)]
+
+
+def _error_reason(e):
+    # Short description of a failed request, for grouping in the summary
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        try:
+            error = e.response.json().get("error")
+        except ValueError:
+            error = None
+        return "HTTP {0}{1}".format(
+            e.response.status_code, ": " + error if error else ""
+        )
+    return str(e) or type(e).__name__
+
+
+def cancel(session, record):
+    session.cancel_job(record.id)
+
+
+def resubmit(session, record):
+    # Returns the new job's id
+    func_name = RESUBMIT_FUNCS.get(record.job_type)
+    if func_name is None:
+        raise ValueError("jobs of type {0} cannot be resubmitted".format(record.job_type))
+
+    params = dict(record.item["row"]["job_params"])
+    params["allow_resubmit"] = "true"
+    return getattr(session, func_name)(params)["job_id"]
+
+
+class BulkSummary(object):
+    def __init__(self):
+        self.succeeded = 0
+        self.failures = Counter()
+        self.elapsed = 0.0
+
+    @property
+    def failed(self):
+        return sum(self.failures.values())
+
+
+def run_bulk(session, records, action, workers=DEFAULT_WORKERS, progress=None):
+    # Call action(session, record) for every record, at most workers at a
+    # time. progress(record, result, error) is called as each one finishes
+    summary = BulkSummary()
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = dict(
+            (pool.submit(action, session, record), record) for record in records
+        )
+
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                summary.failures[_error_reason(e)] += 1
+                if progress:
+                    progress(record, None, e)
+            else:
+                summary.succeeded += 1
+                if progress:
+                    progress(record, result, None)
+
+    summary.elapsed = time.monotonic() - start
+    return summary
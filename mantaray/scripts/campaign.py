@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import hashlib
+from threading import Lock
+
+DEFAULT_MAX_IN_FLIGHT = 100
+
+# How long to wait before submitting again after the server turns a job
+# down (e.g. because the user's queue is full), and how many times a row is
+# tried before it is given up on
+REJECT_BACKOFF = 30.0
+MAX_REJECTIONS = 5
+
+# Row states
+ROW_PENDING = "pending"
+ROW_SUBMITTED = "submitted"
+ROW_DONE = "done"
+ROW_FAILED = "failed"
+ROW_SKIPPED = "skipped"
+
+# Server error codes from submit_job, see mwa_client.submit_job
+ERROR_INVALID = 0
+ERROR_EXISTS = 2
+
+
+def fingerprint(jobs):
+    # Identifies the csv's jobs, so a state file is not used with another csv.
+    # allow_resubmit comes from the command line as often as from the csv
+    digest = hashlib.sha1()
+    for job_type, params in jobs:
+        params = dict((k, v) for k, v in params.items() if k != "allow_resubmit")
+        digest.update(json.dumps([job_type, params], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class WatchedQueue(object):
+    # Passes everything through to queue, telling on_put about each item
+    def __init__(self, queue, on_put):
+        self._queue = queue
+        self._on_put = on_put
+
+    def put(self, item, *args, **kwargs):
+        if item:
+            self._on_put(item)
+        self._queue.put(item, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
+
+class Campaign(object):
+    # Works through the jobs of a csv file a window at a time: at most
+    # max_in_flight jobs submitted and not yet downloaded, and no more
+    # submitted while the completed jobs waiting to be downloaded add up to
+    # max_pending_bytes. Progress is kept in a state file so an interrupted
+    # campaign carries on where it left off
+    def __init__(self, path, jobs, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_pending_bytes=None):
+        self.path = path
+        self.jobs = jobs
+        self.max_in_flight = max_in_flight
+        self.max_pending_bytes = max_pending_bytes
+
+        self._lock = Lock()
+        self._dirty = False
+        self._retry_at = 0.0
+        # job id -> bytes to download, for completed jobs not yet downloaded
+        self._pending = {}
+
+        key = fingerprint(jobs)
+        state = self._load()
+        if state is None:
+            self.rows = [
+                {"obs_id": params.get("obs_id"), "state": ROW_PENDING}
+                for _, params in jobs
+            ]
+            self._dirty = True
+        elif state.get("fingerprint") != key or len(state["rows"]) != len(jobs):
+            raise Exception(
+                "Error: {0} belongs to a campaign with different jobs. Use the"
+                " same csv file, or another --campaign file".format(path)
+            )
+        else:
+            self.rows = state["rows"]
+
+        self.fingerprint = key
+        # job id -> row index, for jobs submitted and not finished
+        self.in_flight = dict(
+            (row["job_id"], i)
+            for i, row in enumerate(self.rows)
+            if row["state"] == ROW_SUBMITTED
+        )
+        self._next = 0
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            raise Exception("Error: could not read {0}: {1}".format(self.path, e))
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            state = {
+                "fingerprint": self.fingerprint,
+                "updated": time.time(),
+                "rows": self.rows,
+            }
+
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def watch(self, download_queue):
+        return WatchedQueue(download_queue, self._queued)
+
+    def _queued(self, item):
+        job_id = int(item["row"]["id"])
+        nbytes = sum(int(p.get("size") or 0) for p in item["row"]["product"]["files"])
+        with self._lock:
+            self._pending[job_id] = nbytes
+
+    def _set(self, index, state, **kwargs):
+        row = self.rows[index]
+        row["state"] = state
+        row.update(kwargs)
+        self._dirty = True
+
+    def update(self, active_ids):
+        # Jobs no longer in active_ids have been downloaded, failed or were
+        # cancelled
+        with self._lock:
+            for job_id in [j for j in self.in_flight if j not in active_ids]:
+                index = self.in_flight.pop(job_id)
+                if self.rows[index]["state"] == ROW_SUBMITTED:
+                    self._set(index, ROW_DONE)
+
+            for job_id in [j for j in self._pending if j not in active_ids]:
+                del self._pending[job_id]
+
+    def failed(self, job_id, message):
+        with self._lock:
+            for row in self.rows:
+                if row.get("job_id") == job_id:
+                    row["state"] = ROW_FAILED
+                    row["error"] = message
+                    self._dirty = True
+
+    def next_row(self):
+        # (index, job) of the next job to submit, or None if the window is
+        # full or there are no more
+        with self._lock:
+            if len(self.in_flight) >= self.max_in_flight:
+                return None
+            if (
+                self.max_pending_bytes is not None
+                and sum(self._pending.values()) >= self.max_pending_bytes
+            ):
+                return None
+            if time.monotonic() < self._retry_at:
+                return None
+
+            while self._next < len(self.rows):
+                if self.rows[self._next]["state"] == ROW_PENDING:
+                    return self._next, self.jobs[self._next]
+                self._next += 1
+            return None
+
+    def submitted(self, index, job_ids, error_code):
+        # Returns True if the server turned the job down and it will be tried
+        # again later
+        with self._lock:
+            if job_ids:
+                job_id = int(job_ids[0])
+                self.in_flight[job_id] = index
+                self._set(index, ROW_SUBMITTED, job_id=job_id)
+                return False
+
+            if error_code in (None, ERROR_INVALID, ERROR_EXISTS):
+                # Nothing to track: invalid, or it matched a job which failed
+                # or one already tracked for another row
+                self._set(index, ROW_SKIPPED)
+                return False
+
+            row = self.rows[index]
+            row["rejections"] = row.get("rejections", 0) + 1
+            if row["rejections"] >= MAX_REJECTIONS:
+                self._set(
+                    index,
+                    ROW_FAILED,
+                    error="turned down by the server {0} times (error code {1})".format(
+                        row["rejections"], error_code
+                    ),
+                )
+                return False
+
+            self._dirty = True
+            self._retry_at = time.monotonic() + REJECT_BACKOFF
+            return True
+
+    def retry_in(self):
+        # Seconds until a job turned down by the server can be tried again,
+        # or None if nothing is waiting for that
+        with self._lock:
+            wait = self._retry_at - time.monotonic()
+            return wait if wait > 0 else None
+
+    def remaining(self):
+        # True until every row has been submitted and finished
+        with self._lock:
+            if self.in_flight:
+                return True
+            return any(row["state"] == ROW_PENDING for row in self.rows[self._next:])
+
+    def counts(self):
+        counts = dict.fromkeys(
+            (ROW_PENDING, ROW_SUBMITTED, ROW_DONE, ROW_FAILED, ROW_SKIPPED), 0
+        )
+        with self._lock:
+            for row in self.rows:
+                counts[row["state"]] += 1
+        return counts
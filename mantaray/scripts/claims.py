@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import socket
+from threading import Thread, Lock
+
+# Claims live in this directory inside the shared output directory
+CLAIM_DIR = ".mwa_client_claims"
+
+DEFAULT_LEASE = 120.0
+RETRY_INTERVAL = 2.0
+
+
+class ClaimDirectory(object):
+    # Lets several mwa_client processes, on any number of hosts, share one
+    # output directory without downloading the same file twice.
+    #
+    # A file is claimed by creating <job_id>_<file name>.claim with O_EXCL,
+    # which is atomic on local and NFS v3+ filesystems. The owner keeps
+    # touching its claims; a claim not touched for a whole lease belongs to a
+    # process which has died, and the next process to find it takes it over.
+    def __init__(self, output_dir, lease=DEFAULT_LEASE):
+        self.path = os.path.join(output_dir, CLAIM_DIR)
+        self.lease = lease
+        # How often to look again at files other processes hold
+        self.retry_interval = min(lease / 4.0, RETRY_INTERVAL)
+        self.owner = "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+        self._lock = Lock()
+        self._held = set()
+        self._closed = False
+
+        os.makedirs(self.path, exist_ok=True)
+
+        renew_thread = Thread(target=self._renew_func)
+        renew_thread.daemon = True
+        renew_thread.start()
+
+    def _claim_path(self, job_id, file_name):
+        return os.path.join(self.path, "{0}_{1}.claim".format(job_id, file_name))
+
+    def _create(self, claim_path):
+        try:
+            fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self.owner, "claimed": time.time()}, f)
+        return True
+
+    def _expired(self, claim_path):
+        try:
+            return time.time() - os.stat(claim_path).st_mtime > self.lease
+        except FileNotFoundError:
+            # Released while we looked, so it is free
+            return True
+
+    def acquire(self, job_id, file_name):
+        # Returns the claim, or None if another live process holds it
+        claim_path = self._claim_path(job_id, file_name)
+
+        if not self._create(claim_path):
+            if not self._expired(claim_path):
+                return None
+
+            # Move the stale claim aside first: only one process can win the
+            # rename, so only one takes over
+            stale_path = "{0}.{1}.stale".format(claim_path, self.owner)
+            try:
+                os.rename(claim_path, stale_path)
+            except FileNotFoundError:
+                pass
+            else:
+                if not self._expired(stale_path):
+                    # Another process took it over between our check and the
+                    # rename; give it back
+                    try:
+                        os.link(stale_path, claim_path)
+                    except FileExistsError:
+                        pass
+                    os.remove(stale_path)
+                    return None
+                os.remove(stale_path)
+
+            if not self._create(claim_path):
+                return None
+
+        with self._lock:
+            self._held.add(claim_path)
+        return claim_path
+
+    def owner_of(self, job_id, file_name):
+        try:
+            with open(self._claim_path(job_id, file_name), "r") as f:
+                return json.load(f).get("owner")
+        except (OSError, ValueError):
+            return None
+
+    def release(self, claim_path):
+        with self._lock:
+            self._held.discard(claim_path)
+        try:
+            os.remove(claim_path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self._lock:
+            held = list(self._held)
+            self._closed = True
+        for claim_path in held:
+            self.release(claim_path)
+
+    def _renew_func(self):
+        while True:
+            time.sleep(self.lease / 3.0)
+
+            with self._lock:
+                if self._closed:
+                    break
+                held = list(self._held)
+
+            for claim_path in held:
+                try:
+                    os.utime(claim_path, None)
+                except OSError:
+                    pass
@@ -0,0 +1,507 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from functools import partial
+from threading import Thread, Event, Lock
+
+try:
+    from queue import Queue, Empty
+except:
+    from Queue import Queue, Empty
+
+from mantaray.scripts.filters import FileSelection
+from mantaray.scripts.mwa_client import (
+    JOB_STATE_CANCELLED,
+    JOB_STATE_ERROR,
+    JOB_STATE_READY_FOR_DOWNLOAD,
+    ParseException,
+    ValidationException,
+    coalesce_notifications,
+    emit_state_event,
+    get_job_list,
+    get_status_message,
+    guarded_download_job,
+    next_notification_batch,
+    notify_reader_func,
+    parse_csv,
+    retry_with_backoff,
+    stop_downloads,
+    submit_jobs,
+    validate_csv,
+)
+from mantaray.scripts.recording import RecordingNotify
+
+BATCH_SUBMITTING = "submitting"
+BATCH_RUNNING = "running"
+BATCH_DONE = "done"
+BATCH_FAILED = "failed"
+
+# Suffix given to a spooled csv file once the daemon has accepted it
+ACCEPTED_SUFFIX = ".accepted"
+
+# Terminal events for jobs not yet registered to a batch are kept (up to this
+# many) in case the job finishes before its batch has finished submitting
+MAX_UNCLAIMED_EVENTS = 10000
+
+
+def _write_json_atomic(path, obj):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class Batch(object):
+    def __init__(self, name, csv_path, output_dir, status_path):
+        self.name = name
+        self.csv_path = csv_path
+        self.output_dir = output_dir
+        self.status_path = status_path
+        self.state = BATCH_SUBMITTING
+        self.pending = set()
+        self.jobs = OrderedDict()
+        self.errors = []
+        self.started = time.time()
+        self.dirty = True
+
+    def add_error(self, job_id, obs_id, message, path=None):
+        error = {"job_id": job_id, "obs_id": obs_id, "result": message}
+        if path:
+            error["path"] = path
+        self.errors.append(error)
+        self.dirty = True
+
+    def write_status(self):
+        _write_json_atomic(
+            self.status_path,
+            {
+                "batch": self.name,
+                "csv": self.csv_path,
+                "output_dir": self.output_dir,
+                "state": self.state,
+                "jobs": self.jobs,
+                "errors": self.errors,
+                "started": self.started,
+                "updated": time.time(),
+            },
+        )
+        self.dirty = False
+
+
+class SpoolDaemon(object):
+    def __init__(
+        self,
+        params,
+        sslopt,
+        session,
+        spool_dir,
+        output_dir,
+        status_queue,
+        verbose,
+        allow_resubmit,
+        poll_interval,
+        validate=True,
+        events=None,
+        workers=4,
+        file_filter=None,
+        layout=None,
+        recorder=None,
+    ):
+        self._params = params
+        self._sslopt = sslopt
+        self._session = session
+        self._spool_dir = spool_dir
+        self._output_dir = output_dir
+        self._status_queue = status_queue
+        self._verbose = verbose
+        self._allow_resubmit = allow_resubmit
+        self._poll_interval = poll_interval
+        self._validate = validate
+        self._events = events
+        self._workers = workers
+        self._selection = FileSelection(file_filter)
+        self._layout = layout
+        self._recorder = recorder
+
+        self._lock = Lock()
+        self._batches = []
+        # Jobs waiting for a notification
+        self._tracked = set()
+        # job id -> the batches it belongs to. Two csv files can hold the
+        # same job, the server then returns the existing one for the second
+        self._batches_of = {}
+        # (job id, batch) being downloaded into that batch's directory
+        self._downloading = set()
+        self._unclaimed = OrderedDict()
+        self._download_queue = Queue()
+        self._cancel = Event()
+        self._result_queue = Queue()
+        self._notify = None
+        self._notify_thread = None
+
+    def run(self):
+        threads = []
+        for _ in range(self._workers):
+            t = Thread(target=self._download_func)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        try:
+            self._connect_notifier()
+            self._status_queue.put(
+                "Watching spool directory {0} for csv files...".format(
+                    self._spool_dir
+                )
+            )
+
+            while True:
+                if not self._notify_thread.is_alive():
+                    self._status_queue.put(
+                        "Notifier connection lost, reconnecting..."
+                    )
+                    self._reconnect()
+
+                self._scan()
+                self._drain_results(self._poll_interval)
+                self._update_batches()
+        except KeyboardInterrupt:
+            self._status_queue.put(
+                "Stopping downloads, partly downloaded files will be carried on"
+                " from next time..."
+            )
+            stop_downloads(self._cancel, threads, self._download_queue)
+            raise
+
+    def _connect_notifier(self):
+        self._notify = self._session.notify(sslopt=self._sslopt)
+        if self._recorder:
+            self._notify = RecordingNotify(self._notify, self._recorder)
+        self._notify_thread = Thread(target=self._notify_func, args=(self._notify,))
+        self._notify_thread.daemon = True
+        self._notify_thread.start()
+
+    def _reconnect(self):
+        # The server may be down for a while, keep trying until it is back
+        retry_with_backoff(self._resync, self._status_queue)
+        self._status_queue.put("Reconnected to MWA ASVO Notifier")
+
+    def _resync(self):
+        # Also closes the connection left by a failed attempt
+        try:
+            self._notify.close()
+        except Exception:
+            pass
+
+        # The session logs in again by itself if its cookie has expired
+        self._connect_notifier()
+
+        # Catch up on anything which happened while we were disconnected
+        with self._lock:
+            tracked = set(self._tracked)
+
+        for record in get_job_list(self._session):
+            if record.id in tracked:
+                self._handle(record.item)
+
+    def _scan(self):
+        try:
+            names = sorted(os.listdir(self._spool_dir))
+        except OSError as e:
+            self._status_queue.put(
+                "Error reading spool directory {0}: {1}".format(self._spool_dir, e)
+            )
+            return
+
+        with self._lock:
+            active = set(b.csv_path for b in self._batches)
+
+        for name in names:
+            path = os.path.join(self._spool_dir, name)
+
+            if name.endswith(".csv"):
+                # Claim the file so it is only picked up once
+                accepted_path = path + ACCEPTED_SUFFIX
+                try:
+                    os.rename(path, accepted_path)
+                except OSError:
+                    continue
+            elif name.endswith(".csv" + ACCEPTED_SUFFIX) and path not in active:
+                # Accepted by an earlier run which did not finish it.
+                # Resubmitting is safe, the server reports existing jobs
+                accepted_path = path
+            else:
+                continue
+
+            self._start_batch(accepted_path)
+
+    def _start_batch(self, csv_path):
+        name = os.path.basename(csv_path)[: -len(".csv" + ACCEPTED_SUFFIX)]
+        output_dir = os.path.join(self._output_dir, name)
+        status_path = os.path.join(self._spool_dir, name + ".status.json")
+
+        batch = Batch(name, csv_path, output_dir, status_path)
+        with self._lock:
+            self._batches.append(batch)
+
+        self._status_queue.put("Starting batch {0}".format(name))
+
+        # Filled in as jobs are submitted, so those already on the server
+        # are in the status file if a later row fails
+        submitted = []
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            batch.write_status()
+
+            if self._validate:
+                validate_csv(csv_path, self._allow_resubmit)
+
+            jobs = parse_csv(csv_path, self._allow_resubmit)
+            if not self._validate:
+                # Every row is parsed before any is submitted
+                jobs = list(jobs)
+
+            # Jobs which are already complete on the server come back here
+            ready_queue = Queue()
+            job_ids = submit_jobs(
+                self._session,
+                jobs,
+                self._status_queue,
+                ready_queue,
+                self._events,
+                self._selection,
+                submitted_jobs=submitted,
+            )
+        except ParseException as e:
+            self._fail_batch(batch, "Error: %s, Line num: %s" % (str(e), e.line_num))
+            return
+        except ValidationException as e:
+            for line_num, errors in e.errors:
+                for error in errors:
+                    self._fail_batch(
+                        batch, "Error: %s, Line num: %s" % (error, line_num)
+                    )
+            return
+        except Exception as e:
+            with self._lock:
+                for job_id in submitted:
+                    batch.jobs.setdefault(int(job_id), "submitted")
+            self._fail_batch(batch, str(e))
+            return
+
+        ready_ids = set()
+        while not ready_queue.empty():
+            item = ready_queue.get()
+            ready_ids.add(int(item["row"]["id"]))
+            self._enqueue_download(item, batch)
+
+        unclaimed = []
+        with self._lock:
+            for job_id in job_ids:
+                job_id = int(job_id)
+                batches = self._batches_of.setdefault(job_id, [])
+                if batch not in batches:
+                    batches.append(batch)
+                batch.pending.add(job_id)
+                batch.jobs.setdefault(job_id, "submitted")
+
+                if job_id not in ready_ids:
+                    self._tracked.add(job_id)
+
+                item = self._unclaimed.pop(job_id, None)
+                if item:
+                    unclaimed.append(item)
+
+            batch.state = BATCH_RUNNING
+            batch.dirty = True
+
+        for item in unclaimed:
+            self._handle(item)
+
+    def _fail_batch(self, batch, message):
+        self._status_queue.put("Batch {0} failed: {1}".format(batch.name, message))
+        with self._lock:
+            batch.add_error(None, None, message)
+            batch.state = BATCH_FAILED
+            batch.dirty = True
+
+    def _notify_func(self, notify):
+        frame_queue = Queue()
+        reader_thread = Thread(target=notify_reader_func, args=(notify, frame_queue))
+        reader_thread.daemon = True
+        reader_thread.start()
+
+        closed = False
+        while not closed:
+            items, closed = next_notification_batch(frame_queue)
+            for item in coalesce_notifications(items):
+                self._handle(item)
+
+    def _handle(self, item):
+        action = item["action"]
+        job_id = int(item["row"]["id"])
+        obs_id = item["row"]["job_params"]["obs_id"]
+        job_state = item["row"]["job_state"]
+        terminal = action == "DELETE" or job_state in (
+            JOB_STATE_READY_FOR_DOWNLOAD,
+            JOB_STATE_ERROR,
+            JOB_STATE_CANCELLED,
+        )
+
+        with self._lock:
+            if job_id not in self._tracked:
+                if terminal:
+                    self._unclaimed[job_id] = item
+                    if len(self._unclaimed) > MAX_UNCLAIMED_EVENTS:
+                        self._unclaimed.popitem(last=False)
+                return
+
+            batches = list(self._batches_of.get(job_id, []))
+            for batch in batches:
+                batch.jobs[job_id] = "deleted" if action == "DELETE" else job_state
+                batch.dirty = True
+
+        if self._events:
+            emit_state_event(self._events, item)
+
+        self._status_queue.put(
+            partial(get_status_message, item, self._verbose, True)
+        )
+
+        if action == "DELETE" or job_state == JOB_STATE_CANCELLED:
+            self._job_finished(job_id)
+        elif job_state == JOB_STATE_ERROR:
+            message = get_status_message(item, self._verbose, False)
+            with self._lock:
+                for batch in batches:
+                    batch.add_error(job_id, obs_id, message)
+            self._job_finished(job_id)
+        elif job_state == JOB_STATE_READY_FOR_DOWNLOAD:
+            for batch in batches:
+                self._enqueue_download(item, batch)
+
+    def _enqueue_download(self, item, batch):
+        # Each batch gets its own copy of the files, in its own directory
+        job_id = int(item["row"]["id"])
+
+        with self._lock:
+            if (job_id, batch) in self._downloading:
+                return
+            self._downloading.add((job_id, batch))
+            self._tracked.discard(job_id)
+
+        self._download_queue.put((item, batch))
+
+    def _job_finished(self, job_id, batch=None):
+        # Finished for batch, or for every batch it belongs to
+        with self._lock:
+            batches = self._batches_of.get(job_id, [])
+            for b in [batch] if batch else batches:
+                self._downloading.discard((job_id, b))
+                b.pending.discard(job_id)
+                b.dirty = True
+
+            if any(job_id in b.pending for b in batches):
+                return
+            self._tracked.discard(job_id)
+
+        self._selection.discard(job_id)
+
+    def _download_func(self):
+        while True:
+            entry = self._download_queue.get()
+            if not entry or self._cancel.is_set():
+                break
+
+            item, batch = entry
+            job_id = int(item["row"]["id"])
+
+            results = Queue()
+            guarded_download_job(
+                item,
+                self._session,
+                batch.output_dir,
+                results,
+                self._status_queue,
+                self._events,
+                selection=self._selection,
+                layout=self._layout,
+                cancel=self._cancel,
+            )
+            if self._cancel.is_set():
+                break
+
+            # The job may be in several batches, the errors are this one's
+            while not results.empty():
+                self._result_queue.put((batch, results.get()))
+
+            with self._lock:
+                if batch.jobs.get(job_id) == JOB_STATE_READY_FOR_DOWNLOAD:
+                    batch.jobs[job_id] = "downloaded"
+
+            self._job_finished(job_id, batch)
+
+    def _drain_results(self, timeout):
+        # (batch, Result) for each download error
+        try:
+            batch, r = self._result_queue.get(timeout=timeout)
+        except Empty:
+            return
+
+        while True:
+            self._status_queue.put(r.colour_message)
+            with self._lock:
+                batch.add_error(r.job_id, r.obs_id, r.no_colour_message, r.path)
+                if batch.jobs.get(r.job_id) == "downloaded":
+                    batch.jobs[r.job_id] = "download failed"
+
+            try:
+                batch, r = self._result_queue.get_nowait()
+            except Empty:
+                return
+
+    def _update_batches(self):
+        with self._lock:
+            finished = [
+                b for b in self._batches
+                if b.state == BATCH_RUNNING and not b.pending
+            ]
+
+        if finished:
+            # Results are queued before a job is marked finished, so pick up
+            # any the batch is still owed before closing it
+            self._drain_results(0)
+
+        with self._lock:
+            for batch in finished:
+                batch.state = BATCH_FAILED if batch.errors else BATCH_DONE
+                batch.dirty = True
+
+            dirty = [b for b in self._batches if b.dirty]
+            done = [b for b in self._batches if b.state in (BATCH_DONE, BATCH_FAILED)]
+
+        for batch in dirty:
+            batch.write_status()
+
+        for batch in done:
+            final_path = batch.csv_path[: -len(ACCEPTED_SUFFIX)] + "." + batch.state
+            try:
+                os.replace(batch.csv_path, final_path)
+            except OSError:
+                pass
+
+            self._status_queue.put(
+                "Batch {0} {1} ({2} jobs, {3} errors)".format(
+                    batch.name, batch.state, len(batch.jobs), len(batch.errors)
+                )
+            )
+
+            with self._lock:
+                self._batches.remove(batch)
+                for job_id in batch.jobs:
+                    batches = self._batches_of.get(job_id)
+                    if batches and batch in batches:
+                        batches.remove(batch)
+                        if not batches:
+                            del self._batches_of[job_id]
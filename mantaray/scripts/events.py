@@ -0,0 +1,68 @@
+import sys
+import json
+import time
+from threading import Lock
+
+
+class EventWriter(object):
+    def __init__(self, stream, close_stream):
+        self._stream = stream
+        self._close_stream = close_stream
+        self._lock = Lock()
+
+    @property
+    def to_stdout(self):
+        return not self._close_stream
+
+    @classmethod
+    def open(cls, spec):
+        # Acceptable values are:
+        # jsonl            == write events to stdout
+        # jsonl=path       == append events to path
+        event_format, _, path = spec.partition("=")
+
+        if event_format != "jsonl":
+            raise Exception(
+                "Error: '{0}' is not valid for --events. Try 'jsonl' or"
+                " 'jsonl=path'.".format(spec)
+            )
+
+        if path:
+            return cls(open(path, "a"), True)
+
+        # The real stdout, not the wrapper colorama puts around sys.stdout,
+        # so events are written exactly as they are and without its overhead
+        return cls(sys.__stdout__, False)
+
+    def close(self):
+        with self._lock:
+            if self._close_stream:
+                self._stream.close()
+            else:
+                self._stream.flush()
+
+    def emit(
+        self,
+        event,
+        job_id=None,
+        obs_id=None,
+        state=None,
+        nbytes=None,
+        throughput=None,
+        error=None,
+    ):
+        record = {
+            "timestamp": time.time(),
+            "event": event,
+            "job_id": job_id,
+            "obs_id": obs_id,
+            "state": state,
+            "bytes": nbytes,
+            "throughput": throughput,
+            "error": None if error is None else str(error),
+        }
+        line = json.dumps(record, separators=(",", ":"))
+
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
@@ -0,0 +1,116 @@
+import re
+import fnmatch
+
+# csv row keys which choose which product files to download. They are used
+# by the client and never sent to the server
+FILTER_KEYS = ("include", "exclude", "min_size", "max_size", "members")
+
+SIZE_REGEX = re.compile(r"^(\d+(?:\.\d+)?)([kmgt]?)i?b?$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_size(value):
+    # 5000, 500k, 10M, 1.5GB, 2GiB -> bytes (binary units)
+    match = SIZE_REGEX.match(value.strip())
+    if not match:
+        raise ValueError("invalid size {0}".format(value))
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.lower()])
+
+
+def compile_pattern(pattern):
+    # Patterns are globs matched against the whole file name, or regular
+    # expressions searched for in it when prefixed with re:
+    if pattern.startswith("re:"):
+        try:
+            return re.compile(pattern[3:]).search
+        except re.error as e:
+            raise ValueError("invalid regular expression {0}: {1}".format(pattern, e))
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def split_filter_params(params):
+    # Split csv row params into (job params, filter params)
+    job_params = {}
+    filter_params = {}
+    for key, value in params.items():
+        if key in FILTER_KEYS:
+            filter_params[key] = value
+        else:
+            job_params[key] = value
+    return job_params, filter_params
+
+
+class FileFilter(object):
+    def __init__(
+        self, include=None, exclude=None, min_size=None, max_size=None, members=None
+    ):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.min_size = min_size
+        self.max_size = max_size
+        self.members = list(members or [])
+
+        self._include = [compile_pattern(p) for p in self.include]
+        self._exclude = [compile_pattern(p) for p in self.exclude]
+        self._members = [compile_pattern(p) for p in self.members]
+
+    @classmethod
+    def from_params(cls, filter_params, defaults=None):
+        # Build a filter from csv row values (patterns separated by ;), taking
+        # anything the row does not set from defaults
+        defaults = defaults or FileFilter()
+
+        def patterns(key, default):
+            if key not in filter_params:
+                return default
+            return [p for p in filter_params[key].split(";") if p]
+
+        def size(key, default):
+            if key not in filter_params:
+                return default
+            return parse_size(filter_params[key])
+
+        return cls(
+            patterns("include", defaults.include),
+            patterns("exclude", defaults.exclude),
+            size("min_size", defaults.min_size),
+            size("max_size", defaults.max_size),
+            patterns("members", defaults.members),
+        )
+
+    def wants(self, file_name, file_size):
+        if self._include and not any(m(file_name) for m in self._include):
+            return False
+        if any(m(file_name) for m in self._exclude):
+            return False
+        if self.min_size is not None and int(file_size) < self.min_size:
+            return False
+        if self.max_size is not None and int(file_size) > self.max_size:
+            return False
+        return True
+
+    def wants_member(self, member_name):
+        return any(m(member_name) for m in self._members)
+
+    def selects_members(self, file_name):
+        # Only zip products can have members picked out of them
+        return bool(self._members) and file_name.lower().endswith(".zip")
+
+
+class FileSelection(object):
+    # The filter for each job: the one from its csv row if it had one,
+    # otherwise the one from the command line. A job's entry is discarded
+    # once it is no longer tracked
+    def __init__(self, default=None):
+        self.default = default
+        self._filters = {}
+
+    def set(self, job_id, file_filter):
+        self._filters[int(job_id)] = file_filter
+
+    def get(self, job_id):
+        return self._filters.get(int(job_id), self.default)
+
+    def discard(self, job_id):
+        self._filters.pop(int(job_id), None)
@@ -0,0 +1,82 @@
+import os
+import hashlib
+
+# Directory names for {job_type}
+JOB_TYPE_DIRS = {
+    0: "conversion",
+    1: "visibilities",
+    2: "metadata",
+    3: "voltage",
+}
+
+# Used to check a template before any job is downloaded
+SAMPLE_FIELDS = {
+    "obs_id": "1104585920",
+    "job_id": 1,
+    "job_type": "conversion",
+    "shard": "ab",
+    "profile": "default",
+}
+
+
+def shard_of(obs_id):
+    # Two hex digits spreading observations evenly over 256 directories
+    return hashlib.sha1(str(obs_id).encode("utf-8")).hexdigest()[:2]
+
+
+class OutputLayout(object):
+    # Where each job's files go under the download directory, e.g.
+    # {obs_id}/{job_id} or {shard}/{obs_id}. Fields are obs_id, job_id,
+    # job_type, shard and profile (the --profiles profile, or default), and
+    # take format specs, so {obs_id:.6} is the first six digits of the obs_id
+    def __init__(self, template, profile="default"):
+        self.template = template.strip("/")
+        self.profile = profile
+        self._created = set()
+
+        try:
+            self._format(SAMPLE_FIELDS)
+        except (KeyError, IndexError, AttributeError, ValueError) as e:
+            raise ValueError(
+                "invalid layout {0}: {1} (use obs_id, job_id, job_type and"
+                " shard and profile)".format(template, e)
+            )
+
+    def _format(self, fields):
+        path = os.path.normpath(self.template.format(**fields))
+        if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+            raise ValueError("{0} is outside the download directory".format(path))
+        return path
+
+    def job_dir(self, output_dir, item, create=True):
+        row = item["row"]
+        # The server sends it as a number, but the template is checked, and
+        # documented, with it as a string, e.g. {obs_id:.6}
+        obs_id = str(row["job_params"]["obs_id"])
+        path = os.path.join(
+            output_dir,
+            self._format(
+                {
+                    "obs_id": obs_id,
+                    "job_id": int(row["id"]),
+                    "job_type": JOB_TYPE_DIRS.get(row["job_type"], str(row["job_type"])),
+                    "shard": shard_of(obs_id),
+                    "profile": self.profile,
+                }
+            ),
+        )
+
+        if create:
+            self.create(path)
+        return path
+
+    def create(self, path):
+        # Only asked of the filesystem once per directory, which is slow on
+        # network filesystems
+        if path not in self._created:
+            os.makedirs(path, exist_ok=True)
+            self._created.add(path)
+
+    def for_profile(self, profile):
+        # The same layout for the jobs of another profile
+        return OutputLayout(self.template, profile)
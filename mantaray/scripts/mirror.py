@@ -0,0 +1,289 @@
+import os
+from functools import partial
+from threading import Thread, Event, Lock, Timer
+
+try:
+    from queue import Queue, Empty
+except:
+    from Queue import Queue, Empty
+
+from mantaray.scripts.mwa_client import (
+    JOB_STATE_DELIVERING,
+    JOB_STATE_READY_FOR_DOWNLOAD,
+    coalesce_notifications,
+    emit_state_event,
+    get_job_list,
+    get_status_message,
+    guarded_download_job,
+    next_notification_batch,
+    notify_reader_func,
+    retry_with_backoff,
+    stop_downloads,
+)
+from mantaray.scripts.recording import RecordingNotify
+from mantaray.scripts.verify import product_files
+
+# Seconds before a failed download is tried again, doubling each time it
+# fails up to the most
+RETRY_DELAY = 60.0
+MAX_RETRY_DELAY = 3600.0
+
+
+class Mirror(object):
+    # Keeps output_dir in step with every one of the user's jobs which is
+    # ready to download, whoever submitted it. The job list is read once at
+    # start and again after the notifier reconnects; in between, jobs are
+    # downloaded as the notifier says they are ready
+    def __init__(
+        self,
+        sslopt,
+        session,
+        output_dir,
+        status_queue,
+        verbose,
+        events=None,
+        workers=4,
+        selection=None,
+        layout=None,
+        claims=None,
+        preflight=None,
+        result_log=None,
+        recorder=None,
+    ):
+        self._sslopt = sslopt
+        self._session = session
+        self._output_dir = output_dir
+        self._status_queue = status_queue
+        self._verbose = verbose
+        self._events = events
+        self._workers = workers
+        self._selection = selection
+        self._layout = layout
+        self._claims = claims
+        self._preflight = preflight
+        self._result_log = result_log
+        self._recorder = recorder
+
+        self._lock = Lock()
+        # Queued or being downloaded
+        self._downloading = set()
+        # Downloaded by this run, so not checked again when resyncing
+        self._mirrored = set()
+        # job id -> times its download has failed, while it waits to be
+        # tried again
+        self._retries = {}
+        self._download_queue = Queue()
+        self._cancel = Event()
+        self._result_queue = Queue()
+        self._notify = None
+        self._notify_thread = None
+
+    def run(self):
+        threads = []
+        for _ in range(self._workers):
+            t = Thread(target=self._download_func)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        try:
+            # Connected before the job list is read, so no job can become
+            # ready between the two unseen
+            self._connect_notifier()
+            self._sync()
+            self._status_queue.put(
+                "Mirroring ready jobs into {0}...".format(self._output_dir)
+            )
+
+            while True:
+                if not self._notify_thread.is_alive():
+                    self._status_queue.put(
+                        "Notifier connection lost, reconnecting..."
+                    )
+                    self._reconnect()
+
+                self._drain_results(1)
+        except KeyboardInterrupt:
+            self._status_queue.put(
+                "Stopping downloads, partly downloaded files will be carried on"
+                " from next time..."
+            )
+            stop_downloads(self._cancel, threads, self._download_queue)
+            raise
+
+    def _reconnect(self):
+        # Catch up on anything which became ready while we were disconnected
+        retry_with_backoff(self._resync, self._status_queue)
+        self._status_queue.put("Reconnected to MWA ASVO Notifier")
+
+    def _resync(self):
+        # Also closes the connection left by a failed attempt
+        try:
+            self._notify.close()
+        except Exception:
+            pass
+
+        self._connect_notifier()
+        self._sync()
+
+    def _connect_notifier(self):
+        self._notify = self._session.notify(sslopt=self._sslopt)
+        if self._recorder:
+            self._notify = RecordingNotify(self._notify, self._recorder)
+        self._notify_thread = Thread(target=self._notify_func, args=(self._notify,))
+        self._notify_thread.daemon = True
+        self._notify_thread.start()
+
+    def _sync(self):
+        for record in get_job_list(self._session):
+            if record.state == JOB_STATE_READY_FOR_DOWNLOAD:
+                self._handle(record.item)
+
+    def _notify_func(self, notify):
+        frame_queue = Queue()
+        reader_thread = Thread(target=notify_reader_func, args=(notify, frame_queue))
+        reader_thread.daemon = True
+        reader_thread.start()
+
+        closed = False
+        while not closed:
+            items, closed = next_notification_batch(frame_queue)
+            for item in coalesce_notifications(items):
+                self._handle(item)
+
+    def _handle(self, item):
+        job_id = int(item["row"]["id"])
+
+        if item["action"] == "DELETE":
+            # Expired or deleted on the server. Files already downloaded are
+            # left where they are
+            with self._lock:
+                self._mirrored.discard(job_id)
+                self._retries.pop(job_id, None)
+            return
+
+        job_state = item["row"]["job_state"]
+        if job_state == JOB_STATE_DELIVERING and self._preflight:
+            self._preflight.delivering(item)
+        if job_state != JOB_STATE_READY_FOR_DOWNLOAD:
+            return
+
+        with self._lock:
+            if job_id in self._downloading or job_id in self._mirrored:
+                return
+            self._downloading.add(job_id)
+            downloading = set(self._downloading)
+
+        if self._preflight:
+            self._preflight.completed(item, downloading)
+
+        if self._events:
+            emit_state_event(self._events, item)
+
+        self._status_queue.put(
+            partial(get_status_message, item, self._verbose, True)
+        )
+        self._download_queue.put(item)
+
+    def _download_func(self):
+        while True:
+            item = self._download_queue.get()
+            if not item or self._cancel.is_set():
+                break
+
+            job_id = int(item["row"]["id"])
+
+            # This job's results only, to tell whether it all came down
+            results = Queue()
+            deferred = guarded_download_job(
+                item,
+                self._session,
+                self._output_dir,
+                results,
+                self._status_queue,
+                self._events,
+                self._claims,
+                self._selection,
+                self._layout,
+                self._cancel,
+            )
+            if self._cancel.is_set():
+                break
+
+            failed = not results.empty() or self._incomplete(item)
+            while not results.empty():
+                self._result_queue.put(results.get())
+
+            if deferred:
+                # Another process has some of its files, look again later
+                timer = Timer(
+                    self._claims.retry_interval, self._download_queue.put, (item,)
+                )
+                timer.daemon = True
+                timer.start()
+                continue
+
+            with self._lock:
+                if failed:
+                    # Kept in _downloading until it is tried again, so it is
+                    # not queued twice meanwhile
+                    retries = self._retries.get(job_id, 0)
+                    self._retries[job_id] = retries + 1
+                else:
+                    self._downloading.discard(job_id)
+                    self._retries.pop(job_id, None)
+                    self._mirrored.add(job_id)
+
+            if failed:
+                delay = min(RETRY_DELAY * 2 ** retries, MAX_RETRY_DELAY)
+                self._status_queue.put(
+                    "Job {0} will be downloaded again in {1:.0f}s".format(
+                        job_id, delay
+                    )
+                )
+                timer = Timer(delay, self._retry, (item,))
+                timer.daemon = True
+                timer.start()
+
+    def _incomplete(self, item):
+        # A file which could not be downloaded is only reported on the screen
+        job_dir = self._output_dir
+        if self._layout:
+            try:
+                job_dir = self._layout.job_dir(self._output_dir, item, create=False)
+            except Exception:
+                return True
+
+        job_id = int(item["row"]["id"])
+        file_filter = self._selection.get(job_id) if self._selection else None
+        for _, path, size, _ in product_files(item, job_dir, file_filter):
+            try:
+                if os.path.getsize(path) != size:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _retry(self, item):
+        job_id = int(item["row"]["id"])
+        with self._lock:
+            if job_id not in self._retries:
+                # Deleted on the server while it waited
+                self._downloading.discard(job_id)
+                return
+        self._download_queue.put(item)
+
+    def _drain_results(self, timeout):
+        try:
+            r = self._result_queue.get(timeout=timeout)
+        except Empty:
+            return
+
+        while r:
+            self._status_queue.put(r.colour_message)
+            if self._result_log:
+                self._result_log.add(r)
+            try:
+                r = self._result_queue.get_nowait()
+            except Empty:
+                return
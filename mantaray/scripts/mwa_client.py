@@ -5,6 +5,13 @@ import sys
 import requests
 import shutil
 import json
+import atexit
+import time
+import re
+import itertools
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from urllib.parse import urlparse
 
 try:
@@ -12,10 +19,31 @@ try:
 except:
     from Queue import Queue, Empty
 
-from threading import Thread, RLock
+from threading import Thread, Event, RLock, Timer
 import argparse
 from colorama import init, Fore, Style
-from mantaray.api import Notify, Session, get_pretty_version_string
+from mantaray.api import (
+    CookieCache,
+    PARTIAL_SUFFIX,
+    DownloadCancelled,
+    Session,
+    get_pretty_version_string,
+    validate_job,
+)
+from mantaray.scripts.events import EventWriter
+from mantaray.scripts.campaign import (
+    Campaign,
+    DEFAULT_MAX_IN_FLIGHT,
+    REJECT_BACKOFF,
+)
+from mantaray.scripts.layout import OutputLayout
+from mantaray.scripts.filters import (
+    FILTER_KEYS,
+    FileFilter,
+    FileSelection,
+    parse_size,
+    split_filter_params,
+)
 
 
 # Constants for job states
@@ -48,6 +76,8 @@ class Result(object):
         result_obs_id,
         result_colour_message,
         result_no_colour_message,
+        result_path=None,
+        result_profile=None,
     ):
         self._job_id = result_job_id
         self._obs_id = result_obs_id
@@ -55,6 +85,10 @@ class Result(object):
         self._no_colour_message = "".join(
             str(result_no_colour_message)
         )  # Remove any newlines
+        # The file or job directory the error is about, if any
+        self._path = result_path
+        # The --profiles profile the job belongs to, if any
+        self._profile = result_profile
 
     @property
     def job_id(self):
@@ -72,6 +106,22 @@ class Result(object):
     def no_colour_message(self):
         return self._no_colour_message
 
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def profile(self):
+        return self._profile
+
+
+class JobFinished(object):
+    # Put on the result queue when a job stops being tracked, whether it was
+    # downloaded, failed, was cancelled or deleted, so whoever waits on the
+    # queue wakes up as soon as anything changes instead of polling
+    def __init__(self, job_id):
+        self.job_id = job_id
+
 
 class ParseException(Exception):
     def __init__(self, *arg):
@@ -96,6 +146,19 @@ class ParseException(Exception):
         self._row = value
 
 
+class ValidationException(Exception):
+    def __init__(self, errors):
+        super(ValidationException, self).__init__(
+            "{0} invalid row(s) in csv file".format(len(errors))
+        )
+        self._errors = errors
+
+    @property
+    def errors(self):
+        # list of (line_num, [error message, ...])
+        return self._errors
+
+
 def parse_row(row, allow_resubmit):
     try:
         job_type = None
@@ -134,8 +197,6 @@ def parse_row(row, allow_resubmit):
         if "allow_resubmit" not in params:
             params["allow_resubmit"] = str(allow_resubmit).lower()
 
-        # check parameters for each job type: create a validate function in api
-
         return [job_type, params]
 
     except ParseException:
@@ -144,84 +205,393 @@ def parse_row(row, allow_resubmit):
         raise ParseException()
 
 
+# csv column choosing the --profiles endpoint a row is submitted to
+PROFILE_KEY = "profile"
+
+# start..end or start..end:step, inclusive
+RANGE_REGEX = re.compile(r"^(-?\d+)\.\.(-?\d+)(?::(\d+))?$")
+
+
+def expand_value(val, base_dir):
+    # Acceptable values are:
+    # value            == a single value
+    # a|b|c            == each of the values in turn
+    # start..end       == every integer from start to end inclusive
+    # start..end:step  == every step'th integer from start to end inclusive
+    # @file            == each value listed in file, one per line (relative
+    #                     paths are relative to the csv file)
+    values = []
+    for part in val.split("|"):
+        range_match = RANGE_REGEX.match(part)
+
+        if part.startswith("@"):
+            list_path = os.path.join(base_dir, part[1:])
+            try:
+                with open(list_path, "r") as f:
+                    for line in f:
+                        line = line.strip()
+                        if line and not line.startswith("#"):
+                            values.append(line)
+            except (IOError, OSError) as e:
+                raise ParseException(
+                    "could not read value list {0}: {1}".format(list_path, e)
+                )
+
+        elif range_match:
+            start, end, step = range_match.groups()
+            start = int(start)
+            end = int(end)
+            step = int(step) if step else 1
+
+            if step == 0 or end < start:
+                raise ParseException("invalid range {0}".format(part))
+
+            values.append(range(start, end + 1, step))
+
+        else:
+            values.append(part)
+
+    if not values:
+        raise ParseException("value list {0} is empty".format(val))
+
+    return itertools.chain.from_iterable(
+        v if isinstance(v, range) else (v,) for v in values
+    )
+
+
+def expand_job(job, base_dir):
+    # Yield one job per combination of expanded parameter values, so a row can
+    # describe a range of observations or a grid of settings
+    job_type, params = job
+
+    keys = list(params.keys())
+    expanded = []
+    for key in keys:
+        if key == "allow_resubmit" or key in FILTER_KEYS:
+            # Filter patterns may contain | themselves
+            expanded.append((params[key],))
+        else:
+            expanded.append(list(expand_value(params[key], base_dir)))
+
+    for combination in itertools.product(*expanded):
+        yield [job_type, dict((k, str(v)) for k, v in zip(keys, combination))]
+
+
 def parse_csv(filename, allow_resubmit):
-    result = []
-    with open(filename, "r") as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            if not row:
-                continue
-            if row[0].strip().startswith("#"):
-                continue
+    # Returns a generator of [job_type, params], so jobs can be submitted while
+    # the rest of the file is still being read. The file is opened up front so
+    # a bad filename is reported straight away
+    csvfile = open(filename, "r")
+    return _parse_csv_file(
+        csvfile, os.path.dirname(os.path.abspath(filename)), allow_resubmit
+    )
+
+
+def _iter_csv_rows(csvfile):
+    # Yield (line_num, row) for each job row, skipping blanks and comments
+    reader = csv.reader(csvfile)
+    for row in reader:
+        if not row:
+            continue
+        if row[0].strip().startswith("#"):
+            continue
+        yield reader.line_num, row
+
+
+def _parse_csv_file(csvfile, base_dir, allow_resubmit):
+    with csvfile:
+        for line_num, row in _iter_csv_rows(csvfile):
             try:
-                result.append(parse_row(row, allow_resubmit))
+                jobs = expand_job(parse_row(row, allow_resubmit), base_dir)
+                for job in jobs:
+                    yield job
             except ParseException as e:
-                e.line_num = reader.line_num
+                e.line_num = line_num
                 e.row = row
                 raise e
-    return result
 
 
-def submit_jobs(session, jobs_to_submit, status_queue, download_queue):
-    submitted_jobs = []
+def validate_csv(filename, allow_resubmit, profiles=None):
+    # Check every job in the csv file before anything is submitted. Raises
+    # ValidationException listing every bad row. profiles are the names a
+    # profile column may use
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    errors = []
+
+    with open(filename, "r") as csvfile:
+        for line_num, row in _iter_csv_rows(csvfile):
+            row_errors = []
+            try:
+                jobs = expand_job(parse_row(row, allow_resubmit), base_dir)
+                for job_type, params in jobs:
+                    params, filter_params = split_filter_params(params)
+                    profile = params.pop(PROFILE_KEY, None)
+                    messages = validate_job(job_type, params)
+                    if profile is not None and profiles is None:
+                        messages.append("profile needs --profiles")
+                    elif profile is not None and profile not in profiles:
+                        messages.append("unknown profile {0}".format(profile))
+                    try:
+                        FileFilter.from_params(filter_params)
+                    except ValueError as e:
+                        messages.append(str(e))
+
+                    for msg in messages:
+                        # Expanded rows usually repeat the same problem
+                        if msg not in row_errors:
+                            row_errors.append(msg)
+            except ParseException as e:
+                row_errors.append(str(e) or "invalid row")
+
+            if row_errors:
+                errors.append((line_num, row_errors))
+
+    if errors:
+        raise ValidationException(errors)
+
+
+def submit_jobs(
+    session,
+    jobs_to_submit,
+    status_queue,
+    download_queue,
+    events=None,
+    selection=None,
+    voltage_groups=None,
+    submitted_jobs=None,
+    submit_lock=None,
+    early=None,
+):
+    # Returns the ids of the jobs to track. Given submitted_jobs, each is
+    # added to it under submit_lock as soon as it is submitted, and any of
+    # its notifications which came first are handed back to the notifier
+    # from early (an EarlyNotifications)
+    if submitted_jobs is None:
+        submitted_jobs = []
+    if submit_lock is None:
+        submit_lock = RLock()
     job_number = 0  # used to help point the user to which csv job had a submission problem
 
-    existing_jobs = get_job_list(session)
-    ready_jobs = []
+    # Only fetched if the server tells us a job already exists
+    existing_jobs = {}
 
     for job in jobs_to_submit:
         job_number = job_number + 1
 
-        # Get the function from the session object e.g. session.submit_conversion_job_direct
-        func = getattr(session, job[0])
+        parts = voltage_groups.split(job) if voltage_groups else [job]
 
-        try:
-            # Call the session function
-            job_response = func(job[1])
-        except requests.exceptions.HTTPError as re:
-            status_code = re.response.status_code
-            response_dict = json.loads(re.response.text)
-            error_code = response_dict.get("error_code")
-            error_text = response_dict.get("error")
-            job_id = response_dict.get("job_id")
-
-            if error_code == 0:
-                status_queue.put(
-                    "{0}Skipping:{1} job #{2} - {3}.".format(
-                        Fore.MAGENTA, Fore.RESET, job_number, error_text
-                    )
-                )
-            if error_code == 2:
-                for e in existing_jobs:
-                    if e["row"]["id"] == job_id:
-                        if job_id not in submitted_jobs:
-                            submitted_jobs.append(job_id)
-
-                status_queue.put(
-                    "{0}Skipping:{1} {2} already running or"
-                    " complete.".format(Fore.MAGENTA, Fore.RESET, job_id)
-                )
-        except Exception:
-            print(
-                "Error submitting job #{0} from csvfile. Details below:"
-                .format(job_number)
+        # Jobs which are already ready are only queued once they are tracked,
+        # or one could be downloaded before it is in submitted_jobs, and then
+        # never leave it
+        ready = Queue()
+        if len(parts) > 1:
+            job_ids = submit_voltage_parts(
+                session,
+                job,
+                parts,
+                job_number,
+                submitted_jobs,
+                existing_jobs,
+                status_queue,
+                ready,
+                events,
+                selection,
+                voltage_groups,
             )
-            raise
         else:
-            new_job_id = job_response["job_id"]
-            status_queue.put("Submitted job: %s " % (new_job_id,))
+            job_ids, _ = submit_job(
+                session,
+                job,
+                job_number,
+                submitted_jobs,
+                existing_jobs,
+                status_queue,
+                ready,
+                events,
+                selection,
+            )
+
+        track_submitted(
+            submit_lock, submitted_jobs, job_ids, ready, download_queue, early
+        )
 
-            submitted_jobs.append(new_job_id)
+    if job_number == 0:
+        raise Exception("Error: No jobs to submit")
 
     return submitted_jobs
 
 
-def _remove_submitted(submit_lock, submitted_jobs, job_id):
+def track_submitted(
+    submit_lock, submitted_jobs, job_ids, ready, download_queue, early=None
+):
+    # Start following newly submitted jobs. submit_lock is only held for
+    # this, not while jobs are submitted, so the notifier and the download
+    # threads are never kept waiting on the server
+    with submit_lock:
+        submitted_jobs.extend(job_ids)
+        if early is not None:
+            early.release(job_ids)
+
+    while not ready.empty():
+        download_queue.put(ready.get())
+
+
+def submit_voltage_parts(
+    session,
+    job,
+    parts,
+    job_number,
+    submitted_jobs,
+    existing_jobs,
+    status_queue,
+    download_queue,
+    events,
+    selection,
+    voltage_groups,
+):
+    # Submit the parts of a split voltage job at the same time, and follow
+    # them as one request. Returns the ids of the jobs to track
+    from mantaray.scripts.voltage import MAX_PARALLEL_SUBMIT
+
+    def submit_part(part):
+        return submit_job(
+            session,
+            part,
+            job_number,
+            submitted_jobs,
+            existing_jobs,
+            status_queue,
+            download_queue,
+            events,
+            selection,
+        )[0]
+
+    with ThreadPoolExecutor(
+        max_workers=min(len(parts), MAX_PARALLEL_SUBMIT)
+    ) as pool:
+        part_ids = list(pool.map(submit_part, parts))
+
+    request = voltage_groups.add(job, [ids[0] if ids else None for ids in part_ids])
+    status_queue.put(
+        "Split voltage request {0} into {1} jobs: {2}".format(
+            request.label,
+            len(parts),
+            ", ".join(str(j) for j in request.job_ids if j is not None),
+        )
+    )
+
+    return [job_id for ids in part_ids for job_id in ids]
+
+
+def submit_job(
+    session,
+    job,
+    job_number,
+    submitted_jobs,
+    existing_jobs,
+    status_queue,
+    download_queue,
+    events=None,
+    selection=None,
+):
+    # Submit one csv job. Returns the ids of the jobs to track (none, the new
+    # job or the existing job it matches) and the server's error code, if it
+    # turned the job down. existing_jobs caches the user's job list
+
+    # Get the function from the session object e.g. session.submit_conversion_job_direct
+    func = getattr(session, job[0])
+
+    # File filters from the csv row are for us, not the server
+    params, filter_params = split_filter_params(job[1])
+    file_filter = None
+    if filter_params and selection:
+        file_filter = FileFilter.from_params(filter_params, selection.default)
+
+    try:
+        # Call the session function
+        job_response = func(params)
+    except requests.exceptions.HTTPError as re:
+        status_code = re.response.status_code
+        response_dict = json.loads(re.response.text)
+        error_code = response_dict.get("error_code")
+        error_text = response_dict.get("error")
+        job_id = response_dict.get("job_id")
+
+        job_ids = []
+        if error_code == 0:
+            status_queue.put(
+                "{0}Skipping:{1} job #{2} - {3}.".format(
+                    Fore.MAGENTA, Fore.RESET, job_number, error_text
+                )
+            )
+        if error_code == 2:
+            if int(job_id) not in existing_jobs:
+                existing_jobs.update((e.id, e) for e in get_job_list(session))
+
+            existing = existing_jobs.get(int(job_id))
+            if existing and job_id not in submitted_jobs:
+                existing_state = existing.state
+
+                if existing_state not in (
+                    JOB_STATE_ERROR,
+                    JOB_STATE_CANCELLED,
+                ):
+                    # Only tracked jobs have their filter discarded later
+                    if file_filter:
+                        selection.set(job_id, file_filter)
+                    job_ids.append(job_id)
+
+                if existing_state == JOB_STATE_READY_FOR_DOWNLOAD:
+                    # No notification will come for this one
+                    download_queue.put(existing.item)
+
+            status_queue.put(
+                "{0}Skipping:{1} {2} already running or"
+                " complete.".format(Fore.MAGENTA, Fore.RESET, job_id)
+            )
+
+        # A job which is tracked gets its own events as it progresses
+        if events and not job_ids:
+            events.emit(
+                "skipped",
+                job_id=job_id,
+                obs_id=job[1].get("obs_id"),
+                error=error_text,
+            )
+        return job_ids, error_code
+    except Exception:
+        print(
+            "Error submitting job #{0} from csvfile. Details below:"
+            .format(job_number)
+        )
+        raise
+    else:
+        new_job_id = job_response["job_id"]
+        status_queue.put("Submitted job: %s " % (new_job_id,))
+
+        if file_filter:
+            selection.set(new_job_id, file_filter)
+
+        if events:
+            events.emit(
+                "submitted",
+                job_id=new_job_id,
+                obs_id=job[1].get("obs_id"),
+                state=JOB_STATE_QUEUED,
+            )
+
+        return [new_job_id], None
+
+
+def _remove_submitted(submit_lock, submitted_jobs, job_id, result_queue=None):
     try:
         with submit_lock:
             submitted_jobs.remove(job_id)
     except:
-        pass
+        return
+
+    if result_queue is not None:
+        result_queue.put(JobFinished(job_id))
 
 
 def uri_validator(product):
@@ -232,249 +602,737 @@ def uri_validator(product):
         return False
 
 
-def download_func(
-    submit_lock,
-    submitted_jobs,
-    download_queue,
-    result_queue,
-    status_queue,
+def download_job(
+    item,
     session,
     output_dir,
+    result_queue,
+    status_queue,
+    events=None,
+    claims=None,
+    selection=None,
+    layout=None,
+    cancel=None,
 ):
-    while True:
-        item = download_queue.get()
-        if not item:
+    # Returns True if another mwa_client process holds some of the job's
+    # files (with claims), so it should be looked at again later. Once
+    # cancel (an Event) is set, it stops at the next chunk of the file it is
+    # downloading, leaving it to be carried on from by the next run
+    job_id = int(item["row"]["id"])
+    obs_id = item["row"]["job_params"]["obs_id"]
+    products = item["row"]["product"]["files"]
+    file_filter = selection.get(job_id) if selection else None
+    deferred = False
+
+    # Where this job's files go under output_dir
+    if layout:
+        job_dir = output_dir
+        try:
+            job_dir = layout.job_dir(output_dir, item, create=False)
+            layout.create(job_dir)
+        except Exception as e:
+            if events:
+                events.emit("error", job_id=job_id, obs_id=obs_id, error=e)
+
+            result_queue.put(Result(job_id, obs_id, e, e, job_dir))
+            return deferred
+        output_dir = job_dir
+
+    for prod in products:
+        if cancel is not None and cancel.is_set():
             break
 
-        job_id = int(item["row"]["id"])
-        obs_id = item["row"]["job_params"]["obs_id"]
-        products = item["row"]["product"]["files"]
+        claim = None
+        try:
+            delivery = prod["type"]
+            file_size = prod["size"]
+            if delivery == "acacia":
+                file_sha1 = prod["sha1"]
+                file_url = prod["url"]
+
+                parsed_url = urlparse(file_url)
+                file_name = os.path.basename(parsed_url.path)
+                file_path = os.path.join(output_dir, file_name)
+
+                if file_filter and not file_filter.wants(file_name, file_size):
+                    status_queue.put(
+                        "%sSkipping:%s Job id: %s file: %s (filtered out)"
+                        % (Fore.MAGENTA, Fore.RESET, job_id, file_name)
+                    )
+                    continue
 
-        for prod in products:
-            try:
-                delivery = prod["type"]
-                file_size = prod["size"]
-                if delivery == "acacia":
-                    file_sha1 = prod["sha1"]
-                    file_url = prod["url"]
-
-                    parsed_url = urlparse(file_url)
-                    file_name = os.path.basename(parsed_url.path)
-                    file_path = os.path.join(output_dir, file_name)
-
-                    if os.path.isfile(file_path):
-                        if os.path.getsize(file_path) == file_size:
-                            msg = (
-                                "%sDownload complete:%s Job id: %s%s%s file:"
-                                " %s%s%s server-sha1: %s%s%s"
-                                % (
-                                    Fore.GREEN,
-                                    Fore.RESET,
-                                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                    job_id,
-                                    Fore.RESET,
-                                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                    file_path,
-                                    Fore.RESET,
-                                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                    file_sha1,
-                                    Fore.RESET,
-                                )
-                            )
-                            status_queue.put(msg)
-                            continue
+                # Only the chosen members of a zip file are fetched, using
+                # Range requests, rather than the whole file
+                members = file_filter is not None and file_filter.selects_members(
+                    file_name
+                )
 
-                    msg = (
-                        "%sDownloading:%s Job id: %s%s%s file: %s%s%s size:"
-                        " %s%s%s bytes"
-                        % (
-                            Fore.MAGENTA,
-                            Fore.RESET,
-                            Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                            job_id,
-                            Fore.RESET,
-                            Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                            file_url,
-                            Fore.RESET,
-                            Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                            file_size,
-                            Fore.RESET,
+                if claims:
+                    claim = claims.acquire(job_id, file_name)
+                    if not claim:
+                        deferred = True
+                        status_queue.put(
+                            "%sDeferring:%s Job id: %s file: %s is being"
+                            " downloaded by %s"
+                            % (
+                                Fore.MAGENTA,
+                                Fore.RESET,
+                                job_id,
+                                file_name,
+                                claims.owner_of(job_id, file_name),
+                            )
                         )
-                    )
-                    status_queue.put(msg)
+                        continue
 
-                    for attempt in range(3):
-                        try:
-                            session.download_file_product(
-                                job_id, file_url, file_path
+                if not members and os.path.isfile(file_path):
+                    if os.path.getsize(file_path) == file_size:
+                        if events:
+                            events.emit(
+                                "download_complete",
+                                job_id=job_id,
+                                obs_id=obs_id,
+                                state=JOB_STATE_READY_FOR_DOWNLOAD,
+                                nbytes=file_size,
+                            )
+
+                        msg = (
+                            "%sDownload complete:%s Job id: %s%s%s file:"
+                            " %s%s%s server-sha1: %s%s%s"
+                            % (
+                                Fore.GREEN,
+                                Fore.RESET,
+                                Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                                job_id,
+                                Fore.RESET,
+                                Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                                file_path,
+                                Fore.RESET,
+                                Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                                file_sha1,
+                                Fore.RESET,
                             )
-                        except (
-                            Exception,
-                            requests.exceptions.ConnectionError,
-                        ) as e:
-                            pass
-                        else:
-                            break
-                    else:
-                        msg = "%sDownload Failed:%s Job id: %s%s%s" % (
-                            Fore.RED,
-                            Fore.RESET,
-                            Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                            job_id,
-                            Fore.RESET,
                         )
                         status_queue.put(msg)
-                else:
-                    # dug or scratch
-                    delivery_path = prod["path"]
+                        continue
 
-                    if os.path.isdir(delivery_path):
-                        # Folder exists on current system
-                        output_path = os.path.join(
-                            output_dir, os.path.basename(delivery_path)
-                        )
-                        if os.path.isdir(output_path):
-                            # Folder has already been moved to output_dir
-                            msg = (
-                                "%sDownload Complete:%s Job id: %s%s%s file:"
-                                " %s%s%s"
-                                % (
-                                    Fore.GREEN,
-                                    Fore.RESET,
-                                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                    job_id,
-                                    Fore.RESET,
-                                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                    output_path,
-                                    Fore.RESET,
-                                )
+                msg = (
+                    "%sDownloading:%s Job id: %s%s%s file: %s%s%s size:"
+                    " %s%s%s bytes"
+                    % (
+                        Fore.MAGENTA,
+                        Fore.RESET,
+                        Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                        job_id,
+                        Fore.RESET,
+                        Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                        file_url,
+                        Fore.RESET,
+                        Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                        file_size,
+                        Fore.RESET,
+                    )
+                )
+                status_queue.put(msg)
+
+                if events:
+                    events.emit(
+                        "download_started",
+                        job_id=job_id,
+                        obs_id=obs_id,
+                        state=JOB_STATE_READY_FOR_DOWNLOAD,
+                        nbytes=file_size,
+                    )
+
+                download_error = None
+                for attempt in range(3):
+                    start = time.monotonic()
+                    try:
+                        if members:
+                            nbytes = download_zip_members(
+                                job_id, file_url, file_size, output_dir,
+                                file_filter, status_queue,
                             )
-                            status_queue.put(msg)
-                            continue
                         else:
-                            # Folder has not been moved to output_dir yet
-                            msg = (
-                                "%sCopying job to the directory:%s%s Job id: %s%s%s"
-                                % (
-                                    Fore.MAGENTA,
-                                    Fore.RESET,
-                                    output_path,
-                                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                    job_id,
-                                    Fore.RESET,
-                                )
+                            # Later attempts carry on from where the last
+                            # one stopped
+                            session.download_file_product(
+                                job_id,
+                                file_url,
+                                file_path,
+                                file_size,
+                                cancel,
+                                file_sha1,
+                            )
+                            nbytes = file_size
+                    except DownloadCancelled:
+                        status_queue.put(
+                            "%sStopped:%s Job id: %s file: %s (%s of %s bytes,"
+                            " the rest will be downloaded next time)"
+                            % (
+                                Fore.MAGENTA,
+                                Fore.RESET,
+                                job_id,
+                                file_path,
+                                os.path.getsize(file_path + PARTIAL_SUFFIX),
+                                file_size,
                             )
-                            status_queue.put(msg)
-                            shutil.copytree(delivery_path, output_path)
-                            continue
+                        )
+                        return deferred
+                    except (
+                        Exception,
+                        requests.exceptions.ConnectionError,
+                    ) as e:
+                        download_error = e
                     else:
-                        # Folder does not exist on current system. Let the user know it's ready and exit
+                        if events:
+                            elapsed = time.monotonic() - start
+                            events.emit(
+                                "download_complete",
+                                job_id=job_id,
+                                obs_id=obs_id,
+                                state=JOB_STATE_READY_FOR_DOWNLOAD,
+                                nbytes=nbytes,
+                                throughput=(
+                                    nbytes / elapsed if elapsed > 0 else None
+                                ),
+                            )
+                        break
+                else:
+                    if events:
+                        events.emit(
+                            "download_failed",
+                            job_id=job_id,
+                            obs_id=obs_id,
+                            state=JOB_STATE_READY_FOR_DOWNLOAD,
+                            nbytes=file_size,
+                            error=download_error,
+                        )
+
+                    msg = "%sDownload Failed:%s Job id: %s%s%s" % (
+                        Fore.RED,
+                        Fore.RESET,
+                        Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                        job_id,
+                        Fore.RESET,
+                    )
+                    status_queue.put(msg)
+            else:
+                # dug or scratch
+                delivery_path = prod["path"]
+
+                if os.path.isdir(delivery_path):
+                    # Folder exists on current system
+                    output_path = os.path.join(
+                        output_dir, os.path.basename(delivery_path)
+                    )
+                    if os.path.isdir(output_path):
+                        # Folder has already been moved to output_dir
                         msg = (
-                            "%sReady on /%s:%s Job id: %s%s%s file: %s%s%s"
+                            "%sDownload Complete:%s Job id: %s%s%s file:"
+                            " %s%s%s"
                             % (
                                 Fore.GREEN,
-                                delivery,
                                 Fore.RESET,
                                 Fore.LIGHTWHITE_EX + Style.BRIGHT,
                                 job_id,
                                 Fore.RESET,
                                 Fore.LIGHTWHITE_EX + Style.BRIGHT,
-                                delivery_path,
+                                output_path,
+                                Fore.RESET,
+                            )
+                        )
+                        status_queue.put(msg)
+                        continue
+                    else:
+                        # Folder has not been moved to output_dir yet
+                        msg = (
+                            "%sCopying job to the directory:%s%s Job id: %s%s%s"
+                            % (
+                                Fore.MAGENTA,
+                                Fore.RESET,
+                                output_path,
+                                Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                                job_id,
                                 Fore.RESET,
                             )
                         )
                         status_queue.put(msg)
+                        shutil.copytree(delivery_path, output_path)
+
+                        if events:
+                            events.emit(
+                                "download_complete",
+                                job_id=job_id,
+                                obs_id=obs_id,
+                                state=JOB_STATE_READY_FOR_DOWNLOAD,
+                                nbytes=file_size,
+                            )
                         continue
+                else:
+                    # Folder does not exist on current system. Let the user know it's ready and exit
+                    msg = (
+                        "%sReady on /%s:%s Job id: %s%s%s file: %s%s%s"
+                        % (
+                            Fore.GREEN,
+                            delivery,
+                            Fore.RESET,
+                            Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                            job_id,
+                            Fore.RESET,
+                            Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                            delivery_path,
+                            Fore.RESET,
+                        )
+                    )
+                    status_queue.put(msg)
+                    continue
 
-            except Exception as e:
-                result_queue.put(Result(job_id, obs_id, e, e))
-                continue
+        except Exception as e:
+            if events:
+                events.emit("error", job_id=job_id, obs_id=obs_id, error=e)
 
-        _remove_submitted(submit_lock, submitted_jobs, job_id)
+            result_queue.put(Result(job_id, obs_id, e, e, output_dir))
+            continue
+        finally:
+            if claim:
+                claims.release(claim)
 
+    return deferred
 
-def status_func(status_queue):
-    while True:
-        status = status_queue.get()
-        if not status:
-            break
 
-        print(status)
-        sys.stdout.flush()
+def guarded_download_job(item, session, output_dir, result_queue, *args, **kwargs):
+    # download_job for the download threads. Anything it did not expect is
+    # reported as the job's error rather than ending the thread, which would
+    # leave the job tracked for ever
+    try:
+        return download_job(item, session, output_dir, result_queue, *args, **kwargs)
+    except Exception as e:
+        result_queue.put(
+            Result(
+                int(item["row"]["id"]),
+                item["row"]["job_params"]["obs_id"],
+                e,
+                e,
+                output_dir,
+            )
+        )
+        return False
 
 
-def notify_func(
-    notify,
+def download_zip_members(
+    job_id, file_url, file_size, output_dir, file_filter, status_queue
+):
+    # Returns the number of bytes fetched
+    from mantaray.api.remotezip import extract_zip_members
+
+    extracted, fetched = extract_zip_members(
+        file_url, file_size, output_dir, file_filter.wants_member
+    )
+
+    if not extracted:
+        status_queue.put(
+            "%sSkipping:%s Job id: %s file: %s has no members matching %s"
+            % (Fore.MAGENTA, Fore.RESET, job_id, file_url,
+               ", ".join(file_filter.members))
+        )
+
+    for path, size, downloaded in extracted:
+        status_queue.put(
+            "%sDownload complete:%s Job id: %s%s%s file: %s%s%s (%s bytes%s)"
+            % (
+                Fore.GREEN,
+                Fore.RESET,
+                Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                job_id,
+                Fore.RESET,
+                Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                path,
+                Fore.RESET,
+                size,
+                "" if downloaded else ", already downloaded",
+            )
+        )
+
+    return fetched
+
+
+def download_func(
     submit_lock,
     submitted_jobs,
     download_queue,
     result_queue,
     status_queue,
-    verbose,
+    session,
+    output_dir,
+    events=None,
+    claims=None,
+    selection=None,
+    layout=None,
+    cancel=None,
 ):
     while True:
-        item = notify.recv()
-        if not item:
-            result_queue.put(None)
+        item = download_queue.get()
+        if not item or (cancel is not None and cancel.is_set()):
+            break
+
+        deferred = guarded_download_job(
+            item,
+            session,
+            output_dir,
+            result_queue,
+            status_queue,
+            events,
+            claims,
+            selection,
+            layout,
+            cancel,
+        )
+        if cancel is not None and cancel.is_set():
             break
 
-        action = item["action"]
+        if deferred:
+            # Look again once the other process has had time to finish, or
+            # for its lease to run out if it has died
+            timer = Timer(claims.retry_interval, download_queue.put, (item,))
+            timer.daemon = True
+            timer.start()
+            continue
+
         job_id = int(item["row"]["id"])
-        obs_id = item["row"]["job_params"]["obs_id"]
-        job_state = item["row"]["job_state"]
+        _remove_submitted(submit_lock, submitted_jobs, job_id, result_queue)
+
+
+# Seconds Ctrl-C waits for the download threads to stop
+STOP_TIMEOUT = 10.0
+
+
+def stop_downloads(cancel, threads, download_queue, timeout=STOP_TIMEOUT):
+    # Tell the download threads to stop at their next chunk, and wait for them
+    # to close their files so what they have downloaded is kept
+    cancel.set()
+    for _ in threads:
+        download_queue.put(None)
+
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+
+
+def status_func(status_queue, quiet=False):
+    while True:
+        status = status_queue.get()
+        if not status:
+            break
+
+        if quiet:
+            continue
+
+        # Messages may be deferred so they are only formatted when printed
+        if callable(status):
+            status = status()
+
+        print(status)
+        sys.stdout.flush()
+
+
+# Seconds to wait before trying to reconnect again, doubling up to the most
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+def retry_with_backoff(func, status_queue):
+    # Calls func until it works, for reconnecting when the server may be down
+    # for a while
+    delay = RECONNECT_DELAY
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            status_queue.put(
+                "Could not reconnect ({0}), trying again in {1:.0f}s".format(e, delay)
+            )
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+# Most notifications the notifier thread takes off the websocket at once
+MAX_NOTIFY_BATCH = 1000
+
+
+def is_terminal_notification(item):
+    return item["action"] == "DELETE" or item["row"]["job_state"] in (
+        JOB_STATE_READY_FOR_DOWNLOAD,
+        JOB_STATE_ERROR,
+        JOB_STATE_CANCELLED,
+    )
+
+
+def coalesce_notifications(items):
+    # Keep only the latest intermediate state of each job, since a burst can
+    # bring several for the same job at once. Terminal states and deletes
+    # are always kept, in the order they arrived
+    latest = OrderedDict()
+    terminal = []
+    ended = set()
+
+    for item in items:
+        job_id = int(item["row"]["id"])
+
+        if is_terminal_notification(item):
+            latest.pop(job_id, None)
+            ended.add(job_id)
+            terminal.append(item)
+        elif job_id not in ended:
+            latest[job_id] = item
+
+    return list(latest.values()) + terminal
+
+
+def notify_reader_func(notify, frame_queue):
+    # Reads the websocket as fast as it can, so the notifier thread can take
+    # whatever has built up in one go
+    try:
+        while True:
+            item = notify.recv()
+            if not item:
+                break
+            frame_queue.put(item)
+    finally:
+        frame_queue.put(None)
+
+
+def next_notification_batch(frame_queue, max_batch=MAX_NOTIFY_BATCH):
+    # Waits for one notification, then takes any others already waiting.
+    # Returns (items, closed)
+    items = [frame_queue.get()]
+
+    while items[-1] is not None and len(items) < max_batch:
+        try:
+            items.append(frame_queue.get_nowait())
+        except Empty:
+            break
+
+    if items[-1] is None:
+        return items[:-1], True
+    return items, False
+
+
+# Most jobs whose early notifications are kept, see EarlyNotifications
+MAX_EARLY_NOTIFICATIONS = 10000
+
+# acted_on entries allowed beyond twice the tracked jobs before those of
+# jobs no longer tracked are dropped, see notify_func
+ACTED_ON_SLACK = 1000
+
+
+class EarlyNotifications(object):
+    # The notifier is connected before jobs are submitted, so a job can
+    # finish before submit_jobs has its id back from the server. Terminal
+    # notifications for jobs not tracked yet are kept here (up to limit),
+    # and handed back to the notifier once the job is tracked. Only used
+    # with submit_lock held
+    def __init__(self, limit=MAX_EARLY_NOTIFICATIONS):
+        self._limit = limit
+        self._items = OrderedDict()
+        self._frame_queue = None
+        self._closed = False
+
+    def attach(self, frame_queue):
+        self._frame_queue = frame_queue
+
+    def hold(self, item):
+        if self._closed or self._frame_queue is None:
+            return
+        self._items[int(item["row"]["id"])] = item
+        if len(self._items) > self._limit:
+            self._items.popitem(last=False)
+
+    def release(self, job_ids):
+        for job_id in job_ids:
+            item = self._items.pop(int(job_id), None)
+            if item is not None:
+                self._frame_queue.put(item)
+
+    def close(self):
+        # Every job has been submitted, nothing more will be released
+        self._closed = True
+        self._items.clear()
+
 
-        msg = get_status_message(item, verbose, True)
-        no_color_msg = get_status_message(
-            item, verbose, False
-        )  # get uncolorised output for error file
+def notify_func(
+    notify,
+    submit_lock,
+    submitted_jobs,
+    download_queue,
+    result_queue,
+    status_queue,
+    verbose,
+    events=None,
+    preflight=None,
+    early=None,
+):
+    frame_queue = Queue()
+    reader_thread = Thread(target=notify_reader_func, args=(notify, frame_queue))
+    reader_thread.daemon = True
+    reader_thread.start()
 
+    if early is not None:
         with submit_lock:
-            if action == "DELETE":
-                status_queue.put(msg)
+            early.attach(frame_queue)
 
-                _remove_submitted(submit_lock, submitted_jobs, job_id)
-                continue
+    # (job id, terminal state or DELETE) already acted on, in case the server
+    # sends one twice
+    acted_on = set()
+    closed = False
 
-            if job_id in submitted_jobs:
-                if job_state == JOB_STATE_QUEUED:
-                    status_queue.put(msg)
-                
-                elif job_state == JOB_STATE_WAIT_CAL:
-                    status_queue.put(msg)
-                
-                elif job_state == JOB_STATE_STAGING:
-                    status_queue.put(msg)
-                
-                elif job_state == JOB_STATE_STAGED:
-                    status_queue.put(msg)
-                
-                elif job_state == JOB_STATE_DOWNLOADING:
-                    status_queue.put(msg)
+    while not closed:
+        items, closed = next_notification_batch(frame_queue)
 
-                elif job_state == JOB_STATE_PREPROCESSING:
-                    status_queue.put(msg)
-                
-                elif job_state == JOB_STATE_IMAGING:
-                    status_queue.put(msg)
-                
-                elif job_state == JOB_STATE_DELIVERING:
-                    status_queue.put(msg)
+        with submit_lock:
+            # One membership check per notification, however many jobs
+            tracked = set(submitted_jobs) if len(items) > 1 else submitted_jobs
+
+            for item in coalesce_notifications(items):
+                handle_notification(
+                    item,
+                    submit_lock,
+                    submitted_jobs,
+                    tracked,
+                    acted_on,
+                    download_queue,
+                    result_queue,
+                    status_queue,
+                    verbose,
+                    events,
+                    preflight,
+                    early,
+                )
 
-                elif job_state == JOB_STATE_READY_FOR_DOWNLOAD:
-                    status_queue.put(msg)
+            # Only tracked jobs are acted on, so the rest can be forgotten
+            if len(acted_on) > 2 * len(submitted_jobs) + ACTED_ON_SLACK:
+                current = set(submitted_jobs)
+                acted_on = set(key for key in acted_on if key[0] in current)
 
-                    download_queue.put(item)
+    result_queue.put(None)
 
-                elif job_state == JOB_STATE_ERROR:
-                    result_queue.put(Result(job_id, obs_id, msg, no_color_msg))
 
-                    _remove_submitted(submit_lock, submitted_jobs, job_id)
+def handle_notification(
+    item,
+    submit_lock,
+    submitted_jobs,
+    tracked,
+    acted_on,
+    download_queue,
+    result_queue,
+    status_queue,
+    verbose,
+    events=None,
+    preflight=None,
+    early=None,
+):
+    # Called with submit_lock held
+    action = item["action"]
+    job_id = int(item["row"]["id"])
+    obs_id = item["row"]["job_params"]["obs_id"]
+    job_state = item["row"]["job_state"]
+    is_tracked = job_id in tracked
 
-                elif job_state == JOB_STATE_CANCELLED:
-                    # do not consider cancelled as an error
-                    status_queue.put(msg)
+    if is_terminal_notification(item):
+        if not is_tracked:
+            # It may be one of ours whose id is not back from the server yet
+            if early is not None:
+                early.hold(item)
+        else:
+            key = (job_id, "DELETE" if action == "DELETE" else job_state)
+            if key in acted_on:
+                return
+            acted_on.add(key)
+
+    # Formatted by the status thread, and only if it is printed
+    msg = partial(get_status_message, item, verbose, True)
+
+    if action == "DELETE":
+        if events:
+            events.emit("deleted", job_id=job_id, obs_id=obs_id, state=job_state)
+
+        status_queue.put(msg)
+
+        _remove_submitted(submit_lock, submitted_jobs, job_id, result_queue)
+        if tracked is not submitted_jobs:
+            tracked.discard(job_id)
+        return
 
-                    _remove_submitted(submit_lock, submitted_jobs, job_id)
+    if not is_tracked:
+        return
+
+    if events:
+        emit_state_event(events, item)
+
+    if job_state == JOB_STATE_READY_FOR_DOWNLOAD:
+        status_queue.put(msg)
+
+        if preflight:
+            preflight.completed(item, tracked)
+        download_queue.put(item)
+
+    elif job_state == JOB_STATE_ERROR:
+        result_queue.put(
+            Result(
+                job_id,
+                obs_id,
+                get_status_message(item, verbose, True),
+                # get uncolorised output for error file
+                get_status_message(item, verbose, False),
+            )
+        )
+
+        _remove_submitted(submit_lock, submitted_jobs, job_id, result_queue)
+        if tracked is not submitted_jobs:
+            tracked.discard(job_id)
+
+    elif job_state == JOB_STATE_CANCELLED:
+        # do not consider cancelled as an error
+        status_queue.put(msg)
+
+        _remove_submitted(submit_lock, submitted_jobs, job_id, result_queue)
+        if tracked is not submitted_jobs:
+            tracked.discard(job_id)
+
+    elif job_state in (
+        JOB_STATE_QUEUED,
+        JOB_STATE_WAIT_CAL,
+        JOB_STATE_STAGING,
+        JOB_STATE_STAGED,
+        JOB_STATE_DOWNLOADING,
+        JOB_STATE_PREPROCESSING,
+        JOB_STATE_IMAGING,
+        JOB_STATE_DELIVERING,
+    ):
+        status_queue.put(msg)
+
+        if preflight and job_state == JOB_STATE_DELIVERING:
+            preflight.delivering(item)
+
+
+def emit_state_event(events, item):
+    row = item["row"]
+    job_state = row["job_state"]
+    nbytes = None
+    error = None
+
+    if job_state == JOB_STATE_READY_FOR_DOWNLOAD:
+        nbytes = sum(int(prod["size"]) for prod in row["product"]["files"])
+    elif job_state == JOB_STATE_ERROR:
+        error = row["error_text"]
+
+    events.emit(
+        "state",
+        job_id=int(row["id"]),
+        obs_id=row["job_params"]["obs_id"],
+        state=job_state,
+        nbytes=nbytes,
+        error=error,
+    )
 
 
 def get_job_summary(job_id, obs_id, job_type_desc, use_colour):
@@ -635,16 +1493,12 @@ def get_status_message(item, verbose, use_colour):
 
 
 def get_job_list(session):
-    jobs = []
-
+    # Yields a JobRecord for each of the user's jobs as the server's response
+    # arrives. Use record.item for the full job
     try:
         # Get all the user's jobs via the API
-        result = session.get_jobs()
-
-        if result:
-            for job in result:
-                jobs.append(job)
-        return jobs
+        for record in session.iter_jobs():
+            yield record
 
     except Exception as e:
         # Error getting job list
@@ -653,33 +1507,41 @@ def get_job_list(session):
         )
 
 
-def get_jobs_status(session, status_queue, verbose):
+def get_record_status_message(record, verbose, use_colour):
+    return get_status_message(record.item, verbose, use_colour)
+
+
+def get_jobs_status(session, status_queue, verbose, events=None):
     # Returns the number of jobs the user has and places a status message for each one
-    jobs = get_job_list(session)
+    job_count = 0
 
-    if jobs:
-        for j in jobs:
-            msg = get_status_message(j, verbose, True)
-            status_queue.put(msg)
+    for j in get_job_list(session):
+        job_count += 1
 
-    return len(jobs)
+        if events:
+            emit_state_event(events, j.item)
+
+        # The job is only expanded if the message is printed
+        status_queue.put(partial(get_record_status_message, j, verbose, True))
+
+    return job_count
 
 
 def enqueue_all_ready_to_download_jobs(
-    session, download_queue, status_queue, verbose
+    session, download_queue, status_queue, verbose, events=None
 ):
     submitted_jobs = []
-    jobs = get_job_list(session)
-
-    for j in jobs:
-        job_state = j["row"]["job_state"]
 
+    for record in get_job_list(session):
         # Check is ready for download
-        if job_state == JOB_STATE_READY_FOR_DOWNLOAD:
-            job_id = j["row"]["id"]
-            submitted_jobs.append(job_id)
-            msg = get_status_message(j, verbose, True)
-            status_queue.put(msg)
+        if record.state == JOB_STATE_READY_FOR_DOWNLOAD:
+            j = record.item
+            submitted_jobs.append(record.id)
+
+            if events:
+                emit_state_event(events, j)
+
+            status_queue.put(partial(get_status_message, j, verbose, True))
             download_queue.put(j)
 
     return submitted_jobs
@@ -689,22 +1551,19 @@ def check_job_is_downloadable_and_enqueue(
     session, download_queue, result_queue, job_id
 ):
     submitted_jobs = []
-    jobs = get_job_list(session)
     found_job = None
 
     # Check this is job owned by the user
-    for j in jobs:
-        j_job_id = int(j["row"]["id"])
-
-        if j_job_id == int(job_id):
+    for j in get_job_list(session):
+        if j.id == int(job_id):
             found_job = j
             break
 
     if found_job:
         # Check is ready for download
-        job_state = found_job["row"]["job_state"]
-        obs_id = found_job["row"]["job_params"]["obs_id"]
-        job_type_desc = JOB_TYPE_VALUES.get(found_job["row"]["job_type"])
+        job_state = found_job.state
+        obs_id = found_job.obs_id
+        job_type_desc = JOB_TYPE_VALUES.get(found_job.job_type)
 
         if job_state != JOB_STATE_READY_FOR_DOWNLOAD:
             colour_msg = (
@@ -724,7 +1583,7 @@ def check_job_is_downloadable_and_enqueue(
         else:
             # Put this in the download queue
             submitted_jobs.append(job_id)
-            download_queue.put(found_job)
+            download_queue.put(found_job.item)
             return submitted_jobs
 
     else:
@@ -742,6 +1601,307 @@ def check_job_is_downloadable_and_enqueue(
         return []
 
 
+def verify_downloads(
+    items,
+    output_dir,
+    selection,
+    download_queue,
+    result_queue,
+    status_queue,
+    requeue=False,
+    workers=None,
+    layout=None,
+):
+    # Check the downloaded files of each job against the server's sha1. Bad
+    # files are reported as errors, or with requeue removed and their jobs
+    # downloaded again. Returns the ids of the jobs queued for download
+    from mantaray.scripts.verify import FILE_MISSING, FILE_OK, verify_files
+
+    def progress(item, file_name, path, status):
+        job_id = item["row"]["id"]
+        if status == FILE_OK:
+            status_queue.put(
+                "%sVerified:%s Job id: %s%s%s file: %s%s%s"
+                % (
+                    Fore.GREEN,
+                    Fore.RESET,
+                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                    job_id,
+                    Fore.RESET,
+                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                    path,
+                    Fore.RESET,
+                )
+            )
+        else:
+            status_queue.put(
+                "%sVerify failed (%s):%s Job id: %s%s%s file: %s%s%s"
+                % (
+                    Fore.RED,
+                    status,
+                    Fore.RESET,
+                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                    job_id,
+                    Fore.RESET,
+                    Fore.LIGHTWHITE_EX + Style.BRIGHT,
+                    path,
+                    Fore.RESET,
+                )
+            )
+
+    start = time.monotonic()
+    report = verify_files(items, output_dir, selection, workers, progress, layout)
+    elapsed = time.monotonic() - start
+
+    status_queue.put(
+        "Verified {0} files in {1:.1f}s: {2} bad, {3} hashed ({4:.1f} MB/s),"
+        " {5} unchanged since last verified".format(
+            report.files,
+            elapsed,
+            len(report.problems),
+            report.hashed,
+            report.hashed_bytes / 1024.0 / 1024.0 / elapsed if elapsed > 0 else 0,
+            report.cached,
+        )
+    )
+
+    requeued = OrderedDict()
+    for item, file_name, path, status in report.problems:
+        job_id = int(item["row"]["id"])
+        obs_id = item["row"]["job_params"]["obs_id"]
+
+        if not requeue:
+            colour_msg = "{0}Error: {1} failed verification ({2}){3}".format(
+                Fore.RED, path, status, Fore.RESET
+            )
+            no_colour_msg = "Error: {0} failed verification ({1})".format(
+                path, status
+            )
+            result_queue.put(
+                Result(job_id, obs_id, colour_msg, no_colour_msg, path)
+            )
+            continue
+
+        # download_job skips files which are already the right size
+        if status != FILE_MISSING:
+            os.remove(path)
+        requeued[job_id] = item
+
+    for item in requeued.values():
+        download_queue.put(item)
+
+    return list(requeued)
+
+
+def bulk_update_jobs(
+    session,
+    selector,
+    cancel_jobs,
+    dry_run,
+    workers,
+    result_queue,
+    status_queue,
+    events=None,
+):
+    # Cancel or resubmit every job selector picks, several at a time
+    from mantaray.scripts.bulk import cancel, resubmit, run_bulk
+
+    records = selector.select(get_job_list(session))
+    action, done = ("cancel", "Cancelled") if cancel_jobs else ("resubmit", "Resubmitted")
+
+    skipped = ""
+    if selector.undated:
+        status_queue.put(
+            "{0}Warning:{1} the server did not say when {2} jobs were created,"
+            " so --older-than skipped them".format(
+                Fore.YELLOW, Fore.RESET, selector.undated
+            )
+        )
+        skipped = "; {0} skipped with no creation time".format(selector.undated)
+
+    def summary(record):
+        return get_job_summary(
+            record.id, record.obs_id, JOB_TYPE_VALUES.get(record.job_type), True
+        )
+
+    if dry_run:
+        for record in records:
+            status_queue.put(
+                "%sWould %s:%s %s" % (Fore.MAGENTA, action, Fore.RESET, summary(record))
+            )
+        status_queue.put(
+            "{0} jobs would be {1}{2} (dry run)".format(
+                len(records), done.lower(), skipped
+            )
+        )
+        return
+
+    def progress(record, new_job_id, error):
+        if error is not None:
+            colour_msg = "{0}Error: could not {1} job:{2} {3}; {4}".format(
+                Fore.RED, action, Fore.RESET, summary(record), error
+            )
+            no_colour_msg = "Error: could not {0} job {1}: {2}".format(
+                action, record.id, error
+            )
+            result_queue.put(
+                Result(record.id, record.obs_id, colour_msg, no_colour_msg)
+            )
+            return
+
+        if cancel_jobs:
+            status_queue.put("%sCancelled:%s %s" % (Fore.GREEN, Fore.RESET, summary(record)))
+            if events:
+                events.emit(
+                    "cancelled",
+                    job_id=record.id,
+                    obs_id=record.obs_id,
+                    state=JOB_STATE_CANCELLED,
+                )
+        else:
+            status_queue.put(
+                "%sResubmitted:%s %s as job %s"
+                % (Fore.GREEN, Fore.RESET, summary(record), new_job_id)
+            )
+            if events:
+                events.emit(
+                    "submitted",
+                    job_id=new_job_id,
+                    obs_id=record.obs_id,
+                    state=JOB_STATE_QUEUED,
+                )
+
+    if workers > 10:
+        session.set_pool_size(workers)
+
+    result = run_bulk(
+        session, records, cancel if cancel_jobs else resubmit, workers, progress
+    )
+
+    msg = "{0} {1} of {2} jobs in {3:.1f}s{4}".format(
+        done, result.succeeded, len(records), result.elapsed, skipped
+    )
+    if result.failed:
+        msg += "; {0} failed: {1}".format(
+            result.failed,
+            ", ".join(
+                "{0} ({1})".format(reason, count)
+                for reason, count in result.failures.most_common()
+            ),
+        )
+    status_queue.put(msg)
+
+
+def report_voltage_requests(voltage_groups, active_ids, status_queue):
+    # One line for each split voltage request whose parts have all finished
+    for request in voltage_groups.update(active_ids):
+        if request.failed or None in request.job_ids:
+            status_queue.put(
+                "{0}{1}{2}".format(Fore.RED, request.summary(), Fore.RESET)
+            )
+        else:
+            status_queue.put(request.summary())
+
+
+def resume_campaign(
+    campaign,
+    session,
+    submit_lock,
+    submitted_jobs,
+    download_queue,
+    result_queue,
+    status_queue,
+    verbose,
+):
+    # Pick up the jobs an interrupted campaign had in flight. They are
+    # tracked before the job list is fetched, so no notification is missed
+    job_ids = list(campaign.in_flight)
+    if not job_ids:
+        return
+
+    with submit_lock:
+        submitted_jobs.extend(job_ids)
+
+    records = dict(
+        (r.id, r) for r in get_job_list(session) if r.id in campaign.in_flight
+    )
+
+    for job_id in job_ids:
+        record = records.get(job_id)
+        if record is None:
+            campaign.failed(job_id, "Job no longer exists on the server")
+            _remove_submitted(submit_lock, submitted_jobs, job_id)
+        elif record.state == JOB_STATE_READY_FOR_DOWNLOAD:
+            download_queue.put(record.item)
+        elif record.state == JOB_STATE_ERROR:
+            item = record.item
+            result_queue.put(
+                Result(
+                    job_id,
+                    record.obs_id,
+                    get_status_message(item, verbose, True),
+                    get_status_message(item, verbose, False),
+                )
+            )
+            _remove_submitted(submit_lock, submitted_jobs, job_id)
+        elif record.state == JOB_STATE_CANCELLED:
+            _remove_submitted(submit_lock, submitted_jobs, job_id)
+
+    status_queue.put(
+        "Resumed campaign with {0} jobs in flight".format(len(job_ids))
+    )
+
+
+def fill_campaign(
+    campaign,
+    session,
+    submit_lock,
+    submitted_jobs,
+    existing_jobs,
+    status_queue,
+    download_queue,
+    events=None,
+    selection=None,
+    early=None,
+):
+    # Submit the campaign's next jobs, as far as its window allows
+    with submit_lock:
+        active = set(submitted_jobs)
+    campaign.update(active)
+
+    while True:
+        row = campaign.next_row()
+        if row is None:
+            break
+        index, job = row
+
+        ready = Queue()
+        job_ids, error_code = submit_job(
+            session,
+            job,
+            index + 1,
+            submitted_jobs,
+            existing_jobs,
+            status_queue,
+            ready,
+            events,
+            selection,
+        )
+        track_submitted(
+            submit_lock, submitted_jobs, job_ids, ready, download_queue, early
+        )
+
+        if campaign.submitted(index, job_ids, error_code):
+            status_queue.put(
+                "{0}Server turned down job #{1}{2} (error code {3}), trying again"
+                " in {4:.0f}s".format(
+                    Fore.MAGENTA, index + 1, Fore.RESET, error_code, REJECT_BACKOFF
+                )
+            )
+
+    campaign.save()
+
+
 class ParseDownloadOnly(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         # Acceptable values are:
@@ -749,8 +1909,8 @@ class ParseDownloadOnly(argparse.Action):
         # Positive integer == specific job
         # all|ALL,etc      == all jobs, same as 0
         msg = (
-            "'{0}' is not valid for -w / --download-only. Try a Job Id, or"
-            " 'all' for all jobs.".format(values)
+            "'{0}' is not valid for {1}. Try a Job Id, or"
+            " 'all' for all jobs.".format(values, option_string)
         )
 
         try:
@@ -768,112 +1928,535 @@ class ParseDownloadOnly(argparse.Action):
 
 def mwa_client():
     version_string = get_pretty_version_string()
-    print(version_string)
 
-    epi = (
-        "\nExamples: \nmwa_client -c csvfile -d destdir           Submit jobs"
-        " in the csv file, monitor them, then download the files, then"
-        " exit\nmwa_client -c csvfile -s                   Submit jobs in the"
-        " csv file, then exit\nmwa_client -d destdir -w JOBID            "
-        " Download the job id (assuming it is ready to download), then"
-        " exit\nmwa_client -d destdir -w all               Download any ready"
-        " to download jobs, then exit\nmwa_client -d destdir -w all -e"
-        " error_file Download any ready to download jobs, then exit, writing"
-        " any errors to error_file\nmwa_client -l                             "
-        " List all of your jobs and their status, then exit"
+    epi = (
+        "\nExamples: \nmwa_client -c csvfile -d destdir           Submit jobs"
+        " in the csv file, monitor them, then download the files, then"
+        " exit\nmwa_client -c csvfile -s                   Submit jobs in the"
+        " csv file, then exit\nmwa_client -d destdir -w JOBID            "
+        " Download the job id (assuming it is ready to download), then"
+        " exit\nmwa_client -d destdir -w all               Download any ready"
+        " to download jobs, then exit\nmwa_client -d destdir -w all -e"
+        " error_file Download any ready to download jobs, then exit, writing"
+        " any errors to error_file\nmwa_client -l                             "
+        " List all of your jobs and their status, then exit"
+    )
+    desc = (
+        "{0}\n==============================\n\nThe mwa_client is a"
+        " command-line tool for submitting, monitoring and \ndownloading jobs"
+        " from the MWA ASVO (https://asvo.mwatelescope.org). \nPlease see"
+        " README.md for csv file format and other details.".format(
+            version_string
+        )
+    )
+
+    parser = argparse.ArgumentParser(
+        description=desc,
+        epilog=epi,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        "-s",
+        "--submit-only",
+        action="store_true",
+        dest="submit_only",
+        help="submit job(s) from csv file then exit (-d is ignored)",
+        default=False,
+    )
+
+    group.add_argument(
+        "-l",
+        "--list-only",
+        action="store_true",
+        dest="list_only",
+        help=(
+            "List the user's active job(s) and exit immediately (-s, -c & -d"
+            " are ignored)"
+        ),
+        default=False,
+    )
+
+    group.add_argument(
+        "-w",
+        "--download-only",
+        action=ParseDownloadOnly,
+        dest="download_job_id",
+        help=(
+            "Download the job id (-w DOWNLOAD_JOB_ID), if it is ready; or all"
+            " downloadable jobs (-w all | -w 0), then exit (-s, -c & -l are"
+            " ignored)"
+        ),
+    )
+
+    group.add_argument(
+        "--verify",
+        action=ParseDownloadOnly,
+        dest="verify_job_id",
+        help=(
+            "Check the downloaded files of the job id (--verify JOB_ID), or of"
+            " all downloadable jobs (--verify all), in -d against the server's"
+            " sha1 and list any which are missing or corrupt, then exit (-s, -c"
+            " & -l are ignored)"
+        ),
+        metavar="JOB_ID",
+    )
+
+    group.add_argument(
+        "--cancel",
+        action="store_true",
+        dest="cancel",
+        help=(
+            "Cancel every job chosen with --state, --obs-id, --job-type and"
+            " --older-than, then exit"
+        ),
+        default=False,
+    )
+
+    group.add_argument(
+        "--resubmit",
+        action="store_true",
+        dest="resubmit",
+        help=(
+            "Submit again, with the same parameters, every job chosen with"
+            " --state, --obs-id, --job-type and --older-than, then exit"
+        ),
+        default=False,
+    )
+
+    group.add_argument(
+        "--daemon",
+        dest="spool_dir",
+        help=(
+            "Run until interrupted, submitting each csv file placed in"
+            " SPOOL_DIR and downloading its jobs into a directory of the same"
+            " name under -d. Progress is written to <name>.status.json in"
+            " SPOOL_DIR (-s, -c, -l & -w are ignored)"
+        ),
+        metavar="SPOOL_DIR",
+        default=None,
+    )
+
+    group.add_argument(
+        "--mirror",
+        action="store_true",
+        dest="mirror",
+        help=(
+            "Run until interrupted, downloading into -d every job which is"
+            " ready to download, whoever submitted it, as soon as the notifier"
+            " says it is ready (-s, -c, -l & -w are ignored)"
+        ),
+        default=False,
+    )
+
+    parser.add_argument(
+        "-c", "--csv", dest="csvfile", help="csv job file", metavar="FILE"
+    )
+
+    parser.add_argument(
+        "-d", "--dir", dest="outdir", help="download directory", metavar="DIR"
+    )
+
+    parser.add_argument(
+        "-e",
+        "--error-file",
+        "--errfile",
+        dest="errfile",
+        help="Write errors in json format to an error file",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--results",
+        dest="results_file",
+        help=(
+            "Append each error to FILE as a line of JSON as soon as it happens,"
+            " and keep a summary in FILE.summary.json, so both can be read"
+            " while mwa_client is running"
+        ),
+        metavar="FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        help="verbose output",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-ar",
+        "--allow-resubmit",
+        help="Will allow a job with the same parameters and an existing job in your queue in Completed, Error or Cancelled status to be resubmitted. Default is to not allow resubmission if the new job matches the parameters of an existing job in your queue.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        dest="skip_validation",
+        help=(
+            "Do not check csv job parameters before submitting them; leave it"
+            " to the server"
+        ),
+        default=False,
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        dest="poll_interval",
+        type=float,
+        help="seconds between checks of the --daemon spool directory (default 2)",
+        default=2.0,
+    )
+
+    parser.add_argument(
+        "--cache-login",
+        dest="cookie_cache",
+        nargs="?",
+        const="",
+        help=(
+            "Keep the login cookie in FILE (default"
+            " ~/.cache/mwa_client/cookies.json), readable only by you, and"
+            " reuse it in later runs until the server rejects it"
+        ),
+        metavar="FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--requeue",
+        action="store_true",
+        dest="requeue",
+        help="With --verify, download any missing or corrupt files again",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--verify-workers",
+        dest="verify_workers",
+        type=int,
+        help="With --verify, the number of processes hashing files (default: one per CPU)",
+        metavar="N",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--state",
+        dest="states",
+        action="append",
+        help=(
+            "With --cancel or --resubmit, only jobs in STATE (e.g. queued,"
+            " error, or ready for completed jobs). May be comma separated or"
+            " given more than once"
+        ),
+        metavar="STATE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--obs-id",
+        dest="obs_range",
+        help=(
+            "With --cancel or --resubmit, only jobs for observations in RANGE:"
+            " an obs_id or FIRST..LAST, where either end may be left out"
+        ),
+        metavar="RANGE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--job-type",
+        dest="job_types",
+        action="append",
+        help=(
+            "With --cancel or --resubmit, only jobs of TYPE: c (conversion),"
+            " d (download) or v (voltage)"
+        ),
+        metavar="TYPE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--older-than",
+        dest="older_than",
+        help="With --cancel or --resubmit, only jobs created more than AGE ago (e.g. 30m, 12h, 2d)",
+        metavar="AGE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        dest="dry_run",
+        help="With --cancel or --resubmit, list the jobs which would be changed and exit",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--bulk-workers",
+        dest="bulk_workers",
+        type=int,
+        help="With --cancel or --resubmit, the number of requests made at once (default 8)",
+        metavar="N",
+        default=8,
+    )
+
+    parser.add_argument(
+        "--campaign",
+        dest="campaign_file",
+        help=(
+            "Work through the csv file a few jobs at a time (see"
+            " --max-in-flight and --max-pending-bytes), submitting more as"
+            " earlier ones are downloaded. Progress is kept in FILE, and"
+            " running the same command again carries on from where it stopped"
+        ),
+        metavar="FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--max-in-flight",
+        dest="max_in_flight",
+        type=int,
+        help=(
+            "With --campaign, the most jobs submitted and not yet downloaded"
+            " at any time (default 100)"
+        ),
+        metavar="N",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--max-pending-bytes",
+        dest="max_pending_bytes",
+        help=(
+            "With --campaign, submit no more jobs while completed jobs waiting"
+            " to be downloaded add up to SIZE (e.g. 500G, 2T)"
+        ),
+        metavar="SIZE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--no-preflight",
+        action="store_false",
+        dest="preflight",
+        help=(
+            "Do not open connections to the download host and check files and"
+            " free space while jobs are delivering"
+        ),
+        default=True,
     )
-    desc = (
-        "{0}\n==============================\n\nThe mwa_client is a"
-        " command-line tool for submitting, monitoring and \ndownloading jobs"
-        " from the MWA ASVO (https://asvo.mwatelescope.org). \nPlease see"
-        " README.md for csv file format and other details.".format(
-            version_string
-        )
+
+    parser.add_argument(
+        "--split-voltage",
+        dest="split_voltage",
+        type=int,
+        help=(
+            "Split voltage jobs longer than SECONDS into jobs of at most"
+            " SECONDS each, submitted together and reported on as one request"
+        ),
+        metavar="SECONDS",
+        default=None,
     )
 
-    parser = argparse.ArgumentParser(
-        description=desc,
-        epilog=epi,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
+    parser.add_argument(
+        "--profiles",
+        dest="profiles_file",
+        help=(
+            "Read more MWA ASVO endpoints and API keys from FILE, and submit"
+            " each csv row to the one named in its profile column (rows"
+            " without one use the MWA_ASVO_* environment variables)"
+        ),
+        metavar="FILE",
+        default=None,
     )
-    group = parser.add_mutually_exclusive_group()
 
-    group.add_argument(
-        "-s",
-        "--submit-only",
-        action="store_true",
-        dest="submit_only",
-        help="submit job(s) from csv file then exit (-d is ignored)",
-        default=False,
+    parser.add_argument(
+        "--layout",
+        dest="layout",
+        help=(
+            "Put each job's files in a directory under -d named by TEMPLATE,"
+            " e.g. '{obs_id}/{job_id}' or '{shard}/{obs_id}'. Fields are"
+            " obs_id, job_id, job_type, shard (two hex digits from the"
+            " obs_id) and profile (see --profiles). The default is to put"
+            " every file directly in -d"
+        ),
+        metavar="TEMPLATE",
+        default=None,
     )
 
-    group.add_argument(
-        "-l",
-        "--list-only",
-        action="store_true",
-        dest="list_only",
+    parser.add_argument(
+        "--include",
+        dest="include",
+        action="append",
         help=(
-            "List the user's active job(s) and exit immediately (-s, -c & -d"
-            " are ignored)"
+            "Only download product files whose name matches PATTERN, a glob"
+            " (e.g. '*.metafits') or a regular expression prefixed with re:."
+            " May be given more than once"
         ),
-        default=False,
+        metavar="PATTERN",
+        default=None,
     )
 
-    group.add_argument(
-        "-w",
-        "--download-only",
-        action=ParseDownloadOnly,
-        dest="download_job_id",
+    parser.add_argument(
+        "--exclude",
+        dest="exclude",
+        action="append",
         help=(
-            "Download the job id (-w DOWNLOAD_JOB_ID), if it is ready; or all"
-            " downloadable jobs (-w all | -w 0), then exit (-s, -c & -l are"
-            " ignored)"
+            "Do not download product files whose name matches PATTERN (as for"
+            " --include). May be given more than once"
         ),
+        metavar="PATTERN",
+        default=None,
     )
 
     parser.add_argument(
-        "-c", "--csv", dest="csvfile", help="csv job file", metavar="FILE"
+        "--min-size",
+        dest="min_size",
+        help="Only download product files of at least SIZE bytes (e.g. 500k, 10M, 2G)",
+        metavar="SIZE",
+        default=None,
     )
 
     parser.add_argument(
-        "-d", "--dir", dest="outdir", help="download directory", metavar="DIR"
+        "--max-size",
+        dest="max_size",
+        help="Only download product files of at most SIZE bytes (e.g. 500k, 10M, 2G)",
+        metavar="SIZE",
+        default=None,
     )
 
     parser.add_argument(
-        "-e",
-        "--error-file",
-        "--errfile",
-        dest="errfile",
-        help="Write errors in json format to an error file",
+        "--members",
+        dest="members",
+        action="append",
+        help=(
+            "For zip products, download only the files inside the zip whose"
+            " name matches PATTERN (as for --include), instead of the whole"
+            " zip. May be given more than once"
+        ),
+        metavar="PATTERN",
         default=None,
     )
 
     parser.add_argument(
-        "-v",
-        "--verbose",
+        "--cooperative",
+        dest="cooperative",
         action="store_true",
-        dest="verbose",
-        help="verbose output",
+        help=(
+            "Share the output directory with other mwa_client processes, on"
+            " this or other hosts, each downloading a different part of the"
+            " work. Files are claimed through lock files in the output"
+            " directory, so each is only downloaded once"
+        ),
         default=False,
     )
 
     parser.add_argument(
-        "-ar",
-        "--allow-resubmit",
-        help="Will allow a job with the same parameters and an existing job in your queue in Completed, Error or Cancelled status to be resubmitted. Default is to not allow resubmission if the new job matches the parameters of an existing job in your queue.",
-        action="store_true",
+        "--lease",
+        dest="lease",
+        type=float,
+        help=(
+            "With --cooperative, seconds without renewal after which another"
+            " process takes over a claimed file (default 120)"
+        ),
+        default=120.0,
+    )
+
+    parser.add_argument(
+        "--record",
+        dest="record_file",
+        help=(
+            "Record every notifier message and job list received from the"
+            " server to FILE, for replaying with benchmarks/replay.py"
+        ),
+        metavar="FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--profile",
+        dest="profile_file",
+        help=(
+            "Time each stage of the run (login, submission, each job's time in"
+            " each server state, queueing and transfers), write the spans to"
+            " FILE as a Chrome trace and print a summary table at the end"
+        ),
+        metavar="FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--cprofile",
+        dest="cprofile_file",
+        help="With --profile, also write cProfile stats for all threads to FILE",
+        metavar="FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--events",
+        dest="events",
+        help=(
+            "Write one JSON record per job event, either to stdout (--events"
+            " jsonl) or to a file (--events jsonl=path). When writing to stdout"
+            " status messages are suppressed and any other output goes to"
+            " stderr."
+        ),
+        metavar="jsonl[=path]",
+        default=None,
     )
 
     args = parser.parse_args()
 
+    if args.cprofile_file and not args.profile_file:
+        raise Exception("Error: --cprofile requires --profile")
+
+    profiler = None
+    if args.profile_file:
+        from mantaray.scripts.profiling import Profiler
+
+        profiler = Profiler(args.profile_file, args.cprofile_file)
+
+        # Also write it out if we exit early
+        atexit.register(close_profiler, profiler)
+
+    events = None
+    if args.events:
+        events = EventWriter.open(args.events)
+
+        if events.to_stdout:
+            # Keep stdout for the event stream only
+            sys.stdout = sys.stderr
+
+    print(version_string)
+
     # Figure out what mode we are running in, based on the command line args
     mode_submit_only = args.submit_only is True
     mode_list_only = args.list_only is True
     mode_download_only = not (args.download_job_id is None)
+    mode_daemon = not (args.spool_dir is None)
+    mode_verify = not (args.verify_job_id is None)
+    mode_bulk = args.cancel or args.resubmit
+    mode_mirror = args.mirror
     allow_resubmit = args.allow_resubmit
 
     # full mode is the default- submit, monitor, download
-    mode_full = not (mode_submit_only or mode_list_only or mode_download_only)
+    mode_full = not (
+        mode_submit_only
+        or mode_list_only
+        or mode_download_only
+        or mode_daemon
+        or mode_verify
+        or mode_bulk
+        or mode_mirror
+    )
 
     verbose = args.verbose
 
@@ -891,6 +2474,110 @@ def mwa_client():
                 "Error: Output directory {0} is invalid.".format(outdir)
             )
 
+    # Which product files to download, unless a csv row says otherwise
+    file_filter = None
+    if args.include or args.exclude or args.min_size or args.max_size or args.members:
+        try:
+            file_filter = FileFilter(
+                args.include,
+                args.exclude,
+                parse_size(args.min_size) if args.min_size else None,
+                parse_size(args.max_size) if args.max_size else None,
+                args.members,
+            )
+        except ValueError as e:
+            raise Exception("Error: {0}".format(e))
+    selection = FileSelection(file_filter)
+
+    layout = None
+    if args.layout:
+        try:
+            layout = OutputLayout(args.layout)
+        except ValueError as e:
+            raise Exception("Error: {0}".format(e))
+
+    if args.cooperative and not (mode_full or mode_download_only or mode_mirror):
+        raise Exception("Error: --cooperative needs a mode which downloads")
+
+    if mode_daemon and (args.errfile or args.results_file):
+        raise Exception(
+            "Error: -e and --results cannot be used with --daemon,"
+            " each batch's errors are written to its status file"
+        )
+
+    if args.requeue and not mode_verify:
+        raise Exception("Error: --requeue needs --verify")
+
+    if args.dry_run and not mode_bulk:
+        raise Exception("Error: --dry-run needs --cancel or --resubmit")
+
+    if args.campaign_file and not mode_full:
+        raise Exception("Error: --campaign needs -c and the default (full) mode")
+
+    if (args.max_in_flight or args.max_pending_bytes) and not args.campaign_file:
+        raise Exception(
+            "Error: --max-in-flight and --max-pending-bytes need --campaign"
+        )
+
+    if args.profiles_file:
+        if not (mode_full or mode_submit_only):
+            raise Exception("Error: --profiles needs -c")
+        if args.campaign_file or args.split_voltage or args.record_file:
+            raise Exception(
+                "Error: --profiles cannot be used with --campaign,"
+                " --split-voltage or --record"
+            )
+
+    if args.split_voltage is not None:
+        if args.split_voltage < 1:
+            raise Exception("Error: --split-voltage must be at least 1 second")
+        if not (mode_submit_only or mode_full):
+            raise Exception("Error: --split-voltage needs -c")
+
+    max_pending_bytes = None
+    if args.max_pending_bytes:
+        try:
+            max_pending_bytes = parse_size(args.max_pending_bytes)
+        except ValueError as e:
+            raise Exception("Error: {0}".format(e))
+
+    # Which jobs --cancel or --resubmit act on
+    selector = None
+    if args.states or args.obs_range or args.job_types or args.older_than:
+        if not mode_bulk:
+            raise Exception(
+                "Error: --state, --obs-id, --job-type and --older-than need"
+                " --cancel or --resubmit"
+            )
+
+        from mantaray.scripts.bulk import (
+            JobSelector,
+            parse_age,
+            parse_job_types,
+            parse_obs_range,
+            parse_states,
+        )
+
+        try:
+            selector = JobSelector(
+                parse_states(args.states or []),
+                parse_obs_range(args.obs_range) if args.obs_range else None,
+                parse_job_types(args.job_types or []),
+                parse_age(args.older_than) if args.older_than else None,
+            )
+        except ValueError as e:
+            raise Exception("Error: {0}".format(e))
+    elif mode_bulk:
+        raise Exception(
+            "Error: --cancel and --resubmit need at least one of --state,"
+            " --obs-id, --job-type or --older-than"
+        )
+
+    if mode_daemon and not os.path.isdir(args.spool_dir):
+        raise Exception(
+            "Error: Spool directory {0} is invalid.".format(args.spool_dir)
+        )
+
     host = os.environ.get("MWA_ASVO_HOST", "asvo.mwatelescope.org")
     if not host:
         raise Exception("[ERROR] MWA_ASVO_HOST env variable not defined")
@@ -920,7 +2607,8 @@ def mwa_client():
         )
 
     api_key = os.environ.get("MWA_ASVO_API_KEY", None)
-    if not api_key:
+    # With --profiles it is only needed for rows without a profile
+    if not api_key and not args.profiles_file:
         raise Exception(
             "[ERROR] MWA_ASVO_API_KEY env variable not defined. Log in to the"
             " MWA ASVO web site- https://asvo.mwatelescope.org/settings to"
@@ -935,14 +2623,31 @@ def mwa_client():
     else:
         sslopt = {"cert_reqs": ssl.CERT_NONE}
 
+    profiles = None
+    if args.profiles_file:
+        from mantaray.scripts.profiles import DEFAULT_PROFILE, Profile, load_profiles
+
+        profiles = load_profiles(
+            args.profiles_file,
+            Profile(DEFAULT_PROFILE, https, host, port, api_key, ssl_verify == "1"),
+        )
+
     # Setup status thread. This will be used to update stdout with status info
     status_queue = Queue()
-    status_thread = Thread(target=status_func, args=(status_queue,))
+    status_thread = Thread(
+        target=profiler.thread(status_func) if profiler else status_func,
+        args=(status_queue, events is not None and events.to_stdout),
+    )
     status_thread.daemon = True
     status_thread.start()
 
     # Download queue keeps track of all in progress downloads
-    download_queue = Queue()
+    if profiler:
+        from mantaray.scripts.profiling import ProfilingQueue
+
+        download_queue = ProfilingQueue(profiler)
+    else:
+        download_queue = Queue()
 
     # Result queue keeps track of job completion
     result_queue = Queue()
@@ -950,26 +2655,192 @@ def mwa_client():
 
     jobs_to_submit = []
     if mode_submit_only or mode_full:
-        jobs_to_submit = parse_csv(args.csvfile, allow_resubmit)
+        if not args.skip_validation:
+            start = time.perf_counter()
+            validate_csv(args.csvfile, allow_resubmit, profiles)
+            if profiler:
+                profiler.add("validate csv", "setup", start)
 
-        if len(jobs_to_submit) == 0:
-            raise Exception("Error: No jobs to submit")
+        jobs_to_submit = parse_csv(args.csvfile, allow_resubmit)
+        if args.skip_validation:
+            # Nothing has checked the file yet, so read it all before
+            # anything is submitted, as a bad row would stop it part way
+            jobs_to_submit = list(jobs_to_submit)
+
+    voltage_groups = None
+    if args.split_voltage and jobs_to_submit:
+        from mantaray.scripts.voltage import VoltageGroups
+
+        voltage_groups = VoltageGroups(args.split_voltage)
+        if args.campaign_file:
+            # Each part is a row of its own in the campaign
+            jobs_to_submit = [
+                part for job in jobs_to_submit for part in voltage_groups.split(job)
+            ]
+            voltage_groups = None
+
+    campaign = None
+    if args.campaign_file:
+        campaign = Campaign(
+            args.campaign_file,
+            list(jobs_to_submit),
+            args.max_in_flight or DEFAULT_MAX_IN_FLIGHT,
+            max_pending_bytes,
+        )
+        download_queue = campaign.watch(download_queue)
 
     params = (https, host, port, api_key)
 
+    cookie_cache = None
+    if args.cookie_cache is not None:
+        cookie_cache = CookieCache(args.cookie_cache or None)
+
+    if profiles is not None:
+        result_log = run_profiles(
+            args,
+            profiles,
+            jobs_to_submit,
+            mode_full,
+            outdir,
+            status_queue,
+            verbose,
+            events,
+            selection,
+            layout,
+            cookie_cache,
+        )
+        status_queue.put(None)
+        status_thread.join()
+        if events:
+            events.close()
+        if profiler:
+            close_profiler(profiler)
+        if result_log:
+            report_results(result_log, args)
+        return
+
     status_queue.put("Connecting to MWA ASVO ({0}:{1})...".format(host, port))
-    session = Session.login(*params)
+    start = time.perf_counter()
+    session = Session.login(*params, cookie_cache=cookie_cache)
+    if profiler:
+        profiler.add("login", "setup", start)
     status_queue.put("Connected to MWA ASVO")
+
+    recorder = None
+    if args.record_file:
+        from mantaray.scripts.recording import Recorder, RecordingSession
+
+        recorder = Recorder(args.record_file)
+        session = RecordingSession(session, recorder)
+
+    if profiler:
+        from mantaray.scripts.profiling import ProfilingSession
+
+        session = ProfilingSession(session, profiler)
     jobs_list = []
 
+    if mode_daemon:
+        # Imported here so the other modes do not pay for it
+        from mantaray.scripts.daemon import SpoolDaemon
+
+        daemon = SpoolDaemon(
+            params,
+            sslopt,
+            session,
+            args.spool_dir,
+            outdir,
+            status_queue,
+            verbose,
+            allow_resubmit,
+            args.poll_interval,
+            not args.skip_validation,
+            events,
+            file_filter=file_filter,
+            layout=layout,
+            recorder=recorder,
+        )
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            # Print what the stopped downloads said before exiting
+            status_queue.put(None)
+            status_thread.join()
+            raise
+
+    # Warms up downloads while jobs are delivering
+    preflight = None
+    if args.preflight and (mode_full or mode_mirror):
+        from mantaray.scripts.preflight import Preflight
+
+        preflight = Preflight(session, outdir, status_queue, layout)
+
+    if mode_mirror:
+        from mantaray.scripts.mirror import Mirror
+
+        claims = None
+        if args.cooperative:
+            from mantaray.scripts.claims import ClaimDirectory
+
+            claims = ClaimDirectory(outdir, args.lease)
+
+        # Written out when the mirror is stopped
+        from mantaray.scripts.results import ResultLog
+
+        result_log = ResultLog(args.results_file, args.errfile)
+        atexit.register(result_log.close)
+
+        mirror = Mirror(
+            sslopt,
+            session,
+            outdir,
+            status_queue,
+            verbose,
+            events,
+            selection=selection,
+            layout=layout,
+            claims=claims,
+            preflight=preflight,
+            result_log=result_log,
+            recorder=recorder,
+        )
+        try:
+            mirror.run()
+        except KeyboardInterrupt:
+            status_queue.put(None)
+            status_thread.join()
+            raise
+
     # Take an action depending on command line options specified
-    if mode_submit_only or mode_full:
+    if campaign:
+        # Jobs are submitted once the notifier is connected, see below
+        counts = campaign.counts()
+        status_queue.put(
+            "Campaign {0}: {1} jobs, {2} done, {3} failed, {4} skipped".format(
+                args.campaign_file,
+                len(campaign.rows),
+                counts["done"],
+                counts["failed"],
+                counts["skipped"],
+            )
+        )
+
+    elif mode_submit_only:
+        # With -c, jobs are submitted once the notifier is connected, see below
+        start = time.perf_counter()
         jobs_list = submit_jobs(
-            session, jobs_to_submit, status_queue, download_queue
+            session,
+            jobs_to_submit,
+            status_queue,
+            download_queue,
+            events,
+            selection,
+            voltage_groups,
         )
+        if profiler:
+            profiler.add("submit all", "setup", start, jobs=len(jobs_list))
 
     elif mode_list_only:
-        job_count = get_jobs_status(session, status_queue, verbose)
+        job_count = get_jobs_status(session, status_queue, verbose, events)
         if job_count == 0:
             print("You have no jobs.")
 
@@ -977,7 +2848,7 @@ def mwa_client():
         # JobID 0 is used to download ALL of the user's ready to download jobs
         if args.download_job_id == 0:
             jobs_list = enqueue_all_ready_to_download_jobs(
-                session, download_queue, status_queue, verbose
+                session, download_queue, status_queue, verbose, events
             )
 
             if len(jobs_list) == 0:
@@ -986,26 +2857,108 @@ def mwa_client():
                 # exit gracefully
                 status_queue.put(None)
                 status_thread.join()
+
+                if events:
+                    events.close()
+                if recorder:
+                    recorder.close()
+                if profiler:
+                    close_profiler(profiler)
                 return
         else:
             jobs_list = check_job_is_downloadable_and_enqueue(
                 session, download_queue, result_queue, args.download_job_id
             )
 
+    elif mode_bulk:
+        bulk_update_jobs(
+            session,
+            selector,
+            args.cancel,
+            args.dry_run,
+            args.bulk_workers,
+            result_queue,
+            status_queue,
+            events,
+        )
+
+    elif mode_verify:
+        verify_queue = Queue()
+        if args.verify_job_id == 0:
+            for record in get_job_list(session):
+                if record.state == JOB_STATE_READY_FOR_DOWNLOAD:
+                    verify_queue.put(record.item)
+
+            if verify_queue.empty():
+                print("You have no jobs that are ready to verify.")
+        else:
+            check_job_is_downloadable_and_enqueue(
+                session, verify_queue, result_queue, args.verify_job_id
+            )
+
+        items = []
+        while not verify_queue.empty():
+            items.append(verify_queue.get())
+
+        start = time.perf_counter()
+        jobs_list = verify_downloads(
+            items,
+            outdir,
+            selection,
+            download_queue,
+            result_queue,
+            status_queue,
+            args.requeue,
+            args.verify_workers,
+            layout,
+        )
+        if profiler:
+            profiler.add("verify", "setup", start, jobs=len(items))
+
     if mode_submit_only or mode_list_only:
         # Exit- user opted to submit only or list only
         status_queue.put(None)
         status_thread.join()
+
+        if events:
+            events.close()
+        if recorder:
+            recorder.close()
+        if profiler:
+            close_profiler(profiler)
         return
 
+    early = None
     if mode_full:
+        # Notifications for jobs which finish before submit_jobs or
+        # fill_campaign has their ids back
+        early = EarlyNotifications()
+
         # Initiate a notifier thread to get updates from the server
         status_queue.put("Connecting to MWA ASVO Notifier...")
-        notify = Notify.login(*params, sslopt=sslopt)
+        start = time.perf_counter()
+        notify = session.notify(sslopt=sslopt)
+        if profiler:
+            profiler.add("notifier connect", "setup", start)
         status_queue.put("Connected to MWA ASVO Notifier")
 
+        if recorder:
+            from mantaray.scripts.recording import RecordingNotify
+
+            notify = RecordingNotify(notify, recorder)
+
+            # The job list is otherwise only read if a job already exists,
+            # and replay --mode download-all needs it
+            for _ in get_job_list(session):
+                pass
+
+        if profiler:
+            from mantaray.scripts.profiling import ProfilingNotify
+
+            notify = ProfilingNotify(notify, profiler)
+
         notify_thread = Thread(
-            target=notify_func,
+            target=profiler.thread(notify_func) if profiler else notify_func,
             args=(
                 notify,
                 submit_lock,
@@ -1014,18 +2967,29 @@ def mwa_client():
                 result_queue,
                 status_queue,
                 verbose,
+                events,
+                preflight,
+                early,
             ),
         )
 
         notify_thread.daemon = True
         notify_thread.start()
 
+    claims = None
+    if args.cooperative:
+        from mantaray.scripts.claims import ClaimDirectory
+
+        claims = ClaimDirectory(outdir, args.lease)
+
+    # Set on Ctrl-C, to stop the downloads cleanly
+    cancel = Event()
     threads = []
 
     for i in range(4):
         # Launch a download thread
         t = Thread(
-            target=download_func,
+            target=profiler.thread(download_func) if profiler else download_func,
             args=(
                 submit_lock,
                 jobs_list,
@@ -1034,26 +2998,128 @@ def mwa_client():
                 status_queue,
                 session,
                 outdir,
+                events,
+                claims,
+                selection,
+                layout,
+                cancel,
             ),
         )
         threads.append(t)
         t.daemon = True
         t.start()
 
-    results = []
+    # Errors go to disk as they happen, see ResultLog
+    from mantaray.scripts.results import ResultLog
 
-    while True:
-        with submit_lock:
-            if len(jobs_list) == 0:
-                break
+    result_log = ResultLog(args.results_file, args.errfile)
+    atexit.register(result_log.close)
 
-        try:
-            r = result_queue.get(timeout=1)
-            if not r:
-                raise Exception("Error: Control connection lost, exiting")
-            results.append(r)
-        except Empty:
-            continue
+    def take_result(r):
+        if isinstance(r, JobFinished):
+            selection.discard(r.job_id)
+            return
+        if not r:
+            raise Exception("Error: Control connection lost, exiting")
+        result_log.add(r)
+        if campaign:
+            campaign.failed(r.job_id, r.no_colour_message)
+        if voltage_groups:
+            voltage_groups.failed(r.job_id, r.no_colour_message)
+
+    if campaign:
+        resume_campaign(
+            campaign,
+            session,
+            submit_lock,
+            jobs_list,
+            download_queue,
+            result_queue,
+            status_queue,
+            verbose,
+        )
+        existing_jobs = {}
+
+    try:
+        if mode_full and not campaign:
+            start = time.perf_counter()
+            submit_jobs(
+                session,
+                jobs_to_submit,
+                status_queue,
+                download_queue,
+                events,
+                selection,
+                voltage_groups,
+                jobs_list,
+                submit_lock,
+                early,
+            )
+            with submit_lock:
+                early.close()
+            if profiler:
+                # Each job also has a submit span of its own
+                profiler.add("submit all", "setup", start)
+
+        while True:
+            if campaign:
+                fill_campaign(
+                    campaign,
+                    session,
+                    submit_lock,
+                    jobs_list,
+                    existing_jobs,
+                    status_queue,
+                    download_queue,
+                    events,
+                    selection,
+                    early,
+                )
+
+            if voltage_groups:
+                with submit_lock:
+                    active = set(jobs_list)
+                # A job's result is queued before it leaves jobs_list, so take
+                # them first or a failed part would be counted as done
+                again = False
+                while not result_queue.empty():
+                    r = result_queue.get()
+                    if isinstance(r, JobFinished) and r.job_id in active:
+                        # It finished after active was taken, look again
+                        again = True
+                    take_result(r)
+                report_voltage_requests(voltage_groups, active, status_queue)
+                if again:
+                    continue
+
+            with submit_lock:
+                if len(jobs_list) == 0 and not (campaign and campaign.remaining()):
+                    break
+
+            # Woken by every result and every job that stops being tracked.
+            # Only a campaign waiting to try a job again needs a timeout
+            try:
+                take_result(
+                    result_queue.get(timeout=campaign.retry_in() if campaign else None)
+                )
+            except Empty:
+                continue
+    except KeyboardInterrupt:
+        status_queue.put(
+            "Stopping downloads, partly downloaded files will be carried on"
+            " from next time..."
+        )
+        stop_downloads(cancel, threads, download_queue)
+        status_queue.put(None)
+        status_thread.join()
+        raise
+
+    if campaign:
+        campaign.update(set())
+        campaign.save()
+
+    if voltage_groups:
+        report_voltage_requests(voltage_groups, set(), status_queue)
 
     for _ in threads:
         download_queue.put(None)
@@ -1065,52 +3131,113 @@ def mwa_client():
         notify.close()
         notify_thread.join()
 
+    if claims:
+        claims.close()
+
     status_queue.put(None)
     status_thread.join()
 
+    if events:
+        events.close()
+    if recorder:
+        recorder.close()
+    if profiler:
+        close_profiler(profiler)
+
     while not result_queue.empty():
         r = result_queue.get()
-        if not r:
+        if not r or isinstance(r, JobFinished):
             continue
-        results.append(r)
+        result_log.add(r)
 
-    # If we specified an error file, write to that too
-    if args.errfile:
-        # open the error file for overwrite, even if we have no errors, so we clear the file
-        error_file = open(args.errfile, "w")
+    report_results(result_log, args)
 
-    if len(results) > 0:
-        print("There were errors:")
 
-        json_list = []
+def report_results(result_log, args):
+    # Print the run's errors, and exit with status 4 if there were any
+    result_log.close(finished=True)
 
-        for r in results:
-            # Output errors to the screen
-            print(r.colour_message)
+    if result_log.count > 0:
+        print("There were errors:")
+
+        # Output errors to the screen
+        for message in result_log.printed:
+            print(message)
 
-            # Put results into a JSON object
-            json_list.append(
-                {
-                    "job_id": r.job_id,
-                    "obs_id": r.obs_id,
-                    "result": r.no_colour_message,
-                }
+        hidden = result_log.count - len(result_log.printed)
+        if hidden:
+            print(
+                "... and {0} more, {1}".format(
+                    hidden,
+                    "see {0}".format(args.results_file or args.errfile)
+                    if args.results_file or args.errfile
+                    else "use -e or --results to keep them all",
+                )
             )
 
-        # If we specified an error file, write to that too
-        if args.errfile:
-            # open the error file for overwrite
-            error_file = open(args.errfile, "w")
+        sys.exit(4)
 
-            json_output = json.dumps(json_list, indent=4)
-            error_file.write(json_output)
 
-            error_file.close()
+def run_profiles(
+    args,
+    profiles,
+    jobs_to_submit,
+    mode_full,
+    outdir,
+    status_queue,
+    verbose,
+    events,
+    selection,
+    layout,
+    cookie_cache,
+):
+    # -c with --profiles: each row goes to its profile's endpoint
+    from mantaray.scripts.profiles import ProfileRun, route_jobs
+
+    claims = None
+    if args.cooperative:
+        from mantaray.scripts.claims import ClaimDirectory
+
+        claims = ClaimDirectory(outdir, args.lease)
+
+    run = ProfileRun(
+        profiles,
+        route_jobs(jobs_to_submit, profiles),
+        outdir,
+        status_queue,
+        verbose,
+        events,
+        selection,
+        layout,
+        claims,
+        cookie_cache,
+        args.preflight,
+    )
+    run.login()
+    if mode_full:
+        run.connect()
+    run.submit()
+
+    # Returns the run's errors, if it downloads
+    result_log = None
+    if mode_full:
+        from mantaray.scripts.results import ResultLog
+
+        result_log = ResultLog(args.results_file, args.errfile)
+        atexit.register(result_log.close)
+        run.run(result_log.add)
+
+    run.close()
+    if claims:
+        claims.close()
+    return result_log
 
-        sys.exit(4)
-    else:
-        if args.errfile:
-            error_file.close()
+
+def close_profiler(profiler):
+    summary = profiler.close()
+    if summary:
+        print(summary)
+        sys.stdout.flush()
 
 
 def main():
@@ -1122,6 +3249,13 @@ def main():
         print("Error: %s, Line num: %s" % (str(e), e.line_num))
         sys.stdout.flush()
         sys.exit(3)
+    except ValidationException as e:
+        for line_num, errors in e.errors:
+            for error in errors:
+                print("Error: %s, Line num: %s" % (error, line_num))
+        print("Error: %s, nothing was submitted" % (str(e),))
+        sys.stdout.flush()
+        sys.exit(3)
     except requests.exceptions.HTTPError as re:
         print(re.response.text)
         sys.stdout.flush()
@@ -0,0 +1,172 @@
+import os
+import time
+import shutil
+from threading import Thread, Lock
+from urllib.parse import urlparse
+
+try:
+    from queue import Queue
+except:
+    from Queue import Queue
+
+# A host warmed up this recently is left alone, its connection should still
+# be open
+WARM_INTERVAL = 30.0
+
+DEFAULT_WORKERS = 2
+
+
+def product_host(url):
+    parsed = urlparse(url)
+    return "{0}://{1}".format(parsed.scheme, parsed.netloc)
+
+
+def product_urls(item):
+    # (url, size) of each file the job will be downloaded from
+    for prod in item["row"].get("product", {}).get("files") or []:
+        if prod.get("type") == "acacia" and prod.get("url"):
+            yield prod["url"], prod.get("size")
+
+
+class Preflight(object):
+    # Gets ready to download a job before it completes. When it starts
+    # delivering, connections are opened to the hosts its files will come
+    # from (or, until its files are listed, the hosts earlier jobs' files
+    # came from) and any files already listed are checked with HEAD
+    # requests. When it completes, the free space in the download directory
+    # is checked against what is still to be downloaded
+    def __init__(
+        self, session, output_dir, status_queue, layout=None, workers=DEFAULT_WORKERS
+    ):
+        self._session = session
+        self._output_dir = output_dir
+        self._status_queue = status_queue
+        self._layout = layout
+
+        self._lock = Lock()
+        # host -> when it was last warmed up
+        self._hosts = {}
+        # urls of delivering jobs already checked
+        self._checked = set()
+        self._no_ranges = set()
+        # job id -> bytes still to download, for completed jobs not yet
+        # downloaded
+        self._pending = {}
+
+        self._queue = Queue()
+        for _ in range(workers):
+            t = Thread(target=self._worker_func)
+            t.daemon = True
+            t.start()
+
+    def delivering(self, item):
+        job_id = int(item["row"]["id"])
+        now = time.monotonic()
+
+        with self._lock:
+            urls = []
+            for url, size in product_urls(item):
+                self._hosts.setdefault(product_host(url), 0.0)
+                if url not in self._checked:
+                    self._checked.add(url)
+                    urls.append((url, size))
+
+            # Checking a file opens a connection to its host as well
+            checking = set(product_host(url) for url, _ in urls)
+            hosts = [
+                host
+                for host, warmed in self._hosts.items()
+                if now - warmed >= WARM_INTERVAL or host in checking
+            ]
+            for host in hosts:
+                self._hosts[host] = now
+
+        for url, size in urls:
+            self._queue.put((self._check, (job_id, url, size)))
+        for host in hosts:
+            if host not in checking:
+                self._queue.put((self._session.warm_up, (host,)))
+
+    def completed(self, item, active_ids):
+        # active_ids are the jobs not yet downloaded, this one included. The
+        # caller may hold a lock the download threads wait on, so the stats
+        # and the free space check are left to the workers
+        self._queue.put((self._completed, (item, set(active_ids))))
+
+    def _completed(self, item, active_ids):
+        job_id = int(item["row"]["id"])
+        job_dir = (
+            self._layout.job_dir(self._output_dir, item, create=False)
+            if self._layout
+            else self._output_dir
+        )
+
+        needed = 0
+        for url, size in product_urls(item):
+            path = os.path.join(job_dir, os.path.basename(urlparse(url).path))
+            try:
+                if os.path.getsize(path) == size:
+                    continue
+            except OSError:
+                pass
+            needed += int(size or 0)
+
+        with self._lock:
+            for url, _ in product_urls(item):
+                self._hosts.setdefault(product_host(url), 0.0)
+                # It is no longer delivering, so will not be checked again
+                self._checked.discard(url)
+
+            for pending_id in [j for j in self._pending if j not in active_ids]:
+                del self._pending[pending_id]
+            others = sum(self._pending.values())
+            self._pending[job_id] = needed
+
+        if not needed:
+            return
+
+        try:
+            free = shutil.disk_usage(self._output_dir).free
+        except OSError:
+            return
+
+        # Files being written are counted in others and in what is used, so
+        # this errs on the side of warning
+        if needed + others > free:
+            self._status_queue.put(
+                "Warning: job {0} needs {1} bytes and other jobs waiting to be"
+                " downloaded {2} more, but only {3} bytes are free in {4}".format(
+                    job_id, needed, others, free, self._output_dir
+                )
+            )
+
+    def _check(self, job_id, url, size):
+        try:
+            server_size, ranges = self._session.preflight(url)
+        except Exception:
+            # Often the file is still being delivered. The download will
+            # report any real problem
+            return
+
+        if size is not None and server_size is not None and server_size != int(size):
+            self._status_queue.put(
+                "Warning: job {0} file {1} is {2} bytes on the server, but its"
+                " job lists {3}".format(job_id, url, server_size, size)
+            )
+
+        host = product_host(url)
+        if not ranges and host not in self._no_ranges:
+            self._no_ranges.add(host)
+            self._status_queue.put(
+                "Warning: {0} does not accept Range requests, --members cannot"
+                " be used with its files".format(host)
+            )
+
+    def _worker_func(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                func(*args)
+            except Exception:
+                # Only ever an optimisation
+                pass
@@ -0,0 +1,402 @@
+import os
+import ssl
+from collections import OrderedDict
+from configparser import ConfigParser, Error as ConfigError
+from functools import partial
+from threading import Thread, Event, RLock, Timer
+
+try:
+    from queue import Queue
+except:
+    from Queue import Queue
+
+from mantaray.api import Session
+from mantaray.scripts.filters import FileSelection
+from mantaray.scripts.mwa_client import (
+    PROFILE_KEY,
+    EarlyNotifications,
+    JobFinished,
+    Result,
+    _remove_submitted,
+    guarded_download_job,
+    notify_func,
+    stop_downloads,
+    submit_jobs,
+)
+
+# Rows without a profile column go to the MWA_ASVO_* endpoint
+DEFAULT_PROFILE = "default"
+
+
+class Profile(object):
+    # One MWA ASVO endpoint and the API key to use with it
+    def __init__(self, name, https, host, port, api_key, ssl_verify=False):
+        self.name = name
+        self.https = https
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.ssl_verify = ssl_verify
+
+    @property
+    def sslopt(self):
+        return {"cert_reqs": ssl.CERT_REQUIRED if self.ssl_verify else ssl.CERT_NONE}
+
+    def login(self, cookie_cache=None):
+        if not self.api_key:
+            raise Exception("Error: profile {0} has no API key".format(self.name))
+        return Session.login(
+            self.https, self.host, self.port, self.api_key, cookie_cache=cookie_cache
+        )
+
+
+def load_profiles(path, default):
+    # The profiles in an ini file, one section each, e.g.
+    #
+    # [staging]
+    # host = asvo-staging.example.org
+    # api_key_env = STAGING_API_KEY
+    #
+    # port (443), https (1) and ssl_verify (0) are optional, and api_key may
+    # be given directly instead of naming an environment variable. default
+    # is used for rows without a profile unless the file has [default]
+    parser = ConfigParser(interpolation=None)
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except (OSError, ConfigError) as e:
+        raise Exception("Error: could not read profiles {0}: {1}".format(path, e))
+
+    profiles = {DEFAULT_PROFILE: default}
+    for name in parser.sections():
+        section = parser[name]
+        if not section.get("host"):
+            raise Exception("Error: profile {0} in {1} has no host".format(name, path))
+
+        if "api_key_env" in section:
+            api_key = os.environ.get(section["api_key_env"])
+            if not api_key:
+                raise Exception(
+                    "Error: profile {0} needs the {1} environment variable".format(
+                        name, section["api_key_env"]
+                    )
+                )
+        else:
+            api_key = section.get("api_key")
+
+        profiles[name] = Profile(
+            name,
+            section.get("https", "1"),
+            section["host"],
+            section.get("port", "443"),
+            api_key,
+            section.get("ssl_verify", "0") == "1",
+        )
+    return profiles
+
+
+def route_jobs(jobs, profiles):
+    # {profile name: [job, ...]}, in csv order, without the profile column
+    routed = OrderedDict()
+    for job_type, params in jobs:
+        params = dict(params)
+        name = params.pop(PROFILE_KEY, DEFAULT_PROFILE)
+        if name not in profiles:
+            raise Exception(
+                "Error: unknown profile {0} in the csv file (profiles are {1})".format(
+                    name, ", ".join(sorted(profiles))
+                )
+            )
+        routed.setdefault(name, []).append([job_type, params])
+    return routed
+
+
+class Lane(object):
+    # One profile's session and notifier, and the jobs submitted through it
+    def __init__(self, profile, session, selection, layout=None):
+        self.profile = profile
+        self.session = session
+        self.selection = selection
+        self.layout = layout
+        self.jobs = []
+        self.notify = None
+        self.notify_thread = None
+        self.early = EarlyNotifications()
+        self.preflight = None
+
+
+def _prefixed(prefix, status):
+    return prefix + status()
+
+
+class LaneStatus(object):
+    # Puts a lane's status messages on the shared queue, with its name first
+    def __init__(self, queue, lane):
+        self._queue = queue
+        self._prefix = "[{0}] ".format(lane.profile.name)
+
+    def put(self, status):
+        if callable(status):
+            self._queue.put(partial(_prefixed, self._prefix, status))
+        else:
+            self._queue.put(self._prefix + str(status))
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
+
+class LaneDownloads(object):
+    # Puts a lane's ready jobs on the shared download queue as (lane, item)
+    def __init__(self, queue, lane):
+        self._queue = queue
+        self._lane = lane
+
+    def put(self, item, *args, **kwargs):
+        self._queue.put((self._lane, item) if item else item, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
+
+class LaneResults(object):
+    # Puts a lane's results on the shared queue, marked with its profile
+    def __init__(self, queue, lane):
+        self._queue = queue
+        self._name = lane.profile.name
+        self._selection = lane.selection
+
+    def put(self, r):
+        if isinstance(r, JobFinished):
+            self._selection.discard(r.job_id)
+        elif r:
+            r = Result(
+                r.job_id,
+                r.obs_id,
+                "[{0}] {1}".format(self._name, r.colour_message),
+                r.no_colour_message,
+                r.path,
+                self._name,
+            )
+        self._queue.put(r)
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
+
+class ProfileRun(object):
+    # Submits each profile's jobs through its own session and notifier, and
+    # downloads them all with one pool of download threads, so several
+    # endpoints and accounts share the link and the disk instead of
+    # competing for them
+    def __init__(
+        self,
+        profiles,
+        routed,
+        output_dir,
+        status_queue,
+        verbose,
+        events=None,
+        selection=None,
+        layout=None,
+        claims=None,
+        cookie_cache=None,
+        preflight=False,
+        workers=4,
+    ):
+        self._profiles = profiles
+        self._routed = routed
+        self._output_dir = output_dir
+        self._status_queue = status_queue
+        self._verbose = verbose
+        self._events = events
+        self._selection = selection
+        self._layout = layout
+        self._claims = claims
+        self._cookie_cache = cookie_cache
+        self._preflight = preflight
+        self._workers = workers
+
+        self._submit_lock = RLock()
+        self._download_queue = Queue()
+        self._result_queue = Queue()
+        # Set on Ctrl-C, to stop the downloads cleanly
+        self._cancel = Event()
+        self.lanes = []
+
+    def login(self):
+        for name in self._routed:
+            profile = self._profiles[name]
+            self._status_queue.put(
+                "[{0}] Connecting to MWA ASVO ({1}:{2})...".format(
+                    name, profile.host, profile.port
+                )
+            )
+            session = profile.login(self._cookie_cache)
+            default = self._selection.default if self._selection else None
+            self.lanes.append(
+                Lane(
+                    profile,
+                    session,
+                    FileSelection(default),
+                    self._layout.for_profile(name) if self._layout else None,
+                )
+            )
+        self._status_queue.put("Connected to MWA ASVO")
+
+    def connect(self):
+        # Connects each profile's notifier, before its jobs are submitted so
+        # none of their notifications are missed
+        if self._preflight:
+            from mantaray.scripts.preflight import Preflight
+
+        for lane in self.lanes:
+            if self._preflight:
+                # Warms up the connections the lane's downloads will use
+                lane.preflight = Preflight(
+                    lane.session,
+                    self._output_dir,
+                    LaneStatus(self._status_queue, lane),
+                    lane.layout,
+                )
+
+            self._status_queue.put(
+                "[{0}] Connecting to MWA ASVO Notifier...".format(lane.profile.name)
+            )
+            lane.notify = lane.session.notify(sslopt=lane.profile.sslopt)
+            lane.notify_thread = Thread(
+                target=notify_func,
+                args=(
+                    lane.notify,
+                    self._submit_lock,
+                    lane.jobs,
+                    LaneDownloads(self._download_queue, lane),
+                    LaneResults(self._result_queue, lane),
+                    LaneStatus(self._status_queue, lane),
+                    self._verbose,
+                    self._events,
+                    lane.preflight,
+                    lane.early,
+                ),
+            )
+            lane.notify_thread.daemon = True
+            lane.notify_thread.start()
+
+    def submit(self):
+        # Each profile's jobs are submitted at the same time as the others'
+        errors = []
+
+        def submit_lane(lane):
+            try:
+                submit_jobs(
+                    lane.session,
+                    self._routed[lane.profile.name],
+                    LaneStatus(self._status_queue, lane),
+                    LaneDownloads(self._download_queue, lane),
+                    self._events,
+                    lane.selection,
+                    submitted_jobs=lane.jobs,
+                    submit_lock=self._submit_lock,
+                    early=lane.early,
+                )
+                with self._submit_lock:
+                    lane.early.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=submit_lane, args=(lane,)) for lane in self.lanes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+    def run(self, add_result):
+        # Waits for every job to be downloaded, fail or be cancelled, after
+        # connect() and submit(). add_result(r) is called with each error
+        threads = []
+        for _ in range(self._workers):
+            t = Thread(target=self._download_func)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        try:
+            while True:
+                with self._submit_lock:
+                    if not any(lane.jobs for lane in self.lanes):
+                        break
+
+                # Woken by every result and every job that stops being tracked
+                r = self._result_queue.get()
+                if isinstance(r, JobFinished):
+                    continue
+                if not r:
+                    raise Exception("Error: Control connection lost, exiting")
+                add_result(r)
+        except KeyboardInterrupt:
+            self._status_queue.put(
+                "Stopping downloads, partly downloaded files will be carried on"
+                " from next time..."
+            )
+            stop_downloads(self._cancel, threads, self._download_queue)
+            raise
+        finally:
+            if not self._cancel.is_set():
+                for _ in threads:
+                    self._download_queue.put(None)
+                for t in threads:
+                    t.join()
+
+            for lane in self.lanes:
+                lane.notify.close()
+                lane.notify_thread.join()
+
+            while not self._result_queue.empty():
+                r = self._result_queue.get()
+                if r and not isinstance(r, JobFinished):
+                    add_result(r)
+
+    def close(self):
+        for lane in self.lanes:
+            lane.session.close()
+
+    def _download_func(self):
+        # Each job is downloaded with its own profile's session, which has
+        # that profile's login and ssl settings
+        while True:
+            entry = self._download_queue.get()
+            if not entry or self._cancel.is_set():
+                break
+            lane, item = entry
+
+            deferred = guarded_download_job(
+                item,
+                lane.session,
+                self._output_dir,
+                LaneResults(self._result_queue, lane),
+                LaneStatus(self._status_queue, lane),
+                self._events,
+                self._claims,
+                lane.selection,
+                lane.layout,
+                self._cancel,
+            )
+            if self._cancel.is_set():
+                break
+
+            if deferred:
+                timer = Timer(
+                    self._claims.retry_interval, self._download_queue.put, (entry,)
+                )
+                timer.daemon = True
+                timer.start()
+                continue
+
+            # Through LaneResults, so the lane's file filter is discarded
+            _remove_submitted(
+                self._submit_lock,
+                lane.jobs,
+                int(item["row"]["id"]),
+                LaneResults(self._result_queue, lane),
+            )
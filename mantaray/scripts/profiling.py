@@ -0,0 +1,337 @@
+import json
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    from queue import Queue
+except:
+    from Queue import Queue
+
+# Chrome trace process ids: one row per client thread, and one row per job
+PID_CLIENT = 1
+PID_JOBS = 2
+
+# Once a job reaches one of these its server side time is over
+TERMINAL_STATES = ("completed", "error", "cancelled", "deleted")
+
+
+class Profiler(object):
+    # Collects timing spans for --profile, written out as a Chrome trace
+    # (chrome://tracing or https://ui.perfetto.dev) and summarised in a table
+    def __init__(self, trace_path, cprofile_path=None):
+        self._trace_path = trace_path
+        self._cprofile_path = cprofile_path
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._spans = []
+        self._threads = {}
+        self._job_states = {}
+        self._profiles = []
+        self._main_profile = None
+        self._closed = False
+
+        if cprofile_path:
+            self._main_profile = self._new_profile()
+            self._main_profile.enable()
+
+    def now(self):
+        return time.perf_counter()
+
+    def _new_profile(self):
+        import cProfile
+
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _thread_id(self):
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self._threads:
+                self._threads[ident] = (
+                    len(self._threads) + 1,
+                    threading.current_thread().name,
+                )
+            return self._threads[ident][0]
+
+    def add(self, name, category, start, end=None, job_id=None, on_job=False, **args):
+        # Record a span on the current thread's row, and on the job's row too
+        # if on_job is set
+        if end is None:
+            end = self.now()
+        if job_id is not None:
+            args["job_id"] = job_id
+
+        tid = self._thread_id()
+        with self._lock:
+            self._spans.append((name, category, PID_CLIENT, tid, start, end, args))
+            if on_job and job_id is not None:
+                self._spans.append(
+                    (name, category, PID_JOBS, int(job_id), start, end, args)
+                )
+
+    @contextmanager
+    def span(self, name, category="client", job_id=None, on_job=False, **args):
+        start = self.now()
+        try:
+            yield args
+        finally:
+            self.add(name, category, start, None, job_id, on_job, **args)
+
+    def job_state(self, job_id, state):
+        # Time in each server state runs from the notification which moved
+        # the job into it until the next one
+        job_id = int(job_id)
+        t = self.now()
+
+        with self._lock:
+            previous = self._job_states.pop(job_id, None)
+            if previous:
+                prev_state, prev_start = previous
+                if prev_state == state:
+                    self._job_states[job_id] = previous
+                    return
+                self._spans.append(
+                    (prev_state, "server", PID_JOBS, job_id, prev_start, t, {})
+                )
+            if state not in TERMINAL_STATES:
+                self._job_states[job_id] = (state, t)
+
+    def thread(self, target):
+        # Wrap a thread target so it has its own cProfile when one is wanted
+        if not self._cprofile_path:
+            return target
+
+        @wraps(target)
+        def run(*args):
+            self._new_profile().runcall(target, *args)
+
+        return run
+
+    def summary(self):
+        # (category, name) -> durations in seconds, in the order each kind of
+        # span first started
+        durations = OrderedDict()
+        with self._lock:
+            spans = sorted(self._spans, key=lambda s: s[4])
+
+        for name, category, pid, tid, start, end, args in spans:
+            if pid == PID_JOBS and category != "server":
+                # Already counted on the thread row
+                continue
+            key = (category, name)
+            durations.setdefault(key, []).append(end - start)
+
+        rows = []
+        for (category, name), values in durations.items():
+            values.sort()
+            rows.append(
+                (
+                    category,
+                    name,
+                    len(values),
+                    sum(values),
+                    values[len(values) // 2],
+                    values[min(len(values) - 1, int(len(values) * 0.95))],
+                    values[-1],
+                )
+            )
+        return rows
+
+    def format_summary(self):
+        lines = [
+            "Profile (wall time %.3fs):" % (self.now() - self._start,),
+            "%-8s %-28s %8s %10s %10s %10s %10s"
+            % ("stage", "span", "count", "total s", "p50 ms", "p95 ms", "max ms"),
+        ]
+        for category, name, count, total, p50, p95, maximum in self.summary():
+            lines.append(
+                "%-8s %-28s %8d %10.3f %10.1f %10.1f %10.1f"
+                % (
+                    category,
+                    name,
+                    count,
+                    total,
+                    p50 * 1000.0,
+                    p95 * 1000.0,
+                    maximum * 1000.0,
+                )
+            )
+        return "\n".join(lines)
+
+    def _trace_events(self):
+        events = [
+            {"ph": "M", "name": "process_name", "pid": PID_CLIENT,
+             "args": {"name": "mwa_client"}},
+            {"ph": "M", "name": "process_name", "pid": PID_JOBS,
+             "args": {"name": "jobs"}},
+        ]
+
+        with self._lock:
+            threads = list(self._threads.values())
+            spans = list(self._spans)
+            # Jobs still in a server state when the run ended
+            end = self.now()
+            for job_id, (state, start) in self._job_states.items():
+                spans.append((state, "server", PID_JOBS, job_id, start, end, {}))
+
+        for tid, name in threads:
+            events.append(
+                {"ph": "M", "name": "thread_name", "pid": PID_CLIENT, "tid": tid,
+                 "args": {"name": name}}
+            )
+
+        for job_id in sorted(set(s[3] for s in spans if s[2] == PID_JOBS)):
+            events.append(
+                {"ph": "M", "name": "thread_name", "pid": PID_JOBS, "tid": job_id,
+                 "args": {"name": "job %s" % (job_id,)}}
+            )
+
+        for name, category, pid, tid, start, end, args in spans:
+            events.append(
+                {
+                    "ph": "X",
+                    "name": name,
+                    "cat": category,
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": (start - self._start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "args": args,
+                }
+            )
+        return events
+
+    def close(self):
+        # Write the trace (and cProfile stats) and return the summary table
+        with self._lock:
+            if self._closed:
+                return None
+            self._closed = True
+
+        with open(self._trace_path, "w") as f:
+            json.dump(
+                {"traceEvents": self._trace_events(), "displayTimeUnit": "ms"}, f
+            )
+
+        if self._cprofile_path:
+            import pstats
+
+            self._main_profile.disable()
+            with self._lock:
+                profiles = list(self._profiles)
+            pstats.Stats(*profiles).dump_stats(self._cprofile_path)
+
+        return self.format_summary()
+
+
+class ProfilingQueue(Queue):
+    # Download queue which records how long each job waited for a worker
+    def __init__(self, profiler):
+        Queue.__init__(self)
+        self._profiler = profiler
+
+    def _put(self, item):
+        Queue._put(self, (item, self._profiler.now()))
+
+    def _get(self):
+        item, queued_at = Queue._get(self)
+        if item:
+            self._profiler.add(
+                "queue wait", "client", queued_at, job_id=item["row"]["id"], on_job=True
+            )
+        return item
+
+
+class ProfilingNotify(object):
+    def __init__(self, notify, profiler):
+        self._notify = notify
+        self._profiler = profiler
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def close(self):
+        self._notify.close()
+
+    def recv(self):
+        item = self._notify.recv()
+        if item:
+            row = item["row"]
+            state = "deleted" if item["action"] == "DELETE" else row["job_state"]
+            self._profiler.job_state(row["id"], state)
+        return item
+
+
+class ProfilingSession(object):
+    def __init__(self, session, profiler):
+        self._session = session
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def _submit(self, name, parameters):
+        start = self._profiler.now()
+        try:
+            response = getattr(self._session, name)(parameters)
+        except Exception:
+            self._profiler.add("submit (rejected)", "submit", start)
+            raise
+
+        job_id = response["job_id"]
+        self._profiler.add("submit", "submit", start, job_id=job_id)
+        self._profiler.job_state(job_id, "submitted")
+        return response
+
+    def submit_conversion_job_direct(self, parameters):
+        return self._submit("submit_conversion_job_direct", parameters)
+
+    def submit_download_job_direct(self, parameters):
+        return self._submit("submit_download_job_direct", parameters)
+
+    def submit_voltage_job_direct(self, parameters):
+        return self._submit("submit_voltage_job_direct", parameters)
+
+    def get_jobs(self):
+        with self._profiler.span("get_jobs", "api") as args:
+            result = self._session.get_jobs()
+            args["jobs"] = len(result or [])
+        return result
+
+    def iter_jobs(self):
+        # The span covers the whole response, which arrives as it is used
+        with self._profiler.span("get_jobs", "api") as args:
+            count = 0
+            for record in self._session.iter_jobs():
+                count += 1
+                yield record
+            args["jobs"] = count
+
+    def cancel_job(self, job_id):
+        with self._profiler.span("cancel_job", "api", job_id=job_id):
+            return self._session.cancel_job(job_id)
+
+    def download_file_product(self, job_id, url, output_path, *args, **kwargs):
+        with self._profiler.span(
+            "transfer", "download", job_id=job_id, on_job=True
+        ) as span_args:
+            result = self._session.download_file_product(
+                job_id, url, output_path, *args, **kwargs
+            )
+            span_args["bytes"] = os.path.getsize(output_path)
+        return result
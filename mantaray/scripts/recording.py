@@ -0,0 +1,99 @@
+import json
+import time
+from threading import Lock
+
+from mantaray.api import get_version_number
+
+RECORD_HEADER = "header"
+RECORD_NOTIFY = "notify"
+RECORD_GET_JOBS = "get_jobs"
+# A job list read with iter_jobs is written one job at a time as it arrives,
+# then closed with the number of jobs in it
+RECORD_JOB = "job"
+RECORD_JOBS_END = "jobs_end"
+
+
+class Recorder(object):
+    # Writes notifier frames and get_jobs responses to a JSON Lines file, each
+    # stamped with the seconds since recording started, for benchmarks/replay.py
+    def __init__(self, path):
+        self._file = open(path, "w")
+        self._lock = Lock()
+        self._start = time.monotonic()
+        self._write(
+            {
+                "type": RECORD_HEADER,
+                "client_version": get_version_number(),
+                "started": time.time(),
+            }
+        )
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record(self, record_type, data):
+        self._write(
+            {"type": record_type, "t": time.monotonic() - self._start, "data": data}
+        )
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingNotify(object):
+    def __init__(self, notify, recorder):
+        self._notify = notify
+        self._recorder = recorder
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def close(self):
+        self._notify.close()
+
+    def recv(self):
+        frame = self._notify.recv_frame()
+        if not frame:
+            return None
+
+        # Keep the frame exactly as the server sent it
+        self._recorder.record(RECORD_NOTIFY, frame)
+        return json.loads(frame)
+
+
+class RecordingSession(object):
+    def __init__(self, session, recorder):
+        self._session = session
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def get_jobs(self):
+        result = self._session.get_jobs()
+        self._recorder.record(RECORD_GET_JOBS, result)
+        return result
+
+    def iter_jobs(self):
+        count = 0
+        try:
+            for record in self._session.iter_jobs():
+                self._recorder.record(RECORD_JOB, record.text)
+                count += 1
+                yield record
+        finally:
+            # Also closes a list which was stopped part way through
+            self._recorder.record(RECORD_JOBS_END, count)
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import tempfile
+from threading import Lock, Timer
+
+# Errors are fsynced after this many, or this many seconds after the first
+# one not yet synced, whichever comes first
+SYNC_EVERY = 100
+SYNC_INTERVAL = 1.0
+
+# Errors printed at the end of a run. The rest are only in the files
+MAX_PRINTED = 100
+
+
+def result_record(result):
+    record = {
+        "job_id": result.job_id,
+        "obs_id": result.obs_id,
+        "result": result.no_colour_message,
+    }
+    if result.path:
+        record["path"] = result.path
+    if result.profile:
+        record["profile"] = result.profile
+    return record
+
+
+class ResultLog(object):
+    # The errors of a run, kept on disk instead of in memory. Each is
+    # appended to a JSON Lines file (path, or a temporary file) as soon as it
+    # happens, and path.summary.json is rewritten alongside it, so both can
+    # be read while the run is going. errfile, if given, gets the usual -e
+    # JSON array when the log is closed, even if the run is interrupted
+    def __init__(
+        self, path=None, errfile=None, sync_every=SYNC_EVERY, sync_interval=SYNC_INTERVAL
+    ):
+        self.path = path
+        self.errfile = errfile
+        self.count = 0
+        # Colour messages of the first few errors, for the screen
+        self.printed = []
+
+        self._sync_every = sync_every
+        self._sync_interval = sync_interval
+        self._lock = Lock()
+        self._unsynced = 0
+        self._timer = None
+        self._closed = False
+        self._started = time.time()
+
+        if path:
+            self._file = open(path, "w+")
+            self._summary_path = path + ".summary.json"
+            self._write_summary(False)
+        else:
+            self._file = tempfile.TemporaryFile("w+")
+            self._summary_path = None
+
+    def add(self, result):
+        line = json.dumps(result_record(result)) + "\n"
+
+        with self._lock:
+            if self._closed:
+                return
+            self.count += 1
+            if len(self.printed) < MAX_PRINTED:
+                self.printed.append(result.colour_message)
+
+            self._file.write(line)
+            if not self.path:
+                return
+
+            # Readers see it at once, it is on disk once synced
+            self._file.flush()
+            self._unsynced += 1
+
+            if self._unsynced >= self._sync_every:
+                self._sync_locked()
+            elif self._timer is None:
+                self._timer = Timer(self._sync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def sync(self):
+        with self._lock:
+            if not self._closed:
+                self._sync_locked()
+
+    def _sync_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._unsynced:
+            return
+
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        if self._summary_path:
+            self._write_summary(False)
+
+    def _write_summary(self, finished):
+        tmp_path = "{0}.{1}.tmp".format(self._summary_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "results": self.path,
+                    "started": self._started,
+                    "updated": time.time(),
+                    "errors": self.count,
+                    "finished": finished,
+                },
+                f,
+                indent=4,
+            )
+        os.replace(tmp_path, self._summary_path)
+
+    def _write_errfile(self):
+        # The same JSON array as json.dumps(errors, indent=4), written one
+        # error at a time
+        self._file.seek(0)
+        with open(self.errfile, "w") as f:
+            if not self.count:
+                return
+
+            f.write("[\n")
+            for i, line in enumerate(self._file):
+                if i:
+                    f.write(",\n")
+                error = json.dumps(json.loads(line), indent=4)
+                f.write("    " + error.replace("\n", "\n    "))
+            f.write("\n]")
+
+    def close(self, finished=False):
+        # Called again at exit, in case the run stopped early
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._sync_locked()
+
+            if self._summary_path:
+                self._write_summary(finished)
+            if self.errfile:
+                self._write_errfile()
+            self._file.close()
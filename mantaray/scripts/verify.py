@@ -0,0 +1,214 @@
+import os
+import json
+import mmap
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+# Hashes of files already checked live in this file in the output directory,
+# so files which have not changed since are not read again
+INDEX_FILE = ".mwa_client_verify.json"
+
+READ_SIZE = 8 * 1024 * 1024
+
+FILE_OK = "ok"
+FILE_MISSING = "missing"
+FILE_WRONG_SIZE = "wrong size"
+FILE_CORRUPT = "sha1 mismatch"
+
+
+def sha1_file(path):
+    # One sequential pass over a memory map, or large reads where the file
+    # cannot be mapped (empty files, some network filesystems)
+    h = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            mm = None
+
+        if mm is not None:
+            with mm:
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                h.update(mm)
+        else:
+            buf = bytearray(READ_SIZE)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+
+    return h.hexdigest()
+
+
+class VerifyIndex(object):
+    # sha1 of each file checked, keyed by its path relative to the output
+    # directory and only trusted while its size and mtime are unchanged
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, INDEX_FILE)
+        self._dirty = False
+
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _key(self, path):
+        return os.path.relpath(path, self.output_dir)
+
+    def lookup(self, path, st):
+        entry = self._entries.get(self._key(path))
+        if (
+            entry
+            and entry["size"] == st.st_size
+            and entry["mtime_ns"] == st.st_mtime_ns
+        ):
+            return entry["sha1"]
+        return None
+
+    def store(self, path, st, sha1):
+        self._entries[self._key(path)] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha1": sha1,
+        }
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        # Forget files which have since been removed
+        entries = dict(
+            (key, entry)
+            for key, entry in self._entries.items()
+            if os.path.isfile(os.path.join(self.output_dir, key))
+        )
+
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def product_files(item, job_dir, file_filter=None):
+    # (file name, local path, size, server sha1) for each product file which
+    # is downloaded whole into job_dir
+    for prod in item["row"]["product"]["files"]:
+        if prod["type"] != "acacia":
+            continue
+
+        file_name = os.path.basename(urlparse(prod["url"]).path)
+        if file_filter:
+            if not file_filter.wants(file_name, prod["size"]):
+                continue
+            # Only some members were extracted, there is no zip to check
+            if file_filter.selects_members(file_name):
+                continue
+
+        yield (
+            file_name,
+            os.path.join(job_dir, file_name),
+            int(prod["size"]),
+            prod["sha1"],
+        )
+
+
+class VerifyReport(object):
+    def __init__(self):
+        self.files = 0
+        self.cached = 0
+        self.hashed = 0
+        self.hashed_bytes = 0
+        # (item, file name, path, reason) for each missing or corrupt file
+        self.problems = []
+
+
+def verify_files(
+    items, output_dir, selection=None, workers=None, progress=None, layout=None
+):
+    # Check the product files of each job in items, in output_dir or where
+    # layout puts them, against the server's sha1. progress(item, file_name,
+    # path, status) is called for each file
+    report = VerifyReport()
+    index = VerifyIndex(output_dir)
+    to_hash = []
+
+    def checked(item, file_name, path, status):
+        if status != FILE_OK:
+            report.problems.append((item, file_name, path, status))
+        if progress:
+            progress(item, file_name, path, status)
+
+    for item in items:
+        file_filter = selection.get(item["row"]["id"]) if selection else None
+        job_dir = layout.job_dir(output_dir, item, create=False) if layout else output_dir
+
+        for file_name, path, size, sha1 in product_files(item, job_dir, file_filter):
+            report.files += 1
+
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                checked(item, file_name, path, FILE_MISSING)
+                continue
+
+            if st.st_size != size:
+                checked(item, file_name, path, FILE_WRONG_SIZE)
+                continue
+
+            local_sha1 = index.lookup(path, st)
+            if local_sha1 is None:
+                to_hash.append((item, file_name, path, st, sha1))
+                continue
+
+            report.cached += 1
+            checked(
+                item,
+                file_name,
+                path,
+                FILE_OK if local_sha1 == sha1.lower() else FILE_CORRUPT,
+            )
+
+    if not to_hash:
+        return report
+
+    # Largest first, so one big file does not hold up the end of the run
+    to_hash.sort(key=lambda f: f[3].st_size, reverse=True)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(workers or os.cpu_count() or 1, len(to_hash))
+        ) as pool:
+            futures = dict(
+                (pool.submit(sha1_file, f[2]), f) for f in to_hash
+            )
+
+            for future in as_completed(futures):
+                item, file_name, path, st, sha1 = futures[future]
+                try:
+                    local_sha1 = future.result()
+                except OSError:
+                    checked(item, file_name, path, FILE_MISSING)
+                    continue
+
+                report.hashed += 1
+                report.hashed_bytes += st.st_size
+                index.store(path, st, local_sha1)
+                checked(
+                    item,
+                    file_name,
+                    path,
+                    FILE_OK if local_sha1 == sha1.lower() else FILE_CORRUPT,
+                )
+    finally:
+        index.save()
+
+    return report
@@ -0,0 +1,113 @@
+from threading import Lock
+
+VOLTAGE_JOB = "submit_voltage_job_direct"
+
+# Most parts of one request submitted at once
+MAX_PARALLEL_SUBMIT = 8
+
+
+def split_voltage_job(job, max_duration):
+    # Split a voltage job into jobs of at most max_duration seconds covering
+    # the same span. Other jobs, and short voltage jobs, are returned as is
+    job_type, params = job
+    if job_type != VOLTAGE_JOB:
+        return [job]
+
+    offset = int(params["offset"])
+    duration = int(params["duration"])
+    if duration <= max_duration:
+        return [job]
+
+    parts = []
+    end = offset + duration
+    for start in range(offset, end, max_duration):
+        part = dict(params)
+        part["offset"] = str(start)
+        part["duration"] = str(min(max_duration, end - start))
+        parts.append([job_type, part])
+    return parts
+
+
+class VoltageRequest(object):
+    # One csv voltage row, submitted as several jobs
+    def __init__(self, obs_id, offset, duration, job_ids):
+        self.obs_id = obs_id
+        self.offset = offset
+        self.duration = duration
+        # None for parts the server did not accept
+        self.job_ids = job_ids
+        self.failed = {}
+        self.finished = set()
+        self.reported = False
+
+    @property
+    def label(self):
+        return "obs id {0} seconds {1}..{2}".format(
+            self.obs_id, self.offset, self.offset + self.duration
+        )
+
+    def summary(self):
+        parts = len(self.job_ids)
+        rejected = self.job_ids.count(None)
+        if not self.failed and not rejected:
+            return "Voltage request {0}: all {1} parts done".format(self.label, parts)
+
+        problems = []
+        if self.failed:
+            problems.append(
+                "jobs {0} failed".format(", ".join(str(j) for j in sorted(self.failed)))
+            )
+        if rejected:
+            problems.append("{0} not submitted".format(rejected))
+        return "Voltage request {0}: {1} of {2} parts done, {3}".format(
+            self.label,
+            parts - len(self.failed) - rejected,
+            parts,
+            "; ".join(problems),
+        )
+
+
+class VoltageGroups(object):
+    # Splits long voltage jobs and follows the parts of each as one request
+    def __init__(self, max_duration):
+        self.max_duration = max_duration
+        self.requests = []
+        self._request_of = {}
+        self._lock = Lock()
+
+    def split(self, job):
+        return split_voltage_job(job, self.max_duration)
+
+    def add(self, job, job_ids):
+        params = job[1]
+        job_ids = [None if j is None else int(j) for j in job_ids]
+        request = VoltageRequest(
+            params.get("obs_id"), int(params["offset"]), int(params["duration"]), job_ids
+        )
+        with self._lock:
+            self.requests.append(request)
+            for job_id in job_ids:
+                if job_id is not None:
+                    self._request_of[int(job_id)] = request
+        return request
+
+    def failed(self, job_id, message):
+        with self._lock:
+            request = self._request_of.get(job_id)
+            if request:
+                request.failed[job_id] = message
+
+    def update(self, active_ids):
+        # Returns the requests all of whose parts have now finished
+        done = []
+        with self._lock:
+            for request in self.requests:
+                if request.reported:
+                    continue
+                for job_id in request.job_ids:
+                    if job_id is not None and job_id not in active_ids:
+                        request.finished.add(job_id)
+                if len(request.finished) == len(request.job_ids) - request.job_ids.count(None):
+                    request.reported = True
+                    done.append(request)
+        return done
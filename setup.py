@@ -5,6 +5,7 @@ setup(
     version="2.0.1",
     packages=find_packages(),
     install_requires=["requests>=2.18.3", "websocket_client", "colorama"],
+    extras_require={"async": ["aiohttp>=3.8"]},
     entry_points={
         "console_scripts": ["mwa_client = mantaray.scripts.mwa_client:main"]
     },
@@ -0,0 +1,32 @@
+import pytest
+
+from mantaray.api import JobRecord
+from mantaray.scripts.bulk import JobSelector, parse_states
+
+
+def record(job_id, state="queued", created=None):
+    row = {"id": job_id, "job_state": state, "job_type": 1, "job_params": {"obs_id": 1}}
+    if created is not None:
+        row["created"] = created
+    return JobRecord.from_item({"row": row})
+
+
+def test_parse_states():
+    assert parse_states(["Queued, ready", "error"]) == {"queued", "completed", "error"}
+
+
+def test_parse_states_unknown():
+    with pytest.raises(ValueError):
+        parse_states(["queud"])
+
+
+def test_older_than_counts_undated_jobs():
+    selector = JobSelector(states=["queued"], older_than=60)
+    records = [record(1, created=0), record(2), record(3, "error"), record(4)]
+
+    assert [r.id for r in selector.select(records)] == [1]
+    # Only jobs which matched everything else are counted
+    assert selector.undated == 2
+
+    selector.select([record(1, created=0)])
+    assert selector.undated == 0
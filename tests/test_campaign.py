@@ -0,0 +1,122 @@
+from queue import Queue
+
+import pytest
+
+from mantaray.scripts import campaign as campaign_module
+from mantaray.scripts.campaign import (
+    MAX_REJECTIONS,
+    ROW_DONE,
+    ROW_FAILED,
+    ROW_PENDING,
+    ROW_SKIPPED,
+    ROW_SUBMITTED,
+    Campaign,
+)
+
+DOWNLOAD = "submit_download_job_direct"
+
+
+def jobs(n):
+    return [[DOWNLOAD, {"obs_id": str(i), "download_type": "vis"}] for i in range(n)]
+
+
+def states(c):
+    return [row["state"] for row in c.rows]
+
+
+def ready_item(job_id, size):
+    return {"row": {"id": job_id, "product": {"files": [{"size": size}]}}}
+
+
+def test_window(tmp_path):
+    c = Campaign(str(tmp_path / "c.json"), jobs(3), max_in_flight=2)
+
+    assert c.next_row() == (0, jobs(3)[0])
+    assert not c.submitted(0, [10], None)
+    assert c.next_row() == (1, jobs(3)[1])
+    assert not c.submitted(1, [11], None)
+    # Two jobs in flight, the window is full
+    assert c.next_row() is None
+    assert states(c) == [ROW_SUBMITTED, ROW_SUBMITTED, ROW_PENDING]
+
+    c.update([11])
+    assert states(c) == [ROW_DONE, ROW_SUBMITTED, ROW_PENDING]
+    assert c.next_row() == (2, jobs(3)[2])
+    assert not c.submitted(2, [12], None)
+
+    c.failed(11, "it broke")
+    c.update([])
+    assert states(c) == [ROW_DONE, ROW_FAILED, ROW_DONE]
+    assert c.rows[1]["error"] == "it broke"
+    assert c.next_row() is None
+    assert not c.remaining()
+    assert c.counts()[ROW_DONE] == 2
+
+
+def test_skipped(tmp_path):
+    c = Campaign(str(tmp_path / "c.json"), jobs(2))
+    assert not c.submitted(0, [], 0)
+    assert not c.submitted(1, [], 2)
+    assert states(c) == [ROW_SKIPPED, ROW_SKIPPED]
+    assert not c.remaining()
+
+
+def test_rejected_backs_off_then_fails(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(campaign_module.time, "monotonic", lambda: now[0])
+    c = Campaign(str(tmp_path / "c.json"), jobs(1))
+
+    for _ in range(MAX_REJECTIONS - 1):
+        assert c.submitted(0, [], 1)
+        assert states(c) == [ROW_PENDING]
+        assert c.next_row() is None
+        assert c.retry_in() == campaign_module.REJECT_BACKOFF
+        now[0] += campaign_module.REJECT_BACKOFF
+        assert c.retry_in() is None
+        assert c.next_row() == (0, jobs(1)[0])
+
+    assert not c.submitted(0, [], 1)
+    assert states(c) == [ROW_FAILED]
+
+
+def test_pending_bytes(tmp_path):
+    c = Campaign(str(tmp_path / "c.json"), jobs(2), max_pending_bytes=100)
+    download_queue = Queue()
+    watched = c.watch(download_queue)
+
+    c.submitted(0, [10], None)
+    watched.put(ready_item(10, 150))
+    assert download_queue.get_nowait()["row"]["id"] == 10
+    assert c.next_row() is None
+
+    c.update([])
+    assert c.next_row() == (1, jobs(2)[1])
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "c.json")
+    c = Campaign(path, jobs(3))
+    c.submitted(0, [10], None)
+    c.submitted(1, [11], None)
+    c.update([11])
+    c.save()
+
+    resumed = Campaign(path, jobs(3))
+    assert states(resumed) == [ROW_DONE, ROW_SUBMITTED, ROW_PENDING]
+    assert resumed.in_flight == {11: 1}
+    assert resumed.next_row() == (2, jobs(3)[2])
+
+
+def test_allow_resubmit_does_not_change_campaign(tmp_path):
+    path = str(tmp_path / "c.json")
+    Campaign(path, jobs(1)).save()
+    job = jobs(1)
+    job[0][1]["allow_resubmit"] = "true"
+    Campaign(path, job)
+
+
+def test_other_csv(tmp_path):
+    path = str(tmp_path / "c.json")
+    Campaign(path, jobs(2)).save()
+    with pytest.raises(Exception, match="different jobs"):
+        Campaign(path, jobs(3))
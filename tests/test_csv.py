@@ -0,0 +1,52 @@
+import pytest
+
+from mantaray.scripts.mwa_client import ParseException, expand_job, expand_value
+
+
+def expand(val, base_dir="."):
+    return list(expand_value(val, base_dir))
+
+
+def test_expand_single_and_alternatives():
+    assert expand("vis") == ["vis"]
+    assert expand("ms|uvfits") == ["ms", "uvfits"]
+
+
+def test_expand_ranges():
+    assert expand("1..3") == [1, 2, 3]
+    assert expand("0..10:5") == [0, 5, 10]
+    assert expand("-1..1|7") == [-1, 0, 1, "7"]
+
+
+@pytest.mark.parametrize("val", ["3..1", "1..3:0"])
+def test_expand_invalid_range(val):
+    with pytest.raises(ParseException):
+        expand(val)
+
+
+def test_expand_file(tmp_path):
+    (tmp_path / "obs.txt").write_text("1104585920\n\n# comment\n 1104586040 \n")
+    assert expand("@obs.txt", str(tmp_path)) == ["1104585920", "1104586040"]
+
+
+def test_expand_missing_file(tmp_path):
+    with pytest.raises(ParseException):
+        expand("@missing.txt", str(tmp_path))
+
+
+def test_expand_job_product():
+    job = ["submit_conversion_job_direct", {"obs_id": "1..2", "output": "ms|uvfits"}]
+    assert list(expand_job(job, ".")) == [
+        ["submit_conversion_job_direct", {"obs_id": "1", "output": "ms"}],
+        ["submit_conversion_job_direct", {"obs_id": "1", "output": "uvfits"}],
+        ["submit_conversion_job_direct", {"obs_id": "2", "output": "ms"}],
+        ["submit_conversion_job_direct", {"obs_id": "2", "output": "uvfits"}],
+    ]
+
+
+def test_expand_job_leaves_filters_alone():
+    job = [
+        "submit_download_job_direct",
+        {"obs_id": "1", "include": "*.fits|*.zip", "allow_resubmit": "true"},
+    ]
+    assert list(expand_job(job, ".")) == [job]
@@ -0,0 +1,77 @@
+import pytest
+
+from mantaray.scripts.filters import FileFilter, FileSelection, parse_size
+
+
+@pytest.mark.parametrize(
+    "value, size",
+    [
+        ("5000", 5000),
+        ("500k", 500 * 1024),
+        ("10M", 10 * 1024 ** 2),
+        ("1.5GB", int(1.5 * 1024 ** 3)),
+        ("2GiB", 2 * 1024 ** 3),
+        (" 1t ", 1024 ** 4),
+    ],
+)
+def test_parse_size(value, size):
+    assert parse_size(value) == size
+
+
+@pytest.mark.parametrize("value", ["", "k", "-1", "10x", "1.5.2M"])
+def test_parse_size_invalid(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
+
+
+def test_include_exclude():
+    f = FileFilter(include=["*.fits", "re:_ch1[0-9]"], exclude=["*_metafits*"])
+    assert f.wants("obs_ch01.fits", 10)
+    assert f.wants("obs_ch12.zip", 10)
+    assert not f.wants("obs_ch01.zip", 10)
+    assert not f.wants("obs_metafits.fits", 10)
+
+
+def test_sizes():
+    f = FileFilter(min_size=10, max_size=20)
+    assert not f.wants("a", 9)
+    assert f.wants("a", "10")
+    assert f.wants("a", 20)
+    assert not f.wants("a", 21)
+
+
+def test_invalid_regex():
+    with pytest.raises(ValueError):
+        FileFilter(include=["re:("])
+
+
+def test_members():
+    f = FileFilter(members=["*.metafits"])
+    assert f.selects_members("obs.ZIP")
+    assert not f.selects_members("obs.tar")
+    assert f.wants_member("1104585920.metafits")
+    assert not f.wants_member("1104585920_ch01.fits")
+    assert not FileFilter().selects_members("obs.zip")
+
+
+def test_from_params_takes_defaults():
+    defaults = FileFilter(include=["*.fits"], max_size=100)
+    f = FileFilter.from_params({"exclude": "a*;b*", "min_size": "1k"}, defaults)
+    assert f.include == ["*.fits"]
+    assert f.exclude == ["a*", "b*"]
+    assert f.min_size == 1024
+    assert f.max_size == 100
+
+
+def test_selection():
+    default = FileFilter(include=["*.fits"])
+    row = FileFilter(include=["*.zip"])
+    selection = FileSelection(default)
+
+    selection.set("5", row)
+    assert selection.get(5) is row
+    assert selection.get(6) is default
+
+    selection.discard(5)
+    assert selection.get(5) is default
+    selection.discard(5)
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from mantaray.api import JobRecord, iter_job_records, iter_json_array
+
+
+def chunked(text, size):
+    data = text.encode("utf-8")
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def parse(chunks):
+    return list(iter_json_array(chunks))
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_any_chunking(size):
+    text = ' [ {"a": [1, 2]}, 12345, "x,]y" , null, true, {"é": "ü"} ] '
+    values = [v for v, _ in parse(chunked(text, size))]
+    assert values == json.loads(text)
+
+
+def test_text_is_as_sent():
+    text = '[{"a":  1},  2.5]'
+    assert parse([text.encode("utf-8")]) == [({"a": 1}, '{"a":  1}'), (2.5, "2.5")]
+
+
+def test_empty_and_null():
+    assert parse([b"[]"]) == []
+    assert parse([b" [ ] "]) == []
+    assert parse([b"nu", b"ll"]) == []
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [[b"[1, 2"], [b"{}"], [b"[1 2]"], [b"[1], 2"], [b""]],
+)
+def test_invalid(chunks):
+    with pytest.raises(ValueError):
+        parse(chunks)
+
+
+def job_item(job_id, state="completed", obs_id=1104585920):
+    return {
+        "action": "INSERT",
+        "row": {
+            "id": job_id,
+            "job_state": state,
+            "job_type": 1,
+            "job_params": {"obs_id": obs_id},
+            "product": {"files": [{"url": "http://host/f.zip", "size": 10}]},
+        },
+    }
+
+
+def test_job_records():
+    items = [job_item(1), job_item(2, "error", 1104586040)]
+    records = list(iter_job_records(chunked(json.dumps(items), 5)))
+
+    assert [(r.id, r.state, r.job_type, r.obs_id, r.action) for r in records] == [
+        (1, "completed", 1, 1104585920, "INSERT"),
+        (2, "error", 1, 1104586040, "INSERT"),
+    ]
+    assert [r.item for r in records] == items
+
+
+def test_job_record_from_item():
+    item = job_item("7")
+    record = JobRecord.from_item(item)
+    assert record.id == 7
+    assert record.item == item
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from mantaray.scripts.layout import OutputLayout, shard_of
+
+
+def job_item(job_id=7, obs_id=1104585920, job_type=0):
+    return {
+        "row": {"id": job_id, "job_type": job_type, "job_params": {"obs_id": obs_id}}
+    }
+
+
+def test_fields(tmp_path):
+    layout = OutputLayout("/{job_type}/{shard}/{obs_id}/{job_id}/")
+    path = layout.job_dir(str(tmp_path), job_item())
+    assert path == os.path.join(
+        str(tmp_path), "conversion", shard_of("1104585920"), "1104585920", "7"
+    )
+    assert os.path.isdir(path)
+
+
+def test_obs_id_format_spec(tmp_path):
+    # The server sends obs_id as a number
+    layout = OutputLayout("{obs_id:.6}")
+    path = layout.job_dir(str(tmp_path), job_item(), create=False)
+    assert path == os.path.join(str(tmp_path), "110458")
+    assert not os.path.exists(path)
+
+
+def test_profile():
+    layout = OutputLayout("{profile}/{job_id}").for_profile("staging")
+    assert layout.job_dir("out", job_item(job_type=3), create=False) == os.path.join(
+        "out", "staging", "7"
+    )
+
+
+@pytest.mark.parametrize("template", ["{nope}", "{obs_id.x}", "{0}", "{job_id:q}"])
+def test_invalid_template(template):
+    with pytest.raises(ValueError):
+        OutputLayout(template)
+
+
+@pytest.mark.parametrize("template", ["..", "../{obs_id}", "{obs_id}/../.."])
+def test_outside_download_directory(template):
+    with pytest.raises(ValueError):
+        OutputLayout(template)
+
+
+def test_create_error(tmp_path):
+    (tmp_path / "7").write_text("")
+    layout = OutputLayout("{job_id}")
+    with pytest.raises(OSError):
+        layout.job_dir(str(tmp_path), job_item())
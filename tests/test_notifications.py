@@ -0,0 +1,44 @@
+from mantaray.scripts.mwa_client import coalesce_notifications
+
+
+def note(job_id, state, action="UPDATE"):
+    return {"action": action, "row": {"id": job_id, "job_state": state}}
+
+
+def summary(items):
+    return [(i["row"]["id"], i["action"], i["row"]["job_state"]) for i in items]
+
+
+def test_keeps_latest_intermediate_state():
+    items = [note(1, "queued"), note(2, "queued"), note(1, "staging"), note(1, "staged")]
+    assert summary(coalesce_notifications(items)) == [
+        (1, "UPDATE", "staged"),
+        (2, "UPDATE", "queued"),
+    ]
+
+
+def test_terminal_states_kept_in_order():
+    items = [
+        note(1, "staging"),
+        note(2, "error"),
+        note(1, "completed"),
+        note(3, "queued"),
+        note(3, "cancelled"),
+        note(4, "queued", "DELETE"),
+    ]
+    assert summary(coalesce_notifications(items)) == [
+        (2, "UPDATE", "error"),
+        (1, "UPDATE", "completed"),
+        (3, "UPDATE", "cancelled"),
+        (4, "DELETE", "queued"),
+    ]
+
+
+def test_nothing_after_terminal_state():
+    # A late intermediate state must not undo the terminal one
+    items = [note(1, "completed"), note(1, "delivering")]
+    assert summary(coalesce_notifications(items)) == [(1, "UPDATE", "completed")]
+
+
+def test_empty():
+    assert coalesce_notifications([]) == []
@@ -0,0 +1,52 @@
+import json
+
+from mantaray.api import JobRecord
+from mantaray.scripts.recording import (
+    RECORD_JOB,
+    RECORD_JOBS_END,
+    Recorder,
+    RecordingSession,
+)
+
+
+class FakeSession(object):
+    def __init__(self, items):
+        self._items = items
+
+    def iter_jobs(self):
+        for item in self._items:
+            yield JobRecord.from_item(item)
+
+
+def job_item(job_id):
+    return {
+        "row": {
+            "id": job_id,
+            "job_state": "completed",
+            "job_type": 1,
+            "job_params": {"obs_id": 1},
+        }
+    }
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f][1:]
+
+
+def test_iter_jobs_records_each_job_as_it_is_read(tmp_path):
+    path = str(tmp_path / "rec.jsonl")
+    recorder = Recorder(path)
+    session = RecordingSession(FakeSession([job_item(1), job_item(2)]), recorder)
+
+    jobs = session.iter_jobs()
+    assert next(jobs).id == 1
+    assert [r["type"] for r in read_records(path)] == [RECORD_JOB]
+
+    assert [r.id for r in jobs] == [2]
+    recorder.close()
+
+    records = read_records(path)
+    assert [r["type"] for r in records] == [RECORD_JOB, RECORD_JOB, RECORD_JOBS_END]
+    assert [json.loads(r["data"]) for r in records[:2]] == [job_item(1), job_item(2)]
+    assert records[2]["data"] == 2
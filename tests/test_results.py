@@ -0,0 +1,68 @@
+import json
+
+from mantaray.scripts.mwa_client import Result
+from mantaray.scripts.results import ResultLog
+
+
+def error(job_id, path=None, profile=None):
+    return Result(
+        job_id,
+        "1104585920",
+        "\x1b[31mfailed\x1b[0m",
+        "Job {0} failed".format(job_id),
+        path,
+        profile,
+    )
+
+
+def test_errfile_matches_json_dumps(tmp_path):
+    errfile = str(tmp_path / "errors.json")
+    log = ResultLog(errfile=errfile)
+    log.add(error(1))
+    log.add(error(2, "/data/2/file.zip", "staging"))
+    log.close()
+
+    expected = [
+        {"job_id": 1, "obs_id": "1104585920", "result": "Job 1 failed"},
+        {
+            "job_id": 2,
+            "obs_id": "1104585920",
+            "result": "Job 2 failed",
+            "path": "/data/2/file.zip",
+            "profile": "staging",
+        },
+    ]
+    with open(errfile) as f:
+        text = f.read()
+    assert json.loads(text) == expected
+    assert text == json.dumps(expected, indent=4)
+
+
+def test_errfile_empty(tmp_path):
+    errfile = tmp_path / "errors.json"
+    log = ResultLog(errfile=str(errfile))
+    log.close()
+    assert errfile.read_text() == ""
+
+
+def test_results_file(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    errfile = str(tmp_path / "errors.json")
+    log = ResultLog(path, errfile, sync_every=1)
+    log.add(error(1))
+
+    with open(path) as f:
+        assert [json.loads(line)["job_id"] for line in f] == [1]
+    with open(path + ".summary.json") as f:
+        assert json.load(f)["errors"] == 1
+
+    log.close(finished=True)
+    # Closing again, as at exit, changes nothing
+    log.close()
+    log.add(error(2))
+
+    with open(path + ".summary.json") as f:
+        summary = json.load(f)
+    assert summary["finished"] and summary["errors"] == 1
+    with open(errfile) as f:
+        assert len(json.load(f)) == 1
@@ -0,0 +1,68 @@
+from mantaray.api import validate_job
+
+CONVERSION = "submit_conversion_job_direct"
+DOWNLOAD = "submit_download_job_direct"
+VOLTAGE = "submit_voltage_job_direct"
+
+
+def test_valid_jobs():
+    assert validate_job(CONVERSION, {"obs_id": "1104585920"}) == []
+    assert (
+        validate_job(
+            CONVERSION,
+            {
+                "obs_id": "1104585920",
+                "avg_time_res": "0.5",
+                "avg_freq_res": "80",
+                "output": "uvfits",
+                "no_rfi": "TRUE",
+            },
+        )
+        == []
+    )
+    assert validate_job(DOWNLOAD, {"obs_id": "1", "download_type": "vis"}) == []
+    assert (
+        validate_job(VOLTAGE, {"obs_id": "1", "offset": "0", "duration": "8"}) == []
+    )
+
+
+def test_unknown_job_type():
+    assert validate_job("submit_nothing", {}) == ["unknown job type submit_nothing"]
+
+
+def test_required_and_unknown_params():
+    errors = validate_job(DOWNLOAD, {"obs_id": "1", "avg_frq_res": "80"})
+    assert errors == ["download_type is required", "unknown parameter avg_frq_res"]
+
+
+def test_types_and_ranges():
+    errors = validate_job(
+        CONVERSION,
+        {
+            "obs_id": "abc",
+            "avg_time_res": "0",
+            "avg_freq_res": "x",
+            "output": "fits",
+            "apply_di_cal": "yes",
+            "phase_centre_dec": "91",
+        },
+    )
+    assert errors == [
+        "obs_id=abc must be an integer",
+        "avg_time_res=0 must be greater than 0",
+        "avg_freq_res=x must be an integer",
+        "output=fits must be one of ms, uvfits",
+        "apply_di_cal=yes must be true or false",
+        "phase_centre_dec=91 must be at most 90",
+    ]
+    assert validate_job(VOLTAGE, {"obs_id": "1", "offset": "-1", "duration": "0"}) == [
+        "offset=-1 must be at least 0",
+        "duration=0 must be at least 1",
+    ]
+
+
+def test_custom_centre_needs_coordinates():
+    errors = validate_job(
+        CONVERSION, {"obs_id": "1", "centre": "custom", "phase_centre_ra": "10"}
+    )
+    assert errors == ["phase_centre_dec is required when centre=custom"]
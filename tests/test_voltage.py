@@ -0,0 +1,35 @@
+from mantaray.scripts.voltage import VOLTAGE_JOB, split_voltage_job
+
+
+def voltage(offset, duration):
+    return [VOLTAGE_JOB, {"obs_id": "1", "offset": str(offset), "duration": str(duration)}]
+
+
+def spans(parts):
+    return [(int(p["offset"]), int(p["duration"])) for _, p in parts]
+
+
+def test_split():
+    parts = split_voltage_job(voltage(10, 25), 10)
+    assert spans(parts) == [(10, 10), (20, 10), (30, 5)]
+    assert all(p["obs_id"] == "1" and t == VOLTAGE_JOB for t, p in parts)
+
+
+def test_exact_multiple():
+    assert spans(split_voltage_job(voltage(0, 20), 10)) == [(0, 10), (10, 10)]
+
+
+def test_short_job_unchanged():
+    job = voltage(0, 10)
+    assert split_voltage_job(job, 10) == [job]
+
+
+def test_other_jobs_unchanged():
+    job = ["submit_download_job_direct", {"obs_id": "1", "download_type": "vis"}]
+    assert split_voltage_job(job, 1) == [job]
+
+
+def test_original_untouched():
+    job = voltage(0, 30)
+    split_voltage_job(job, 10)
+    assert job == voltage(0, 30)